@@ -1,4 +1,7 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import (
+    Blueprint, Flask, Response, render_template, request, jsonify, session, redirect, url_for, send_file,
+    stream_with_context
+)
 from flask_cors import CORS
 import json
 import os
@@ -9,36 +12,211 @@ import time
 from auth import GooglePhotosAuth
 from photos_api import GooglePhotosAPI
 from direct_auth import DirectOAuth
-from config import SECRET_KEY, FLASK_ENV, AUTH_BASE_URL
+from http_session import get_transport
+from coalesce import get_single_flight
+from rate_limiter import INTERACTIVE, BACKGROUND, get_rate_limiter
+from state_store import get_state_store
+from token_store import get_token_store
+from media_index import LOCAL_PAGE_PREFIX, get_media_index, start_background_sync, remove_media_index
+from image_cache import ImageCache, display_size, negotiate_format
+from media_item import MediaItem, dumps_page, page_urls
+from prefetch import PrefetchScheduler
+from video_proxy import VideoProxy
+from response_cache import ResponseCache
+from playlist import WEIGHTS, Playlist, PlaylistCursor
+from merged_feed import POLICIES, FeedCursor, MergedFeed
+from dedupe import start_background_dedupe, is_deduping
+from mirror import MIRROR_PAGE_PREFIX, get_mirror, start_background_mirror
+from search_index import FACETS, get_search_index, parse_page_token, remove_search_index
+from sync_groups import ACTIONS, GROUP_NAME_PATTERN, group_status, list_groups, remove_group, save_group, send_command
+from compression import choose_encoding, compress, content_etag
+from metrics import CONTENT_TYPE, callback, get_registry, instrument_app
+from config import (
+    SECRET_KEY, FLASK_ENV, AUTH_BASE_URL, BASE_URL_MAX_AGE,
+    MEDIA_PROXY_ENABLED, MEDIA_MASTER_SIZE, MEDIA_MAX_DIMENSION, MEDIA_CACHE_MAX_AGE,
+    SERVER_HOST, SERVER_PORT, PLAYLIST_BATCH_SIZE, PLAYLIST_MAX_BATCH, MAX_IMAGES_PER_PAGE, DEDUPE_ENABLED,
+    METRICS_ENABLED, OFFLINE_MODE, SEARCH_MAX_RESULTS, DEFAULT_SLIDESHOW_SPEED, PREFETCH_MAX_LOOKAHEAD,
+    SYNC_HUB_ENABLED, SYNC_PORT, SYNC_PUBLIC_URL, SYNC_BATCH_SIZE, SERVER_PROCESSES
+)
 
-app = Flask(__name__)
-app.secret_key = SECRET_KEY
-CORS(app)
+# Routes live on a blueprint so create_app() can build the app on demand
+bp = Blueprint('slideshow', __name__)
 
-# Initialize auth handlers
-try:
-    auth_handler = GooglePhotosAuth()
-except ValueError as e:
-    print(f"Warning: {e}")
-    auth_handler = None
+# Process-wide services, built once by _init_services()
+transport = None
+auth_handler = None
+direct_auth = None
+image_cache = None
+video_proxy = None
+prefetcher = None
+album_cache = None
+merged_feed = None
+auth_sessions = None
+_services_ready = False
+_services_lock = threading.Lock()
 
-direct_auth = DirectOAuth()
+def _init_services():
+    """
+    Build the services every route shares, once per process
+    This opens the state store, scans the image cache and starts the token
+    refresher, none of which the slideshow page itself needs. create_app()
+    runs it on a background thread so the server answers while it works.
+    """
+    global transport, auth_handler, direct_auth, image_cache, video_proxy, prefetcher, album_cache, merged_feed, \
+        auth_sessions, _services_ready
+    if _services_ready:
+        return
+    with _services_lock:
+        if _services_ready:
+            return
 
-# Store active authentication sessions
-auth_sessions = {}
+        # All outbound HTTP shares one pooled keep-alive transport
+        transport = get_transport()
 
-@app.route('/')
+        try:
+            auth_handler = GooglePhotosAuth(transport)
+            auth_handler.start_refresher()
+        except ValueError as e:
+            print(f"Warning: {e}")
+            auth_handler = None
+
+        direct_auth = DirectOAuth(transport)
+
+        # Images are proxied through a local resized-image cache
+        image_cache = ImageCache(transport=transport)
+
+        # Videos stream through the server, starting from a cached head of each clip
+        video_proxy = VideoProxy(transport=transport)
+
+        # Warms the image cache and video heads ahead of each display's position
+        prefetcher = PrefetchScheduler(image_cache, video_proxy)
+
+        # Album listings change rarely; displays on the same account share them
+        # Album listings are shared through the state store when several workers serve the app
+        album_cache = ResponseCache(namespace='album_responses' if SERVER_PROCESSES > 1 else None)
+
+        # Fans page fetches out across accounts for the merged feed
+        merged_feed = MergedFeed()
+
+        # Store active authentication sessions (shared by every server worker)
+        auth_sessions = get_state_store().namespace('auth_sessions', ttl=30 * 60)
+
+        if SYNC_HUB_ENABLED:
+            # aiohttp stays off the startup path; one worker serves the hub on its own port
+            from sync_hub import SyncHub, start_sync_hub
+            start_sync_hub(SyncHub(_sync_slides, _sync_warm))
+
+        if METRICS_ENABLED:
+            callback('cache_lookups_total', 'Cache lookups by cache and result', 'counter', ('cache', 'result'),
+                     _cache_lookups)
+            callback('cache_entries', 'Entries held per cache', 'gauge', ('cache',), _cache_entries)
+            callback('media_cache_bytes', 'Bytes held in the proxied image cache', 'gauge', (),
+                     lambda: [((), image_cache.stats()['bytes'])])
+            callback('video_cache_bytes', 'Bytes of cached video heads', 'gauge', (),
+                     lambda: [((), video_proxy.stats()['bytes'])])
+
+        _services_ready = True
+
+def _cache_lookups():
+    """Lookup counts of every cache, read from their stats() at scrape time"""
+    caches = {
+        'albums': album_cache.stats(),
+        'feed_pages': merged_feed.stats()['page_cache'],
+        'media': image_cache.stats(),
+        'video': video_proxy.stats(),
+        'prefetch': prefetcher.stats()
+    }
+    for name, stats in caches.items():
+        yield (name, 'hit'), stats['hits']
+        yield (name, 'miss'), stats['misses']
+        if 'stale_hits' in stats:
+            yield (name, 'stale_hit'), stats['stale_hits']
+
+def _cache_entries():
+    yield ('albums',), album_cache.stats()['entries']
+    yield ('feed_pages',), merged_feed.stats()['page_cache']['entries']
+    yield ('media',), image_cache.stats()['entries']
+    yield ('video',), video_proxy.stats()['entries']
+
+def _sync_slides(settings, cursor):
+    """
+    Next slides of a sync group's shuffled playlist, for the sync hub
+    Returns: (MediaItems, cursor), or None until the account is indexed
+    """
+    if OFFLINE_MODE:
+        return None
+    user_id = settings['user_id']
+    creds = auth_handler.read_credentials(user_id) if auth_handler else None
+    if not creds:
+        return None
+    index = get_media_index(user_id)
+    if not index.is_complete():
+        _start_sync(user_id)
+        return None
+    
+    playlist = Playlist(index)
+    playlist_cursor = PlaylistCursor.decode(cursor, index.max_seq()) if cursor else None
+    if playlist_cursor is None:
+        playlist_cursor = playlist.start(settings.get('seed'))
+    result = playlist.next_batch(
+        playlist_cursor, SYNC_BATCH_SIZE, settings['type'],
+        weights=settings['weights'], exclude_duplicates=settings['dedupe']
+    )
+    index.refresh_base_urls(result, GooglePhotosAPI(creds['token'], transport, account=user_id, priority=BACKGROUND))
+    return result['mediaItems'], result['cursor']
+
+def _sync_warm(name, settings, position, items, variants):
+    """Warm the image cache and video heads for a sync group's next slides, once per slide variant"""
+    user_id = settings['user_id']
+    if not settings.get('media'):
+        return  # displays load images straight from Google
+    item_ids = [item.id for item in items]
+    videos = [item.id for item in items if item.type == 'video']
+    try:
+        for variant in variants:
+            width, height, image_format = variant or (*MEDIA_MASTER_SIZE, 'jpeg')
+            prefetcher.report_position(
+                f'sync:{name}:{width}x{height}.{image_format}', (user_id, 'sync', name), position, item_ids,
+                lambda item_id: _base_url_provider(user_id, item_id, BACKGROUND), width, height,
+                lookahead=len(item_ids), image_format=image_format, videos=videos
+            )
+    except Exception as e:
+        print(f'Error warming sync group {name}: {e}')
+
+def create_app() -> Flask:
+    """
+    Build the Flask application
+    Returns as soon as the routes are registered; shared services are built
+    on a background thread, and any request other than the slideshow page
+    waits for them.
+    Returns: the app
+    """
+    app = Flask(__name__)
+    app.secret_key = SECRET_KEY
+    CORS(app)
+    app.register_blueprint(bp)
+    if METRICS_ENABLED:
+        instrument_app(app)
+    threading.Thread(target=_init_services, daemon=True, name='init-services').start()
+    return app
+
+@bp.before_app_request
+def _wait_for_services():
+    if not _services_ready and request.endpoint not in ('slideshow.index', 'static'):
+        _init_services()
+
+@bp.route('/')
 def index():
     """Main slideshow page"""
     return render_template('index.html')
 
-@app.route('/api/accounts')
+@bp.route('/api/accounts')
 def get_accounts():
     """Get list of authenticated accounts"""
     accounts = auth_handler.get_all_accounts()
     return jsonify(accounts)
 
-@app.route('/api/auth/start', methods=['POST'])
+@bp.route('/api/auth/start', methods=['POST'])
 def start_auth():
     """Start OAuth authentication process"""
     # Use direct OAuth instead of device flow
@@ -48,7 +226,7 @@ def start_auth():
         'method': 'direct'
     })
 
-@app.route('/auth/callback')
+@bp.route('/auth/callback')
 def auth_callback():
     """Handle OAuth callback"""
     code = request.args.get('code')
@@ -66,10 +244,6 @@ def auth_callback():
         return jsonify({'error': 'Failed to get user info'}), 500
     
     # Save credentials (similar to auth_handler)
-    from pathlib import Path
-    import json
-    from datetime import datetime, timedelta
-    
     user_id = user_info['id']
     email = user_info['email']
     
@@ -82,45 +256,105 @@ def auth_callback():
         'expiry': datetime.utcnow() + timedelta(seconds=token_data.get('expires_in', 3600))
     }
     
-    # Save to file
-    token_file = Path('data/tokens') / f"{user_id}.json"
-    token_file.parent.mkdir(parents=True, exist_ok=True)
-    
-    with open(token_file, 'w') as f:
-        json.dump(credentials, f, default=str)
-    
+    get_token_store().save(user_id, credentials)
     return redirect('/?success=true')
 
-@app.route('/api/auth/check/<session_id>')
+@bp.route('/api/auth/check/<session_id>')
 def check_auth(session_id):
     """Check authentication status (legacy - not used with direct OAuth)"""
     return jsonify({'status': 'not_used'})
 
-@app.route('/api/auth/remove/<user_id>', methods=['DELETE'])
+@bp.route('/api/auth/remove/<user_id>', methods=['DELETE'])
 def remove_account(user_id):
     """Remove an account"""
+    # Credentials go first, so the account's index sync and dedupe run stop at their next page
     success = auth_handler.remove_account(user_id)
+    remove_media_index(user_id)
+    remove_search_index(user_id)
+    get_mirror().remove_user(user_id)
+    album_cache.invalidate(user_id)
     if success:
         return jsonify({'message': 'Account removed successfully'})
     else:
         return jsonify({'error': 'Account not found'}), 404
 
-@app.route('/api/photos/<user_id>')
-def get_photos(user_id):
-    """Get photos for a specific user"""
-    creds = auth_handler.read_credentials(user_id)
-    if not creds:
-        return jsonify({'error': 'Account not found or expired'}), 404
+def _api_factory(user_id):
+    """Build a callable returning a GooglePhotosAPI with fresh credentials"""
+    def factory():
+        creds = auth_handler.read_credentials(user_id)
+        return GooglePhotosAPI(creds['token'], transport, account=user_id, priority=BACKGROUND) if creds else None
+    return factory
+
+def _start_sync(user_id, force=False):
+    """
+    Start a background index sync, unless the account was synced recently (or force)
+    Once it finishes, new photos are hashed for duplicates and mirrored
+    albums are brought up to date.
+    """
+    factory = _api_factory(user_id)
     
-    api = GooglePhotosAPI(creds['token'])
+    def on_complete(added):
+        if DEDUPE_ENABLED:
+            start_background_dedupe(user_id, factory)
+        if get_mirror().albums(user_id):
+            start_background_mirror(user_id, factory)
     
-    # Get query parameters
-    page_token = request.args.get('page_token')
-    media_type = request.args.get('type', 'image')
-    album_id = request.args.get('album_id')
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    favorites_only = request.args.get('favorites', 'false').lower() == 'true'
+    return start_background_sync(user_id, factory, on_complete, force)
+
+def _media_url_prefix(user_id):
+    """URL prefix of the local media proxy for a user, or None when proxying is off"""
+    if not MEDIA_PROXY_ENABLED and not OFFLINE_MODE:
+        return None
+    # Build the route once with a placeholder id rather than calling url_for per item
+    return url_for('.get_media', user_id=user_id, item_id='_')[:-1]
+
+def _display_size(viewport=None):
+    """
+    Size ladder rung for the viewport a client reports (vw, vh in CSS pixels, dpr)
+    Returns: (width, height), or None when no viewport was reported
+    """
+    viewport = request.args if viewport is None else viewport
+    try:
+        width, height = float(viewport['vw']), float(viewport['vh'])
+        dpr = float(viewport.get('dpr', 1))
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+    if not (0 < width < 100000 and 0 < height < 100000):
+        return None
+    return display_size(width, height, dpr)
+
+def _compact():
+    """Whether the client asked for the compact wire format (compact=true)"""
+    return request.args.get('compact', 'false').lower() == 'true'
+
+def _json_page(body):
+    """
+    Send a JSON body compressed as the client prefers, with a strong ETag
+    The tag is checked before compressing, so a client re-polling an
+    unchanged page gets an empty 304 for the price of one digest.
+    """
+    data = body.encode()
+    encoding = choose_encoding(request.accept_encodings, len(data))
+    etag = content_etag(data, encoding)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(compress(data, encoding), mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    # Pages change as libraries sync, so clients revalidate every time instead of trusting a max age
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response
+
+def _accepted_types():
+    return [part.split(';')[0].strip() for part in request.headers.get('Accept', '').split(',')]
+
+def _fetch_upstream_page(api, source, page_token):
+    """Fetch one page of media items from Google for a (user, album, filters) source"""
+    _, album_id, media_type, start_date, end_date, favorites_only = source
     
     # Build filters
     filters = {}
@@ -136,68 +370,647 @@ def get_photos(user_id):
     
     # Get media items
     if album_id:
-        result = api.get_album_media(album_id, page_token)
+        return api.get_album_media(album_id, page_token)
     elif filters:
-        result = api.search_media_items(filters, page_token)
+        return api.search_media_items(filters, page_token)
     else:
-        result = api.get_media_items(page_token)
+        return api.get_media_items(page_token)
+
+def _base_url_provider(user_id, item_id, priority=INTERACTIVE):
+    """Build a callable that finds a usable baseUrl for an item, only when needed"""
+    def provider():
+        indexed = get_media_index(user_id).get_item(item_id)
+        if indexed and time.time() - indexed['fetchedAt'] < BASE_URL_MAX_AGE:
+            return indexed['baseUrl']
+        creds = auth_handler.read_credentials(user_id)
+        if not creds:
+            return None
+        api = GooglePhotosAPI(creds['token'], transport, account=user_id, priority=priority)
+        return api.get_media_item(item_id).get('baseUrl')
+    return provider
+
+def _source_from_args(user_id):
+    """Build the (user, album, filters) source tuple from the query string"""
+    return (
+        user_id,
+        request.args.get('album_id'),
+        request.args.get('type', 'image'),
+        request.args.get('start_date'),
+        request.args.get('end_date'),
+        request.args.get('favorites', 'false').lower() == 'true'
+    )
+
+def _dates_valid(*dates):
+    """
+    Check optional start/end dates before they reach a date filter
+    Returns: True when every date given is a real YYYY-MM-DD day
+    """
+    for date in dates:
+        if date:
+            try:
+                datetime.strptime(date, '%Y-%m-%d')
+            except ValueError:
+                return False
+    return True
+
+def _search_from_args():
+    """
+    Search words (q) and facet filters from the query string
+    Facets other than type may be repeated to allow several values; type
+    stays the single media type filter every photo listing takes.
+    Returns: dict with text and filters, or None when nothing is searched for
+    """
+    text = request.args.get('q', '').strip()
+    filters = {name: request.args.getlist(name) for name in FACETS if name != 'type' and name in request.args}
+    if not text and not filters:
+        return None
+    return {'text': text, 'filters': filters}
+
+def _search_page(api, source, page_token, dedupe, search):
+    """One page of local search results for a source, resolved to MediaItems from the index"""
+    user_id, _, media_type, start_date, end_date, favorites_only = source
+    filters = dict(search['filters'])
+    if media_type != 'all':
+        filters['type'] = [media_type]
+    result = get_search_index(user_id).search(
+        search['text'], filters, start_date, end_date, favorites_only, dedupe, page_token
+    )
+    page = get_media_index(user_id).items_by_id(result['ids'])
+    get_media_index(user_id).refresh_base_urls(page, api)
+    return {'mediaItems': page['mediaItems'], 'nextPageToken': result['nextPageToken']}
+
+def _mirror_page(source, page_token):
+    """Fetch one page from the offline mirror; it doesn't track favorites, so that filter is ignored"""
+    user_id, album_id, media_type, start_date, end_date, _ = source
+    return get_mirror().query_page(user_id, album_id, media_type, start_date, end_date, page_token)
+
+def _fetch_page(api, source, page_token, dedupe=False, search=None):
+    """
+    Fetch one raw page of media items for a source
+    Served from the local index when it covers the request, otherwise from
+    a prefetched page or live from Google. dedupe leaves out photos already
+    known to be near-duplicates of another one. search (from
+    _search_from_args) is answered by the local search index, over whatever
+    has been indexed so far; albums are not searchable. When Google can't be
+    reached, a first page falls back to the offline mirror.
+    Returns: dict with MediaItems under mediaItems and nextPageToken, or {} on failure
+    """
+    user_id, album_id, media_type, start_date, end_date, favorites_only = source
+    if page_token and page_token.startswith(MIRROR_PAGE_PREFIX):
+        return _mirror_page(source, page_token)
+    
+    index = get_media_index(user_id)
+    if search is not None and not album_id:
+        if not index.is_complete() or page_token is None:
+            _start_sync(user_id)
+        return _search_page(api, source, page_token, dedupe, search)
     
+    local_token = page_token is None or page_token.startswith(LOCAL_PAGE_PREFIX)
+    if not album_id and not favorites_only and local_token and index.is_complete():
+        if page_token is None:
+            _start_sync(user_id)
+        
+        result = index.query_page(media_type, start_date, end_date, page_token, exclude_duplicates=dedupe)
+        index.refresh_base_urls(result, api)
+        return {'mediaItems': result['mediaItems'], 'nextPageToken': result['nextPageToken']}
+    
+    if not index.is_complete():
+        _start_sync(user_id)
+    
+    result = page_token and prefetcher.take_page(source, page_token)
+    result = result or _fetch_upstream_page(api, source, page_token)
+    if not result:
+        if MEDIA_PROXY_ENABLED and page_token is None and get_mirror().has_items(user_id):
+            print(f'Serving {user_id} from the offline mirror')
+            return _mirror_page(source, None)
+        return {}
+    media_items = MediaItem.from_page(result.get('mediaItems', []))
+    if dedupe:
+        duplicates = index.duplicate_ids([item.id for item in media_items])
+        media_items = [item for item in media_items if item.id not in duplicates]
+    return {
+        'mediaItems': media_items,
+        'nextPageToken': result.get('nextPageToken')
+    }
+
+@bp.route('/api/photos/<user_id>')
+def get_photos(user_id):
+    """Get photos for a specific user"""
+    # Get query parameters
+    page_token = request.args.get('page_token')
+    source = _source_from_args(user_id)
+    dedupe = request.args.get('dedupe', 'false').lower() == 'true'
+    if not _dates_valid(source[3], source[4]):
+        return jsonify({'error': 'Invalid date'}), 400
+    
+    if OFFLINE_MODE:
+        # No credentials needed: nothing is fetched from Google
+        try:
+            result = _mirror_page(source, page_token)
+        except ValueError:
+            return jsonify({'error': 'Invalid page token'}), 400
+    else:
+        creds = auth_handler.read_credentials(user_id)
+        if not creds:
+            return jsonify({'error': 'Account not found or expired'}), 404
+        
+        api = GooglePhotosAPI(creds['token'], transport, account=user_id)
+        try:
+            result = _fetch_page(api, source, page_token, dedupe, _search_from_args())
+        except ValueError:
+            return jsonify({'error': 'Invalid page token'}), 400
     if not result:
         return jsonify({'error': 'Failed to fetch photos'}), 500
     
-    # Process media items
-    media_items = result.get('mediaItems', [])
-    processed_items = []
+    return _json_page(dumps_page(
+        result['mediaItems'], result['nextPageToken'], _media_url_prefix(user_id), _display_size(), _compact()
+    ))
+
+@bp.route('/api/photos/<user_id>/stream')
+def stream_photos(user_id):
+    """
+    Stream every matching item as NDJSON, one page at a time
+    Each line is a processed media item; the last line is a trailer with
+    done, count and nextPageToken. limit stops the stream at the first page
+    boundary after that many items, so the trailer's token resumes cleanly.
+    """
+    if not auth_handler.read_credentials(user_id):
+        return jsonify({'error': 'Account not found or expired'}), 404
     
-    for item in media_items:
-        mime_type = item.get('mimeType', '')
-        item_type = mime_type.split('/')[0] if mime_type else 'unknown'
-        
-        processed_item = {
-            'id': item['id'],
-            'filename': item['filename'],
-            'mimeType': mime_type,
-            'type': item_type,
-            'baseUrl': item['baseUrl'],
-            'description': item.get('description', ''),
-            'creationTime': item.get('mediaMetadata', {}).get('creationTime', '')
-        }
-        
-        # Add appropriate URLs based on type
-        if item_type == 'image':
-            processed_item['displayUrl'] = api.build_image_url(item['baseUrl'])
-            processed_item['thumbnailUrl'] = api.build_thumbnail_url(item['baseUrl'])
-        elif item_type == 'video':
-            processed_item['videoUrl'] = api.build_video_url(item['baseUrl'])
-            processed_item['thumbnailUrl'] = api.build_thumbnail_url(item['baseUrl'])
-        
-        processed_items.append(processed_item)
+    source = _source_from_args(user_id)
+    if not _dates_valid(source[3], source[4]):
+        return jsonify({'error': 'Invalid date'}), 400
+    page_token = request.args.get('page_token')
+    limit = request.args.get('limit', type=int)
+    dedupe = request.args.get('dedupe', 'false').lower() == 'true'
+    search = _search_from_args()
+    media_url_prefix = _media_url_prefix(user_id)
+    size = _display_size()
     
-    return jsonify({
-        'mediaItems': processed_items,
-        'nextPageToken': result.get('nextPageToken')
-    })
+    def generate():
+        token = page_token
+        count = 0
+        while True:
+            # Re-read credentials per page so long streams survive token refreshes
+            creds = auth_handler.read_credentials(user_id)
+            if not creds:
+                yield json.dumps({'error': 'Account not found or expired', 'nextPageToken': token}) + '\n'
+                return
+            
+            api = GooglePhotosAPI(creds['token'], transport, account=user_id)
+            try:
+                result = _fetch_page(api, source, token, dedupe, search)
+            except ValueError:
+                yield json.dumps({'error': 'Invalid page token', 'nextPageToken': token}) + '\n'
+                return
+            if not result:
+                yield json.dumps({'error': 'Failed to fetch photos', 'nextPageToken': token}) + '\n'
+                return
+            
+            items = result['mediaItems']
+            count += len(items)
+            yield ''.join(
+                json.dumps(item.to_dict(media_url_prefix, size), separators=(',', ':')) + '\n' for item in items
+            )
+            
+            token = result['nextPageToken']
+            if not token or (limit is not None and count >= limit):
+                yield json.dumps({'done': True, 'count': count, 'nextPageToken': token}) + '\n'
+                return
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
-@app.route('/api/albums/<user_id>')
+@bp.route('/api/feed')
+def get_feed():
+    """
+    Get one page of a feed merged across several accounts
+    accounts is a comma-separated list of user IDs (all accounts by default);
+    policy is 'time' (newest first) or 'interleave'. Accounts that are slow
+    or failing are left out of the page and listed in accounts/partial.
+    """
+    requested = [user_id for user_id in request.args.get('accounts', '').split(',') if user_id]
+    user_ids = requested or [account['user_id'] for account in auth_handler.get_all_accounts()]
+    
+    apis = {}
+    for user_id in user_ids:
+        creds = auth_handler.read_credentials(user_id)
+        if creds:
+            apis[user_id] = GooglePhotosAPI(creds['token'], transport, account=user_id)
+    if not apis:
+        return jsonify({'error': 'No valid accounts'}), 404
+    
+    policy = request.args.get('policy', 'time')
+    if policy not in POLICIES:
+        return jsonify({'error': f'Unknown policy: {policy}'}), 400
+    
+    cursor = None
+    token = request.args.get('cursor')
+    if token:
+        cursor = FeedCursor.decode(token)
+        if cursor is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    
+    # Albums belong to one account, so the merged feed filters by type and date only
+    filters = (
+        request.args.get('type', 'image'),
+        request.args.get('start_date'),
+        request.args.get('end_date'),
+        request.args.get('favorites', 'false').lower() == 'true'
+    )
+    if not _dates_valid(filters[1], filters[2]):
+        return jsonify({'error': 'Invalid date'}), 400
+    count = max(1, min(request.args.get('count', MAX_IMAGES_PER_PAGE, type=int), MAX_IMAGES_PER_PAGE))
+    result = merged_feed.next_page(
+        sorted(apis),
+        lambda user_id, page_token: _fetch_page(apis[user_id], (user_id, None) + filters, page_token),
+        cursor, count, policy, filters
+    )
+    
+    prefixes = {user_id: _media_url_prefix(user_id) for user_id in apis}
+    size = _display_size()
+    compact = _compact()
+    media_items = []
+    for user_id, item in result['items']:
+        if compact:
+            processed_item = item.to_compact_dict(prefixes[user_id] is None)
+        else:
+            processed_item = item.to_dict(prefixes[user_id], size)
+        processed_item['userId'] = user_id
+        media_items.append(processed_item)
+    
+    accounts = result['accounts']
+    for user_id in user_ids:
+        accounts.setdefault(user_id, 'not_found')
+    page = {
+        'mediaItems': media_items,
+        'cursor': result['cursor'],
+        'partial': result['partial'] or len(apis) < len(user_ids),
+        'accounts': accounts
+    }
+    if compact:
+        page['urls'] = page_urls(prefixes if any(prefixes.values()) else None, size)
+    return _json_page(json.dumps(page, separators=(',', ':')))
+
+@bp.route('/api/playlist/<user_id>')
+def get_playlist(user_id):
+    """
+    Get the next batch of a shuffled playlist over the whole indexed library
+    Pass the returned cursor back to continue; seed starts a reproducible
+    order and weight (favorites, recency) biases how often items come up.
+    """
+    if OFFLINE_MODE:
+        # The shuffle needs fresh baseUrls; the slideshow falls back to /api/photos
+        return jsonify({'error': 'Shuffled playlists are not available offline'}), 503
+    
+    creds = auth_handler.read_credentials(user_id)
+    if not creds:
+        return jsonify({'error': 'Account not found or expired'}), 404
+    
+    if not _dates_valid(request.args.get('start_date'), request.args.get('end_date')):
+        return jsonify({'error': 'Invalid date'}), 400
+    
+    index = get_media_index(user_id)
+    token = request.args.get('cursor')
+    if not index.is_complete() or token is None:
+        _start_sync(user_id)
+    if not index.is_complete():
+        return jsonify({'error': 'Media index is still syncing', **index.status()}), 503
+    
+    playlist = Playlist(index)
+    if token:
+        cursor = PlaylistCursor.decode(token, index.max_seq())
+        if cursor is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    else:
+        cursor = playlist.start(request.args.get('seed', type=int))
+    
+    count = max(1, min(request.args.get('count', PLAYLIST_BATCH_SIZE, type=int), PLAYLIST_MAX_BATCH))
+    weights = [weight for weight in request.args.get('weight', '').split(',') if weight in WEIGHTS]
+    result = playlist.next_batch(
+        cursor, count,
+        request.args.get('type', 'image'),
+        request.args.get('start_date'),
+        request.args.get('end_date'),
+        weights,
+        exclude_duplicates=request.args.get('dedupe', 'false').lower() == 'true'
+    )
+    index.refresh_base_urls(result, GooglePhotosAPI(creds['token'], transport, account=user_id))
+    
+    media_url_prefix = _media_url_prefix(user_id)
+    size = _display_size()
+    page = {
+        'cursor': result['cursor'],
+        'epoch': result['epoch'],
+        'position': result['position'],
+        'size': result['size']
+    }
+    if _compact():
+        page['mediaItems'] = [item.to_compact_dict(media_url_prefix is None) for item in result['mediaItems']]
+        page['urls'] = page_urls(media_url_prefix, size)
+    else:
+        page['mediaItems'] = [item.to_dict(media_url_prefix, size) for item in result['mediaItems']]
+    return _json_page(json.dumps(page, separators=(',', ':')))
+
+@bp.route('/media/<user_id>/<item_id>')
+def get_media(user_id, item_id):
+    """
+    Serve an image from the local cache, fetching it from Google once
+    The size comes from w and h, or from the viewport (vw, vh, dpr) snapped
+    to the size ladder; WebP or AVIF is served to clients that accept it.
+    Images Google can't provide are served from the offline mirror as stored.
+    """
+    size = None if 'w' in request.args else _display_size()
+    if size is None:
+        size = (
+            request.args.get('w', MEDIA_MASTER_SIZE[0], type=int),
+            request.args.get('h', MEDIA_MASTER_SIZE[1], type=int)
+        )
+    width = max(1, min(size[0], MEDIA_MAX_DIMENSION))
+    height = max(1, min(size[1], MEDIA_MAX_DIMENSION))
+    image_format = negotiate_format(_accepted_types())
+    
+    if OFFLINE_MODE:
+        # Sizes already in the image cache are still served; nothing is fetched
+        result = image_cache.get_image(item_id, lambda: None, width, height, image_format)
+        if result is not None:
+            return _cached_media(result)
+        return _mirrored_media(user_id, item_id) or (jsonify({'error': 'Image is not mirrored'}), 404)
+    
+    creds = auth_handler.read_credentials(user_id)
+    if not creds:
+        return _mirrored_media(user_id, item_id) or (jsonify({'error': 'Account not found or expired'}), 404)
+    
+    prefetcher.record_access(item_id, width, height, image_format)
+    result = image_cache.get_image(item_id, _base_url_provider(user_id, item_id), width, height, image_format)
+    if result is None:
+        return _mirrored_media(user_id, item_id) or (jsonify({'error': 'Failed to fetch image'}), 502)
+    return _cached_media(result)
+
+def _cached_media(result):
+    """Response for an image cache entry"""
+    
+    path, etag = result
+    # send_file resolves relative paths against the app root, not the working directory
+    response = send_file(os.path.abspath(path), conditional=True, etag=etag, max_age=MEDIA_CACHE_MAX_AGE)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.vary.add('Accept')
+    return response
+
+def _mirrored_media(user_id, item_id):
+    """Response for an image in the offline mirror, or None if it isn't mirrored"""
+    found = get_mirror().open_item(user_id, item_id)
+    if found is None:
+        return None
+    path, digest, content_type = found
+    response = send_file(
+        os.path.abspath(path), mimetype=content_type, conditional=True, etag=digest, max_age=MEDIA_CACHE_MAX_AGE
+    )
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+@bp.route('/media/<user_id>/<item_id>/video')
+def get_video(user_id, item_id):
+    """
+    Stream a video through the server, honouring Range requests
+    The first seconds come from the local head cache when the clip was
+    prefetched; the rest is read ahead from Google while they are sent.
+    """
+    if OFFLINE_MODE:
+        return jsonify({'error': 'Videos are not mirrored'}), 404
+    
+    creds = auth_handler.read_credentials(user_id)
+    if not creds:
+        return jsonify({'error': 'Account not found or expired'}), 404
+    
+    byte_range = None
+    if request.range and request.range.units == 'bytes' and len(request.range.ranges) == 1:
+        byte_range = request.range.ranges[0]
+    stream = video_proxy.open(item_id, _base_url_provider(user_id, item_id), byte_range)
+    if stream is None:
+        return jsonify({'error': 'Failed to fetch video'}), 502
+    
+    response = Response(stream_with_context(stream.chunks), status=stream.status, headers=stream.headers,
+                        direct_passthrough=True)
+    response.call_on_close(stream.close)
+    response.accept_ranges = 'bytes'
+    response.cache_control.private = True
+    response.cache_control.max_age = MEDIA_CACHE_MAX_AGE
+    return response
+
+@bp.route('/api/video/startup', methods=['POST'])
+def report_video_startup():
+    """Record how long a display waited for a video slide to start playing"""
+    data = request.get_json(silent=True) or {}
+    item_id = data.get('item_id')
+    try:
+        seconds = float(data.get('ms')) / 1000
+    except (TypeError, ValueError):
+        seconds = -1
+    if not item_id or not 0 <= seconds < 3600:
+        return jsonify({'error': 'item_id and ms are required'}), 400
+    video_proxy.record_startup(str(item_id), seconds)
+    return jsonify({'message': 'Startup recorded'})
+
+@bp.route('/api/video/stats')
+def get_video_stats():
+    """Get video head cache statistics and recent startup latencies per clip"""
+    return jsonify(video_proxy.stats())
+
+@bp.route('/api/prefetch/<session_id>', methods=['POST'])
+def report_position(session_id):
+    """Report a display's position so its upcoming slides are fetched ahead of time"""
+    data = request.get_json(silent=True) or {}
+    user_id = data.get('user_id')
+    creds = auth_handler.read_credentials(user_id) if user_id else None
+    if not creds:
+        return jsonify({'error': 'Account not found or expired'}), 404
+    
+    try:
+        position = max(0, int(data.get('position', 0)))
+        lookahead = data.get('lookahead')
+        if lookahead is not None:
+            lookahead = max(1, min(int(lookahead), PREFETCH_MAX_LOOKAHEAD))
+        speed = data.get('speed')
+        if speed is not None:
+            speed = max(1.0, min(float(speed), 3600.0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'position, lookahead and speed must be numbers'}), 400
+    items = data.get('items', [])
+    if not isinstance(items, list):
+        return jsonify({'error': 'items must be a list'}), 400
+    
+    source = (
+        user_id, data.get('album_id'), data.get('type', 'image'),
+        data.get('start_date'), data.get('end_date'), bool(data.get('favorites', False))
+    )
+    api = GooglePhotosAPI(creds['token'], transport, account=user_id, priority=BACKGROUND)
+    next_page_token = data.get('next_page_token')
+    # Warm the same variant the display's image requests will ask for
+    width, height = _display_size(data.get('viewport') or {}) or MEDIA_MASTER_SIZE
+    formats = data.get('formats') if isinstance(data.get('formats'), list) else []
+    if next_page_token and next_page_token.startswith(LOCAL_PAGE_PREFIX):
+        # Index-backed pages are served locally and need no warming
+        next_page_token = None
+    
+    result = prefetcher.report_position(
+        session_id,
+        source,
+        position,
+        [item_id for item_id in items if isinstance(item_id, str)],
+        lambda item_id: _base_url_provider(user_id, item_id, BACKGROUND),
+        width,
+        height,
+        next_page_token=next_page_token,
+        page_fetcher=lambda page_token: _fetch_upstream_page(api, source, page_token),
+        lookahead=lookahead,
+        speed=speed,
+        image_format=negotiate_format(str(image_type) for image_type in formats),
+        videos=data.get('videos') if isinstance(data.get('videos'), list) else []
+    )
+    return jsonify(result)
+
+@bp.route('/api/prefetch/<session_id>', methods=['DELETE'])
+def cancel_prefetch(session_id):
+    """Cancel queued prefetch work for a display"""
+    prefetcher.cancel(session_id)
+    return jsonify({'message': 'Prefetch cancelled'})
+
+@bp.route('/api/prefetch/stats')
+def get_prefetch_stats():
+    """Get prefetch hit/miss statistics"""
+    return jsonify(prefetcher.stats())
+
+@bp.route('/api/index/<user_id>')
+def get_index_status(user_id):
+    """Get the state of the local media index for a user"""
+    if not auth_handler.read_credentials(user_id):
+        return jsonify({'error': 'Account not found or expired'}), 404
+    
+    return jsonify(get_media_index(user_id).status())
+
+@bp.route('/api/index/<user_id>/sync', methods=['POST'])
+def sync_index(user_id):
+    """Start a background sync of the local media index"""
+    if not auth_handler.read_credentials(user_id):
+        return jsonify({'error': 'Account not found or expired'}), 404
+    
+    started = _start_sync(user_id, force=True)
+    return jsonify({'started': started, **get_media_index(user_id).status()})
+
+@bp.route('/api/search/<user_id>')
+def search_photos(user_id):
+    """
+    Search the local index: q matches words in filenames, descriptions and
+    camera names; year, month (YYYY-MM), type, mime and camera filter by
+    facet and may be repeated. Returns matching IDs newest first, the total
+    and facet counts, without calling Google.
+    """
+    if not auth_handler.read_credentials(user_id):
+        return jsonify({'error': 'Account not found or expired'}), 404
+    
+    index = get_media_index(user_id)
+    if not index.is_complete():
+        _start_sync(user_id)
+    
+    filters = {name: request.args.getlist(name) for name in FACETS}
+    if not _dates_valid(request.args.get('start_date'), request.args.get('end_date')):
+        return jsonify({'error': 'Invalid date'}), 400
+    page_token = request.args.get('page_token')
+    if page_token and parse_page_token(page_token) is None:
+        return jsonify({'error': 'Invalid page token'}), 400
+    limit = max(0, min(request.args.get('limit', MAX_IMAGES_PER_PAGE, type=int), SEARCH_MAX_RESULTS))
+    
+    start = time.perf_counter()
+    result = get_search_index(user_id).search(
+        request.args.get('q', ''), filters,
+        request.args.get('start_date'), request.args.get('end_date'),
+        request.args.get('favorites', 'false').lower() == 'true',
+        request.args.get('dedupe', 'false').lower() == 'true',
+        page_token, limit
+    )
+    result['tookMs'] = round((time.perf_counter() - start) * 1000, 2)
+    result['complete'] = index.is_complete()
+    return jsonify(result)
+
+@bp.route('/api/dedupe/<user_id>')
+def get_dedupe_status(user_id):
+    """Get how many of a user's photos are hashed and how many are near-duplicates"""
+    if not auth_handler.read_credentials(user_id):
+        return jsonify({'error': 'Account not found or expired'}), 404
+    
+    return jsonify({'running': is_deduping(user_id), **get_media_index(user_id).dedupe_status()})
+
+@bp.route('/api/dedupe/<user_id>', methods=['POST'])
+def start_dedupe(user_id):
+    """Start hashing a user's indexed photos that have no perceptual hash yet"""
+    if not auth_handler.read_credentials(user_id):
+        return jsonify({'error': 'Account not found or expired'}), 404
+    
+    started = start_background_dedupe(user_id, _api_factory(user_id))
+    return jsonify({'started': started, **get_media_index(user_id).dedupe_status()})
+
+@bp.route('/api/mirror/<user_id>')
+def get_mirror_status(user_id):
+    """Get a user's mirrored albums and how much of each is downloaded"""
+    if not OFFLINE_MODE and not auth_handler.read_credentials(user_id):
+        return jsonify({'error': 'Account not found or expired'}), 404
+    
+    return jsonify(get_mirror().status(user_id))
+
+@bp.route('/api/mirror/<user_id>', methods=['POST'])
+def start_mirror(user_id):
+    """
+    Add an album to the offline mirror (album_id, title, priority in the body)
+    and start syncing the user's mirrored albums
+    """
+    if not auth_handler.read_credentials(user_id):
+        return jsonify({'error': 'Account not found or expired'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    if data.get('album_id'):
+        try:
+            priority = int(data.get('priority', 0))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'priority must be an integer'}), 400
+        get_mirror().add_album(user_id, data['album_id'], data.get('title', ''), priority)
+    
+    started = start_background_mirror(user_id, _api_factory(user_id))
+    return jsonify({'started': started, **get_mirror().status(user_id)})
+
+@bp.route('/api/mirror/<user_id>/<album_id>', methods=['DELETE'])
+def remove_mirrored_album(user_id, album_id):
+    """Stop mirroring an album and free its disk space"""
+    if not get_mirror().remove_album(user_id, album_id):
+        return jsonify({'error': 'Album is not mirrored'}), 404
+    return jsonify({'message': 'Album removed from the mirror'})
+
+@bp.route('/api/albums/<user_id>')
 def get_albums(user_id):
     """Get albums for a specific user"""
     creds = auth_handler.read_credentials(user_id)
     if not creds:
         return jsonify({'error': 'Account not found or expired'}), 404
     
-    api = GooglePhotosAPI(creds['token'])
+    api = GooglePhotosAPI(creds['token'], transport, account=user_id)
     
     album_type = request.args.get('type', 'albums')
     page_token = request.args.get('page_token')
     
     if album_type == 'shared':
-        result = api.get_shared_albums(page_token)
+        result = album_cache.get((user_id, 'shared', page_token), lambda: api.get_shared_albums(page_token))
         albums = result.get('sharedAlbums', [])
     else:
-        result = api.get_albums(page_token)
+        result = album_cache.get((user_id, 'albums', page_token), lambda: api.get_albums(page_token))
         albums = result.get('albums', [])
     
     # Process albums
+    compact = _compact()
     processed_albums = []
     for album in albums:
         processed_album = {
@@ -208,17 +1021,119 @@ def get_albums(user_id):
             'isWriteable': album.get('isWriteable', False)
         }
         
-        if processed_album['coverPhotoBaseUrl']:
+        # Compact clients build the thumbnail URL from coverPhotoBaseUrl and urls.thumbnail
+        if processed_album['coverPhotoBaseUrl'] and not compact:
             processed_album['thumbnailUrl'] = api.build_thumbnail_url(processed_album['coverPhotoBaseUrl'])
         
         processed_albums.append(processed_album)
     
-    return jsonify({
+    page = {
         'albums': processed_albums,
         'nextPageToken': result.get('nextPageToken')
+    }
+    if compact:
+        page['urls'] = page_urls()
+    return _json_page(json.dumps(page, separators=(',', ':')))
+
+@bp.route('/api/albums/<user_id>/cache', methods=['DELETE'])
+def invalidate_albums(user_id):
+    """Drop cached album listings for a user (optionally only one type)"""
+    album_type = request.args.get('type')
+    if album_type:
+        removed = album_cache.invalidate(user_id, 'shared' if album_type == 'shared' else 'albums')
+    else:
+        removed = album_cache.invalidate(user_id)
+    return jsonify({'invalidated': removed})
+
+@bp.route('/api/sync/groups')
+def get_sync_groups():
+    """List sync groups with their playback status, and where displays reach the hub"""
+    groups = [
+        {'name': name, **settings, 'status': group_status(name)}
+        for name, settings in sorted(list_groups().items())
+    ]
+    return jsonify({
+        'hub': {'enabled': SYNC_HUB_ENABLED, 'url': SYNC_PUBLIC_URL or None, 'port': SYNC_PORT},
+        'groups': groups
+    })
+
+@bp.route('/api/sync/groups/<name>', methods=['PUT'])
+def put_sync_group(name):
+    """
+    Create a sync group or change what it plays
+    Displays subscribed to the group all show the same shuffled playlist of
+    one account (user_id), advanced every speed seconds by the sync hub.
+    """
+    if not GROUP_NAME_PATTERN.match(name):
+        return jsonify({'error': 'Group names are 1-64 letters, digits, _ or -'}), 400
+    data = request.get_json(silent=True) or {}
+    user_id = data.get('user_id')
+    if not user_id or not auth_handler.read_credentials(user_id):
+        return jsonify({'error': 'Account not found or expired'}), 404
+    
+    try:
+        speed = max(1.0, min(float(data.get('speed', DEFAULT_SLIDESHOW_SPEED)), 3600.0))
+        seed = int(data['seed']) if data.get('seed') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'speed and seed must be numbers'}), 400
+    settings = {
+        'user_id': user_id,
+        'speed': speed,
+        'seed': seed,
+        'type': data.get('type') if data.get('type') in ('image', 'video', 'all') else 'image',
+        'weights': [weight for weight in data.get('weights') or [] if weight in WEIGHTS],
+        'dedupe': bool(data.get('dedupe', False)),
+        # The hub has no request to build URLs from, so the media proxy prefix is kept with the group
+        'media': _media_url_prefix(user_id)
+    }
+    save_group(name, settings)
+    if not get_media_index(user_id).is_complete():
+        _start_sync(user_id)
+    return jsonify({'name': name, **settings})
+
+@bp.route('/api/sync/groups/<name>', methods=['DELETE'])
+def delete_sync_group(name):
+    """Remove a sync group; its displays are disconnected"""
+    if not remove_group(name):
+        return jsonify({'error': 'Sync group not found'}), 404
+    return jsonify({'message': 'Sync group removed'})
+
+@bp.route('/api/sync/groups/<name>/<action>', methods=['POST'])
+def control_sync_group(name, action):
+    """Play, pause, skip or go back on every display of a sync group"""
+    if action not in ACTIONS:
+        return jsonify({'error': f'action must be one of {", ".join(ACTIONS)}'}), 400
+    if name not in list_groups():
+        return jsonify({'error': 'Sync group not found'}), 404
+    send_command(name, action)
+    return jsonify({'message': f'{action.capitalize()} sent'})
+
+@bp.route('/api/stats')
+def get_stats():
+    """Get runtime statistics for the server's shared components"""
+    return jsonify({
+        'http': transport.stats(),
+        'media_cache': image_cache.stats(),
+        'video': video_proxy.stats(),
+        'prefetch': prefetcher.stats(),
+        'album_cache': album_cache.stats(),
+        'coalescing': get_single_flight().stats(),
+        'merged_feed': merged_feed.stats()
     })
 
-@app.route('/api/settings', methods=['GET', 'POST'])
+@bp.route('/metrics')
+def get_metrics():
+    """Prometheus text exposition of this worker's metrics"""
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(get_registry().expose(), content_type=CONTENT_TYPE)
+
+@bp.route('/api/quota')
+def get_quota():
+    """Get the Photos API request budget, current rates and throttle counts"""
+    return jsonify(get_rate_limiter().stats())
+
+@bp.route('/api/settings', methods=['GET', 'POST'])
 def settings():
     """Get or update slideshow settings"""
     if request.method == 'GET':
@@ -241,4 +1156,5 @@ if __name__ == '__main__':
     os.makedirs('data/tokens', exist_ok=True)
     os.makedirs('data/cache', exist_ok=True)
     
-    app.run(debug=(FLASK_ENV == 'development'), host='0.0.0.0', port=5000)
+    # main.py runs the reloader without building the app twice; here it is simply off
+    create_app().run(debug=(FLASK_ENV == 'development'), host=SERVER_HOST, port=SERVER_PORT, use_reloader=False)
@@ -0,0 +1,303 @@
+import asyncio
+import datetime
+import time
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from rate_limiter import BACKGROUND, RateLimiter, parse_retry_after
+from config import (
+    GOOGLE_PHOTOS_API_BASE, MAX_IMAGES_PER_PAGE, HTTP_TIMEOUT, HTTP_RETRIES, HTTP_BACKOFF_FACTOR,
+    ASYNC_MAX_CONCURRENCY, ASYNC_RATE_LIMIT, ASYNC_RATE_BURST, ASYNC_FIRST_YEAR
+)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class AsyncRateLimiter:
+    """Token bucket shared by every coroutine of a crawl"""
+
+    def __init__(self, rate: float = ASYNC_RATE_LIMIT, burst: int = ASYNC_RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AsyncGooglePhotosAPI:
+    """
+    asyncio counterpart of GooglePhotosAPI for large crawls
+    All calls share a bounded semaphore and a global rate limiter, so many
+    listings can be paged concurrently without tripping the API quota.
+    With a quota limiter, every request is also counted as background work
+    against the process-wide account/global budget shared with GooglePhotosAPI.
+    """
+
+    def __init__(self, access_token: str, token_provider: Optional[Callable[[], Optional[str]]] = None,
+                 api_base: str = GOOGLE_PHOTOS_API_BASE, max_concurrency: int = ASYNC_MAX_CONCURRENCY,
+                 rate_limiter: Optional[AsyncRateLimiter] = None,
+                 session: Optional[aiohttp.ClientSession] = None,
+                 quota: Optional[RateLimiter] = None, account: Optional[str] = None):
+        self.access_token = access_token
+        self.token_provider = token_provider
+        self.api_base = api_base
+        self.rate_limiter = rate_limiter or AsyncRateLimiter()
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = session
+        self._owns_session = session is None
+        self.quota = quota
+        self.account = account or 'default'
+        self.requests = 0
+        self.retries = 0
+
+    async def __aenter__(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+                connector=aiohttp.TCPConnector(limit_per_host=self.max_concurrency)
+            )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _refresh_token(self) -> bool:
+        if self.token_provider is None:
+            return False
+        token = await asyncio.to_thread(self.token_provider)
+        if not token or token == self.access_token:
+            return False
+        self.access_token = token
+        return True
+
+    async def _reserve_quota(self) -> bool:
+        while True:
+            wait = self.quota.reserve(self.account, BACKGROUND)
+            if wait is None:
+                return False
+            if wait == 0:
+                return True
+            await asyncio.sleep(wait)
+
+    async def _call(self, method: str, path: str, action: str, **kwargs) -> Dict:
+        """
+        Send a request to the Photos Library API
+        Returns: decoded JSON body, or {} on failure
+        """
+        token_refreshed = False
+        for attempt in range(HTTP_RETRIES + 1):
+            await self.rate_limiter.acquire()
+            if self.quota is not None and not await self._reserve_quota():
+                print(f'Error {action}: rate limited (background request for {self.account})')
+                return {}
+            try:
+                async with self._semaphore:
+                    self.requests += 1
+                    async with self._session.request(
+                        method,
+                        f'{self.api_base}/{path}',
+                        headers={'Authorization': f'Bearer {self.access_token}'},
+                        **kwargs
+                    ) as response:
+                        if response.status == 200:
+                            if self.quota is not None:
+                                self.quota.record_success(self.account)
+                            return await response.json()
+                        status = response.status
+                        text = await response.text()
+                        retry_after = response.headers.get('Retry-After')
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status, text, retry_after = None, str(e), None
+
+            if status == 429 and self.quota is not None:
+                self.quota.record_throttle(self.account, parse_retry_after(retry_after))
+
+            if status == 401 and not token_refreshed and await self._refresh_token():
+                token_refreshed = True
+                continue
+
+            if (status is None or status in RETRY_STATUSES) and attempt < HTTP_RETRIES:
+                self.retries += 1
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else HTTP_BACKOFF_FACTOR * 2 ** attempt
+                await asyncio.sleep(delay)
+                continue
+
+            print(f'Error {action}: {status} - {text}')
+            return {}
+        return {}
+
+    async def get_media_items(self, page_token: Optional[str] = None, page_size: int = MAX_IMAGES_PER_PAGE) -> Dict:
+        """
+        Get media items from Google Photos
+        Returns: dict with mediaItems and nextPageToken
+        """
+        params = {'pageSize': page_size}
+        if page_token:
+            params['pageToken'] = page_token
+
+        return await self._call('GET', 'mediaItems', 'fetching media items', params=params)
+
+    async def search_media_items(self, filters: Dict, page_token: Optional[str] = None,
+                                 page_size: int = MAX_IMAGES_PER_PAGE) -> Dict:
+        """
+        Search media items with filters
+        Returns: dict with mediaItems and nextPageToken
+        """
+        params = {'pageSize': page_size, 'filters': filters}
+        if page_token:
+            params['pageToken'] = page_token
+
+        return await self._call('POST', 'mediaItems:search', 'searching media items', json=params)
+
+    async def get_album_media(self, album_id: str, page_token: Optional[str] = None,
+                              page_size: int = MAX_IMAGES_PER_PAGE) -> Dict:
+        """
+        Get media items from a specific album
+        Returns: dict with mediaItems and nextPageToken
+        """
+        params = {'pageSize': page_size, 'albumId': album_id}
+        if page_token:
+            params['pageToken'] = page_token
+
+        return await self._call('POST', 'mediaItems:search', 'fetching album media', json=params)
+
+    async def get_albums(self, page_token: Optional[str] = None) -> Dict:
+        """
+        Get user's albums
+        Returns: dict with albums and nextPageToken
+        """
+        params = {'pageSize': 50}
+        if page_token:
+            params['pageToken'] = page_token
+
+        return await self._call('GET', 'albums', 'fetching albums', params=params)
+
+    async def get_shared_albums(self, page_token: Optional[str] = None) -> Dict:
+        """
+        Get user's shared albums
+        Returns: dict with sharedAlbums and nextPageToken
+        """
+        params = {'pageSize': 50}
+        if page_token:
+            params['pageToken'] = page_token
+
+        return await self._call('GET', 'sharedAlbums', 'fetching shared albums', params=params)
+
+    async def list_all_albums(self, shared: bool = False) -> List[Dict]:
+        """Page through every album (or shared album) the account can see"""
+        albums = []
+        page_token = None
+        key = 'sharedAlbums' if shared else 'albums'
+        while True:
+            result = await (self.get_shared_albums(page_token) if shared else self.get_albums(page_token))
+            albums.extend(result.get(key, []))
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                return albums
+
+    async def _page_source(self, source: Dict, page_token: Optional[str]) -> Dict:
+        if 'album_id' in source:
+            return await self.get_album_media(source['album_id'], page_token)
+        if 'filters' in source:
+            return await self.search_media_items(source['filters'], page_token)
+        return await self.get_media_items(page_token)
+
+    async def crawl(self, sources: List[Dict]) -> AsyncIterator[Tuple[Dict, List[Dict], bool]]:
+        """
+        Page through several listings concurrently
+        Each source is {} (whole library), {'album_id': ...} or {'filters': ...}.
+        Yields (source, media_items, finished) as pages arrive, in arrival order;
+        finished is True on a source's last page, and media_items is None if
+        the source failed midway.
+        """
+        queue = asyncio.Queue(maxsize=len(sources) * 2)
+        done = object()
+
+        async def produce(source):
+            page_token = None
+            try:
+                while True:
+                    result = await self._page_source(source, page_token)
+                    if not result:
+                        await queue.put((source, None, False))
+                        return
+                    page_token = result.get('nextPageToken')
+                    await queue.put((source, result.get('mediaItems', []), not page_token))
+                    if not page_token:
+                        return
+            finally:
+                await queue.put(done)
+
+        tasks = [asyncio.create_task(produce(source)) for source in sources]
+        remaining = len(tasks)
+        try:
+            while remaining:
+                entry = await queue.get()
+                if entry is done:
+                    remaining -= 1
+                    continue
+                yield entry
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def year_partitions(first_year: int = ASYNC_FIRST_YEAR, last_year: Optional[int] = None) -> List[Dict]:
+    """
+    Split the whole library into per-year search sources
+    A single mediaItems.list can only be paged serially; date-filtered
+    searches over disjoint years can be paged in parallel instead.
+    """
+    last_year = last_year or datetime.date.today().year + 1
+
+    def date_range(start, end):
+        return {
+            'startDate': {'year': start[0], 'month': start[1], 'day': start[2]},
+            'endDate': {'year': end[0], 'month': end[1], 'day': end[2]}
+        }
+
+    ranges = [date_range((1, 1, 1), (first_year - 1, 12, 31))]
+    ranges.extend(date_range((year, 1, 1), (year, 12, 31)) for year in range(first_year, last_year + 1))
+    # Archived items are left out, as mediaItems.list leaves them out of a serial crawl
+    return [{'filters': {'dateFilter': {'ranges': [date_range_]}}} for date_range_ in ranges]
+
+
+async def crawl_sources(access_token: str, sources: List[Dict],
+                        on_page: Callable[[Dict, List[Dict]], Optional[bool]],
+                        token_provider: Optional[Callable[[], Optional[str]]] = None,
+                        api_base: str = GOOGLE_PHOTOS_API_BASE, **api_options) -> bool:
+    """
+    Crawl sources concurrently, handing each page to on_page as it arrives
+    on_page runs in a worker thread so blocking storage writes do not stall the loop;
+    it may return False to stop the crawl.
+    Returns: True if every source was crawled to its last page
+    """
+    complete = True
+    async with AsyncGooglePhotosAPI(access_token, token_provider, api_base, **api_options) as api:
+        pages = api.crawl(sources)
+        try:
+            async for source, media_items, finished in pages:
+                if media_items is None:
+                    complete = False
+                elif media_items and await asyncio.to_thread(on_page, source, media_items) is False:
+                    complete = False
+                    break
+        finally:
+            # Cancels the sources still being paged
+            await pages.aclose()
+    return complete
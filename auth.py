@@ -1,18 +1,28 @@
 import datetime
 import time
-import requests
 import json
-import os
+import sqlite3
+import threading
 from pathlib import Path
 from config import (
     GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, AUTH_BASE_URL, 
     DEVICE_CODE_URL, TOKEN_URL, REFRESH_URL, GOOGLE_OPENID_URL, SCOPES,
-    TOKENS_DIR
+    TOKENS_DIR, TOKEN_REFRESH_MARGIN, TOKEN_REFRESH_INTERVAL, CREDENTIAL_STAT_INTERVAL
 )
+from http_session import get_transport
+from state_store import get_state_store
+from token_store import get_token_store
+from metrics import counter, histogram
+
+CREDENTIAL_READ_SECONDS = histogram(
+    'credentials_read_duration_seconds', 'read_credentials latency by outcome', ('result',)
+)
+TOKEN_REFRESH_SECONDS = histogram('token_refresh_duration_seconds', 'Access token refresh round trips', ('trigger',))
+TOKEN_REFRESHES = counter('token_refreshes_total', 'Access token refreshes', ('trigger', 'result'))
 
 
 class GooglePhotosAuth:
-    def __init__(self):
+    def __init__(self, transport=None):
         # Require credentials just like the Kodi plugin
         if not GOOGLE_CLIENT_ID or not GOOGLE_CLIENT_SECRET:
             raise ValueError("Google OAuth credentials are required. Please set GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET in your .env file. Get them from: https://photos-kodi-addon.onrender.com/credentialsguide")
@@ -21,11 +31,14 @@ class GooglePhotosAuth:
             'clientId': GOOGLE_CLIENT_ID,
             'clientSecret': GOOGLE_CLIENT_SECRET
         }
-        self._ensure_directories()
-    
-    def _ensure_directories(self):
-        """Create necessary directories if they don't exist"""
-        Path(TOKENS_DIR).mkdir(parents=True, exist_ok=True)
+        self.transport = transport or get_transport()
+        self.store = get_token_store()
+        
+        # In-memory credential cache keyed by user_id
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self._user_locks = {}
+        self._refresher = None
     
     def _join_path(self, *args):
         """Join path parts and strip extra slashes"""
@@ -36,10 +49,11 @@ class GooglePhotosAuth:
         Get device code for OAuth authentication
         Returns: dict with device_code, user_code, etc. or None on failure
         """
+        import requests
         path = self._join_path(AUTH_BASE_URL, DEVICE_CODE_URL)
         
         try:
-            res = requests.post(path, data=self.client_creds, timeout=30)
+            res = self.transport.post(path, data=self.client_creds)
             if res.status_code != 200:
                 print(f'Device code request failed: {res.status_code}')
                 return None
@@ -56,13 +70,14 @@ class GooglePhotosAuth:
         Fetch token from auth server and save if successful
         Returns: 200 if successful, 202 if pending, 403 if rate limited, other status codes on error
         """
+        import requests
         token_url = self._join_path(AUTH_BASE_URL, TOKEN_URL)
         
         try:
-            res = requests.post(token_url, data={
+            res = self.transport.post(token_url, data={
                 'deviceCode': device_code,
                 'grant_type': 'urn:ietf:params:oauth:grant-type:device_code'
-            }, timeout=30)
+            })
             
             if res.status_code in [202, 403]:
                 return res.status_code
@@ -75,7 +90,7 @@ class GooglePhotosAuth:
             
             # Get user email and unique identifier
             headers = {'Authorization': f'Bearer {token_data["access_token"]}'}
-            openid_res = requests.get(GOOGLE_OPENID_URL, headers=headers, timeout=30)
+            openid_res = self.transport.get(GOOGLE_OPENID_URL, headers=headers)
             
             if openid_res.status_code != 200:
                 print(f'Failed to get user info: {openid_res.status_code}')
@@ -95,19 +110,20 @@ class GooglePhotosAuth:
                 "expiry": datetime.datetime.utcnow() + datetime.timedelta(seconds=token_data["expires_in"])
             }
             
-            # Save token to file
-            token_file = Path(TOKENS_DIR) / f"{user_id}.json"
-            with open(token_file, 'w') as f:
-                json.dump(token, f, default=str)
-            
+            self.store.save(user_id, token)
             return 200
             
         except requests.RequestException as e:
             print(f'Error fetching token: {e}')
             return 500
     
-    def refresh_access_token(self, creds, token_file):
-        """Refresh expired access token"""
+    def refresh_access_token(self, creds, user_id):
+        """
+        Refresh expired access token
+        Only the token and expiry are written back, in one transaction.
+        Returns: 200 if successful, 404 if the account was removed meanwhile, other status codes on error
+        """
+        import requests
         refresh_url = self._join_path(AUTH_BASE_URL, REFRESH_URL)
         
         data = {
@@ -116,7 +132,7 @@ class GooglePhotosAuth:
         }
         
         try:
-            res = requests.post(refresh_url, data={**data, **self.client_creds}, timeout=30)
+            res = self.transport.post(refresh_url, data={**data, **self.client_creds})
             if res.status_code != 200:
                 print(f'Token refresh failed: {res.status_code}')
                 return res.status_code
@@ -125,76 +141,166 @@ class GooglePhotosAuth:
             creds["token"] = token_data["access_token"]
             creds["expiry"] = datetime.datetime.utcnow() + datetime.timedelta(seconds=token_data["expires_in"])
             
-            with open(token_file, 'w') as f:
-                json.dump(creds, f, default=str)
-            
+            if self.store.update(user_id, {'token': creds['token'], 'expiry': creds['expiry']}) is None:
+                return 404
             return 200
             
         except requests.RequestException as e:
             print(f'Error refreshing token: {e}')
             return 500
     
-    def read_credentials(self, user_id):
+    @staticmethod
+    def _parse_expiry(expiry_str):
+        """Parse a stored expiry into a naive UTC datetime"""
+        try:
+            return datetime.datetime.strptime(expiry_str, "%Y-%m-%d %H:%M:%S.%f")
+        except ValueError:
+            # Handle different datetime formats
+            expiry = datetime.datetime.fromisoformat(expiry_str.replace('Z', '+00:00'))
+            if expiry.tzinfo is not None:
+                expiry = expiry.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            return expiry
+    
+    def _user_lock(self, user_id):
+        with self._cache_lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+    
+    def _load_credentials(self, user_id):
         """
-        Read credentials for a user, refreshing if expired
-        Returns: credentials dict if successful, None if not found
+        Get cached credentials, re-reading them only when another writer changed them
+        The stored version is checked at most once per CREDENTIAL_STAT_INTERVAL.
+        Returns: cache entry dict or None if the account isn't stored
         """
-        token_file = Path(TOKENS_DIR) / f"{user_id}.json"
+        now = time.monotonic()
+        entry = self._cache.get(user_id)
+        if entry is not None and now - entry['checked'] < CREDENTIAL_STAT_INTERVAL:
+            return entry
         
-        if not token_file.exists():
+        if entry is not None and self.store.version(user_id) == entry['version']:
+            entry['checked'] = now
+            return entry
+        
+        stored = self.store.get(user_id)
+        if stored is None:
+            self._cache.pop(user_id, None)
             return None
         
-        try:
-            with open(token_file, 'r') as f:
-                creds = json.load(f)
+        creds, version = stored
+        entry = {
+            'creds': creds,
+            'expiry': self._parse_expiry(creds["expiry"]),
+            'version': version,
+            'checked': now
+        }
+        self._cache[user_id] = entry
+        return entry
+    
+    def _refresh_cached(self, user_id, margin):
+        """
+        Refresh a user's token if it expires within margin seconds
+        Holds the user's lock so concurrent callers share one refresh.
+        Returns: the (possibly refreshed) cache entry, or None on failure
+        """
+        with self._user_lock(user_id):
+            # Another thread may have refreshed while we waited for the lock
+            entry = self._load_credentials(user_id)
+            if entry is None:
+                return None
             
-            # Check if token is expired
-            expiry_str = creds["expiry"]
-            try:
-                expiry = datetime.datetime.strptime(expiry_str, "%Y-%m-%d %H:%M:%S.%f")
-            except ValueError:
-                # Handle different datetime formats
-                expiry = datetime.datetime.fromisoformat(expiry_str.replace('Z', '+00:00'))
+            deadline = datetime.datetime.utcnow() + datetime.timedelta(seconds=margin)
+            if entry['expiry'] > deadline:
+                return entry
             
-            if expiry < datetime.datetime.utcnow():
+            creds = dict(entry['creds'])
+            trigger = 'request' if margin == 0 else 'background'
+            start = time.perf_counter()
+            status = self.refresh_access_token(creds, user_id)
+            TOKEN_REFRESH_SECONDS.labels(trigger).observe(time.perf_counter() - start)
+            TOKEN_REFRESHES.labels(trigger, 'success' if status == 200 else 'failure').inc()
+            if status != 200:
+                print(f"Failed to refresh token: {status}")
+                return None
+            
+            # Re-read what was committed, so the cache holds the stored version
+            self._cache.pop(user_id, None)
+            return self._load_credentials(user_id)
+    
+    def read_credentials(self, user_id):
+        """
+        Read credentials for a user, refreshing if expired
+        Served from an in-memory cache that is invalidated by the stored
+        version; the background refresher normally renews tokens before
+        a request ever sees them expire.
+        Returns: credentials dict if successful, None if not found
+        """
+        start = time.perf_counter()
+        result = 'missing'
+        try:
+            entry = self._load_credentials(user_id)
+            if entry is None:
+                return None
+            
+            if entry['expiry'] < datetime.datetime.utcnow():
                 print("Token expired, refreshing...")
-                status = self.refresh_access_token(creds, token_file)
-                if status != 200:
-                    print(f"Failed to refresh token: {status}")
+                result = 'refresh_failed'
+                entry = self._refresh_cached(user_id, 0)
+                if entry is None:
                     return None
+                result = 'refreshed'
+            else:
+                result = 'ok'
             
-            return creds
+            return dict(entry['creds'])
             
-        except (json.JSONDecodeError, KeyError, FileNotFoundError) as e:
+        except (json.JSONDecodeError, KeyError, ValueError, sqlite3.Error) as e:
+            result = 'error'
             print(f"Error reading credentials: {e}")
             return None
+        finally:
+            CREDENTIAL_READ_SECONDS.labels(result).observe(time.perf_counter() - start)
     
-    def get_all_accounts(self):
-        """Get list of all authenticated accounts"""
-        accounts = []
-        tokens_dir = Path(TOKENS_DIR)
-        
-        if not tokens_dir.exists():
-            return accounts
-        
-        for token_file in tokens_dir.glob("*.json"):
+    def refresh_expiring(self, margin=TOKEN_REFRESH_MARGIN):
+        """Refresh every account whose token expires within margin seconds"""
+        refreshed = 0
+        for user_id in self.store.user_ids():
             try:
-                with open(token_file, 'r') as f:
-                    creds = json.load(f)
-                accounts.append({
-                    'user_id': creds.get('user_id', token_file.stem),
-                    'email': creds.get('email', 'Unknown'),
-                    'token_file': token_file.name
-                })
-            except (json.JSONDecodeError, KeyError):
-                continue
+                entry = self._load_credentials(user_id)
+                deadline = datetime.datetime.utcnow() + datetime.timedelta(seconds=margin)
+                if entry is not None and entry['expiry'] <= deadline:
+                    if self._refresh_cached(user_id, margin) is not None:
+                        refreshed += 1
+            except (json.JSONDecodeError, KeyError, ValueError, sqlite3.Error) as e:
+                print(f"Error checking credentials for {user_id}: {e}")
+        return refreshed
+    
+    def start_refresher(self, interval=TOKEN_REFRESH_INTERVAL, margin=TOKEN_REFRESH_MARGIN):
+        """
+        Start a daemon thread that renews tokens shortly before they expire
+        With several server workers, only the one holding the refresh lease
+        does the renewing; the others pick new tokens up from the token store.
+        """
+        if self._refresher is not None:
+            return
+        
+        def run():
+            store = get_state_store()
+            while True:
+                if store.acquire_lease('token-refresher', interval * 2):
+                    self.refresh_expiring(margin)
+                time.sleep(interval)
         
-        return accounts
+        self._refresher = threading.Thread(target=run, name='token-refresher', daemon=True)
+        self._refresher.start()
+    
+    def get_all_accounts(self):
+        """Get list of all authenticated accounts"""
+        return self.store.accounts()
     
     def remove_account(self, user_id):
-        """Remove an account's token file"""
-        token_file = Path(TOKENS_DIR) / f"{user_id}.json"
-        if token_file.exists():
-            token_file.unlink()
-            return True
-        return False
+        """Remove an account's credentials, and its token file from before the token store"""
+        self._cache.pop(user_id, None)
+        removed = self.store.remove(user_id)
+        legacy_file = Path(TOKENS_DIR) / f"{user_id}.json"
+        if legacy_file.exists():
+            legacy_file.unlink()
+        return removed
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Serial vs concurrent full-library crawl against a local stub API.
+
+Starts a small aiohttp server emulating mediaItems and mediaItems:search
+(with a fixed per-page latency) and, for each latency, times a serial
+nextPageToken walk with GooglePhotosAPI, the per-year partitioned crawl
+done by the async engine, and a first MediaIndex sync, which picks one of
+the two after timing the first page. All three go through the same rate
+limiter and crawl rate as the server, so the requests each one sends and
+the rate cap are counted alike.
+
+Usage: python benchmarks/bench_async_crawl.py [--items 20000] [--latency 0.1 0.4]
+"""
+
+import argparse
+import asyncio
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aiohttp import web
+
+from async_photos_api import AsyncRateLimiter, crawl_sources, year_partitions
+from config import ASYNC_MAX_CONCURRENCY, ASYNC_RATE_LIMIT
+from http_session import HttpTransport
+from media_index import MediaIndex
+from photos_api import GooglePhotosAPI
+from rate_limiter import RateLimiter
+from state_store import StateStore
+
+FIRST_YEAR = 2005
+YEARS = 20
+
+
+def build_library(total_items):
+    return [{
+        'id': f'item-{n:08d}',
+        'filename': f'IMG_{n:05d}.jpg',
+        'mimeType': 'image/jpeg',
+        'baseUrl': f'https://lh3.googleusercontent.com/lr/{n:040d}',
+        'mediaMetadata': {'creationTime': f'{FIRST_YEAR + n % YEARS}-06-01T12:00:00Z'}
+    } for n in range(total_items)]
+
+
+def start_stub(library, latency, requests):
+    by_year = {}
+    for item in library:
+        by_year.setdefault(int(item['mediaMetadata']['creationTime'][:4]), []).append(item)
+
+    def page(items, token, size):
+        start = int(token or 0)
+        body = {'mediaItems': items[start:start + size]}
+        if start + size < len(items):
+            body['nextPageToken'] = str(start + size)
+        return body
+
+    async def list_items(request):
+        requests['list'] += 1
+        await asyncio.sleep(latency)
+        return web.json_response(page(library, request.query.get('pageToken'), int(request.query['pageSize'])))
+
+    async def search(request):
+        requests['search'] += 1
+        await asyncio.sleep(latency)
+        body = await request.json()
+        if 'dateFilter' not in body['filters']:
+            return web.json_response({'mediaItems': []})  # the favorites search after an index sync
+        date_range = body['filters']['dateFilter']['ranges'][0]
+        items = [item for year, year_items in by_year.items()
+                 if date_range['startDate']['year'] <= year <= date_range['endDate']['year']
+                 for item in year_items]
+        return web.json_response(page(items, body.get('pageToken'), body['pageSize']))
+
+    app = web.Application()
+    app.router.add_get('/v1/mediaItems', list_items)
+    app.router.add_post('/v1/mediaItems:search', search)
+
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app, access_log=None)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return f'http://127.0.0.1:{port}/v1'
+
+
+def run(label, requests, work):
+    requests.update(list=0, search=0)
+    start = time.perf_counter()
+    items = work()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<12} {elapsed:>8.2f} {requests["list"] + requests["search"]:>9} {requests["search"]:>9} '
+          f'{items:>8}')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--latency', type=float, nargs='+', default=[0.1, 0.4],
+                        help='simulated seconds per upstream page; one run per value')
+    parser.add_argument('--concurrency', type=int, default=ASYNC_MAX_CONCURRENCY)
+    parser.add_argument('--rate', type=float, default=ASYNC_RATE_LIMIT, help='requests per second allowed to the crawl')
+    args = parser.parse_args()
+
+    library = build_library(args.items)
+    requests = {'list': 0, 'search': 0}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        limiter = RateLimiter(daily_quota=10 ** 9, store=StateStore(str(Path(workdir) / 'state.sqlite3')))
+        print(f'Library: {args.items} items, crawl rate {args.rate:g}/s, account rate {limiter.account_rate:g}/s')
+        for latency in args.latency:
+            api_base = start_stub(library, latency, requests)
+            api = GooglePhotosAPI('stub-token', HttpTransport(), api_base=api_base, rate_limiter=limiter)
+
+            def serial():
+                count = 0
+                page_token = None
+                while True:
+                    result = api.get_media_items(page_token)
+                    count += len(result.get('mediaItems', []))
+                    page_token = result.get('nextPageToken')
+                    if not page_token:
+                        return count
+
+            def concurrent():
+                seen = set()
+                asyncio.run(crawl_sources(
+                    'stub-token',
+                    year_partitions(FIRST_YEAR, FIRST_YEAR + YEARS - 1),
+                    lambda source, items: seen.update(item['id'] for item in items),
+                    api_base=api_base,
+                    max_concurrency=args.concurrency,
+                    rate_limiter=AsyncRateLimiter(args.rate, args.concurrency),
+                    quota=limiter
+                ))
+                return len(seen)
+
+            def index_sync():
+                index = MediaIndex(f'bench-{latency}', index_dir=workdir)
+                added = index.sync(lambda: api, parallel=True)
+                index.close()
+                return added
+
+            print(f'\n{latency * 1000:.0f} ms per page')
+            print(f'{"":<12} {"seconds":>8} {"requests":>9} {"searches":>9} {"items":>8}')
+            serial_seconds = run('serial walk', requests, serial)
+            concurrent_seconds = run('concurrent', requests, concurrent)
+            sync_seconds = run('index sync', requests, index_sync)
+            print(f'Concurrent speedup {serial_seconds / concurrent_seconds:.1f}x, '
+                  f'index sync {serial_seconds / sync_seconds:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Concurrent identical album requests with and without request coalescing.
+
+Starts a local stub of mediaItems:search that counts requests and answers
+after a fixed latency, then has N threads (one per "screen") load the same
+album page at once, first each with its own SingleFlight group (no
+coalescing) and then sharing one.
+
+Usage: python benchmarks/bench_coalesce.py [--screens 20] [--latency 0.2]
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from coalesce import SingleFlight
+from http_session import HttpTransport
+from photos_api import GooglePhotosAPI
+
+
+def start_stub(latency):
+    counter = {'requests': 0}
+    lock = threading.Lock()
+    body = json.dumps({'mediaItems': [{
+        'id': f'item-{n}',
+        'filename': f'IMG_{n:04d}.jpg',
+        'mimeType': 'image/jpeg',
+        'baseUrl': f'https://lh3.googleusercontent.com/lr/{n:040d}'
+    } for n in range(100)], 'nextPageToken': 'next'}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            with lock:
+                counter['requests'] += 1
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}/v1', counter
+
+
+def run(api_base, counter, screens, shared):
+    transport = HttpTransport()
+    group = SingleFlight()
+    barrier = threading.Barrier(screens)
+    latencies = []
+
+    def screen():
+        api = GooglePhotosAPI('stub-token', transport, api_base, group if shared else SingleFlight())
+        barrier.wait()
+        start = time.perf_counter()
+        result = api.get_album_media('album-1')
+        latencies.append(time.perf_counter() - start)
+        assert len(result['mediaItems']) == 100
+
+    counter['requests'] = 0
+    threads = [threading.Thread(target=screen) for _ in range(screens)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counter['requests'], max(latencies), group.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--screens', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.2, help='simulated seconds per upstream request')
+    args = parser.parse_args()
+
+    api_base, counter = start_stub(args.latency)
+    baseline_requests, baseline_latency, _ = run(api_base, counter, args.screens, shared=False)
+    requests, latency, stats = run(api_base, counter, args.screens, shared=True)
+
+    print(f'{args.screens} screens, {args.latency * 1000:.0f} ms upstream latency')
+    print(f'Without coalescing: {baseline_requests:4d} upstream requests, slowest screen {baseline_latency * 1000:6.0f} ms')
+    print(f'With coalescing:    {requests:4d} upstream requests, slowest screen {latency * 1000:6.0f} ms')
+    print(f'Coalescing stats:   {stats}')
+
+
+if __name__ == '__main__':
+    main()
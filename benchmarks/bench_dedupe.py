@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate detection throughput, accuracy and lookup scaling.
+
+Renders synthetic photos and edited copies of them (re-encoded, resized,
+brightened) to measure hashing speed on one process versus the process
+pool and how many copies are caught versus falsely matched. Then times
+duplicate lookups among --hashes stored hashes against a linear scan, and
+runs the full pipeline over a temporary media index twice to show that a
+second run only hashes newly added items.
+
+Usage: python benchmarks/bench_dedupe.py [--photos 2000] [--hashes 100000]
+"""
+
+import argparse
+import io
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image, ImageEnhance
+
+from config import DEDUPE_MAX_DISTANCE, DEDUPE_THUMBNAIL_SIZE, DEDUPE_WORKERS
+from dedupe import DedupePipeline, MultiIndexHash, dhash, popcount
+from media_index import MediaIndex
+from photos_api import GooglePhotosAPI
+
+
+def render_photo(seed, size=DEDUPE_THUMBNAIL_SIZE):
+    """A smooth random image standing in for a photo thumbnail"""
+    rng = random.Random(seed)
+    small = Image.new('RGB', (6, 6))
+    small.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(36)])
+    return small.resize((size, size), Image.BICUBIC)
+
+
+def encode(image, quality=85):
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def edited_copy(image, seed):
+    """Re-encode, resize or brighten a photo the way re-uploads and burst shots differ"""
+    kind = seed % 3
+    if kind == 0:
+        return encode(image, quality=40)
+    if kind == 1:
+        size = image.size[0]
+        return encode(image.resize((size * 3 // 4, size * 3 // 4)).resize((size, size)))
+    return encode(ImageEnhance.Brightness(image).enhance(1.15))
+
+
+def bench_hashing(photos, workers):
+    originals = [render_photo(n) for n in range(photos)]
+    blobs = [encode(image) for image in originals]
+    copies = [edited_copy(image, n) for n, image in enumerate(originals)]
+
+    start = time.perf_counter()
+    hashes = [dhash(blob) for blob in blobs]
+    serial = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as pool:
+        copy_hashes = list(pool.map(dhash, copies, chunksize=max(1, photos // (workers * 4))))
+    pooled = time.perf_counter() - start
+
+    print(f'hashing: {photos / serial:8.0f} images/s on 1 process, '
+          f'{photos / pooled:8.0f} images/s on {workers} worker processes (incl. startup)')
+
+    table = MultiIndexHash(DEDUPE_MAX_DISTANCE)
+    false_matches = 0
+    for n, value in enumerate(hashes):
+        if table.find(value) is not None:
+            false_matches += 1
+        table.add(value, n)
+    caught = sum(1 for n, value in enumerate(copy_hashes) if (table.find(value) or (0, None))[1] == n)
+    print(f'accuracy: {caught / photos:.1%} of edited copies matched their original, '
+          f'{false_matches / photos:.2%} of distinct photos matched another (distance <= {DEDUPE_MAX_DISTANCE})')
+
+
+def bench_lookup(total, queries):
+    rng = random.Random(1)
+    hashes = []
+    while len(hashes) < total:
+        # Clusters of burst shots a few bits apart
+        base = rng.getrandbits(64)
+        for _ in range(rng.randint(1, 4)):
+            hashes.append(base ^ sum(1 << rng.randrange(64) for _ in range(rng.randint(0, 3))))
+    hashes = hashes[:total]
+
+    start = time.perf_counter()
+    table = MultiIndexHash(DEDUPE_MAX_DISTANCE, entries=((value, n) for n, value in enumerate(hashes)))
+    build = time.perf_counter() - start
+
+    probes = [value ^ (1 << rng.randrange(64)) for value in rng.sample(hashes, queries // 2)]
+    probes += [rng.getrandbits(64) for _ in range(queries - len(probes))]
+
+    start = time.perf_counter()
+    found = [table.find(value) for value in probes]
+    indexed = (time.perf_counter() - start) / len(probes)
+
+    sample = probes[:max(1, queries // 10)]
+    start = time.perf_counter()
+    for value in sample:
+        min(popcount(value ^ other) for other in hashes)
+    linear = (time.perf_counter() - start) / len(sample)
+
+    print(f'lookup among {total} hashes: build {build:.2f} s, {indexed * 1e3:.3f} ms/query indexed vs '
+          f'{linear * 1e3:.2f} ms/query linear scan ({linear / indexed:.0f}x), '
+          f'{sum(result is not None for result in found)}/{len(probes)} matched')
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, content):
+        self.content = content
+
+
+class FakeTransport:
+    """Serves rendered thumbnails for the synthetic baseUrls"""
+
+    def get(self, url, **kwargs):
+        n = int(url.rsplit('/', 1)[1].split('=')[0])
+        # Every fifth item is an edited copy of the one before it
+        if n % 5 == 4:
+            return FakeResponse(edited_copy(render_photo(n - 1), n))
+        return FakeResponse(encode(render_photo(n)))
+
+
+def bench_pipeline(photos, workers):
+    with tempfile.TemporaryDirectory() as index_dir:
+        index = MediaIndex('bench', index_dir)
+
+        def add_items(first, count):
+            index.upsert_items([{
+                'id': f'item-{n:08d}',
+                'filename': f'IMG_{n:05d}.jpg',
+                'mimeType': 'image/jpeg',
+                'baseUrl': f'https://lh3.googleusercontent.com/lr/{n}',
+                'mediaMetadata': {'creationTime': '2020-01-01T12:00:00Z'}
+            } for n in range(first, first + count)])
+
+        pipeline = DedupePipeline(index, lambda: GooglePhotosAPI('token'), FakeTransport(), workers=workers)
+        initial = photos - photos // 10
+        add_items(0, initial)
+        start = time.perf_counter()
+        counts = pipeline.run()
+        print(f'pipeline: first run {counts} in {time.perf_counter() - start:.2f} s')
+
+        add_items(initial, photos - initial)
+        start = time.perf_counter()
+        counts = pipeline.run()
+        print(f'pipeline: incremental run {counts} in {time.perf_counter() - start:.2f} s; '
+              f'index now {index.dedupe_status()}')
+        index.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--photos', type=int, default=2000, help='synthetic photos hashed')
+    parser.add_argument('--hashes', type=int, default=100000, help='stored hashes for the lookup benchmark')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=DEDUPE_WORKERS)
+    args = parser.parse_args()
+
+    bench_hashing(args.photos, args.workers)
+    bench_lookup(args.hashes, args.queries)
+    bench_pipeline(args.photos, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Cold vs warm benchmark for the local media index.
+
+Simulates a library served by the Photos Library API (with a fixed
+per-page latency) and compares re-listing it from scratch against
+serving pages from the on-disk index.
+
+Usage: python benchmarks/bench_media_index.py [--items 60000] [--latency 0.05]
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from media_index import MediaIndex
+
+
+class SimulatedPhotosAPI:
+    """Stands in for GooglePhotosAPI listing calls over a synthetic library (every 50th item a favorite)"""
+
+    def __init__(self, total_items, latency):
+        self.total_items = total_items
+        self.latency = latency
+        self.calls = 0
+
+    def get_media_items(self, page_token=None, page_size=100):
+        self.calls += 1
+        time.sleep(self.latency)
+        start = int(page_token or 0)
+        end = min(start + page_size, self.total_items)
+        items = [self._item(n) for n in range(self.total_items - start - 1, self.total_items - end - 1, -1)]
+        result = {'mediaItems': items}
+        if end < self.total_items:
+            result['nextPageToken'] = str(end)
+        return result
+
+    def create_favorites_filter(self):
+        return {'featureFilter': {'includedFeatures': ['FAVOURITES']}}
+
+    def search_media_items(self, filters, page_token=None, page_size=100):
+        self.calls += 1
+        time.sleep(self.latency)
+        favorites = range(0, self.total_items, 50)
+        start = int(page_token or 0)
+        result = {'mediaItems': [self._item(n) for n in favorites[start:start + page_size]]}
+        if start + page_size < len(favorites):
+            result['nextPageToken'] = str(start + page_size)
+        return result
+
+    @staticmethod
+    def _item(n):
+        return {
+            'id': f'item-{n:08d}',
+            'filename': f'IMG_{n:05d}.jpg',
+            'mimeType': 'image/jpeg' if n % 10 else 'video/mp4',
+            'baseUrl': f'https://lh3.googleusercontent.com/lr/{n:040d}',
+            'mediaMetadata': {
+                'creationTime': f'20{10 + n % 14:02d}-{1 + n % 12:02d}-{1 + n % 28:02d}T12:00:00Z',
+                'width': '4032',
+                'height': '3024'
+            }
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--items', type=int, default=60000)
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated seconds per upstream page')
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+
+    api = SimulatedPhotosAPI(args.items, args.latency)
+    pages = -(-args.items // 100)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = MediaIndex('bench', index_dir=tmp)
+
+        start = time.perf_counter()
+        index.sync(lambda: api, parallel=False)
+        cold_crawl = time.perf_counter() - start
+
+        timings = []
+        token = None
+        for _ in range(args.lookups):
+            start = time.perf_counter()
+            page = index.query_page('image', page_token=token)
+            timings.append(time.perf_counter() - start)
+            token = page['nextPageToken']
+
+        api.total_items += 50
+        api.calls = 0
+        start = time.perf_counter()
+        added = index.sync(lambda: api, parallel=False)
+        incremental = time.perf_counter() - start
+        incremental_calls = api.calls
+        index.close()
+
+    timings.sort()
+    print(f'Library: {args.items} items, {pages} upstream pages at {args.latency * 1000:.0f} ms each')
+    print(f'Cold full crawl:        {cold_crawl:8.2f} s')
+    print(f'Live re-list estimate:  {pages * args.latency:8.2f} s per reconnect')
+    print(f'Warm page (p50):        {statistics.median(timings) * 1000:8.3f} ms')
+    print(f'Warm page (p99):        {timings[int(len(timings) * 0.99) - 1] * 1000:8.3f} ms')
+    print(f'Incremental sync:       {incremental:8.2f} s, {incremental_calls} upstream calls, {added} new items')
+
+
+if __name__ == '__main__':
+    main()
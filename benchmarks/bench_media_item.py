@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Memory and per-page processing benchmark for MediaItem.
+
+Compares the per-item dict processing /api/photos used to do (and keeping
+those dicts as an in-memory catalog) with MediaItem.from_page plus
+dumps_page.
+
+Usage: python benchmarks/bench_media_item.py [--items 100000]
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from media_item import MediaItem, dumps_page
+from photos_api import GooglePhotosAPI
+
+
+def build_page(start, size=100):
+    return [{
+        'id': f'AF1QipN{n:040d}',
+        'filename': f'IMG_{n:05d}.jpg',
+        'mimeType': 'image/jpeg' if n % 10 else 'video/mp4',
+        'baseUrl': f'https://lh3.googleusercontent.com/lr/AFBm1_{n:0100d}',
+        'mediaMetadata': {'creationTime': '2021-06-01T12:00:00Z', 'width': '4032', 'height': '3024'}
+    } for n in range(start, start + size)]
+
+
+def legacy_process(api, media_items):
+    """The per-item loop get_photos used before MediaItem"""
+    processed_items = []
+    for item in media_items:
+        mime_type = item.get('mimeType', '')
+        item_type = mime_type.split('/')[0] if mime_type else 'unknown'
+        processed_item = {
+            'id': item['id'],
+            'filename': item['filename'],
+            'mimeType': mime_type,
+            'type': item_type,
+            'baseUrl': item['baseUrl'],
+            'description': item.get('description', ''),
+            'creationTime': item.get('mediaMetadata', {}).get('creationTime', '')
+        }
+        if item_type == 'image':
+            processed_item['displayUrl'] = api.build_image_url(item['baseUrl'])
+            processed_item['thumbnailUrl'] = api.build_thumbnail_url(item['baseUrl'])
+        elif item_type == 'video':
+            processed_item['videoUrl'] = api.build_video_url(item['baseUrl'])
+            processed_item['thumbnailUrl'] = api.build_thumbnail_url(item['baseUrl'])
+        processed_items.append(processed_item)
+    return processed_items
+
+
+def measure_memory(build, pages):
+    tracemalloc.start()
+    catalog = []
+    for page in pages:
+        catalog.extend(build(page))
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, len(catalog)
+
+
+def time_page(func, page, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(page)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--rounds', type=int, default=500)
+    args = parser.parse_args()
+
+    api = GooglePhotosAPI('bench-token')
+    pages = [build_page(start) for start in range(0, args.items, 100)]
+
+    legacy_bytes, count = measure_memory(lambda page: legacy_process(api, page), pages)
+    item_bytes, _ = measure_memory(MediaItem.from_page, pages)
+
+    page = pages[0]
+    legacy_time = time_page(
+        lambda p: json.dumps({'mediaItems': legacy_process(api, p), 'nextPageToken': None}), page, args.rounds
+    )
+    item_time = time_page(lambda p: dumps_page(MediaItem.from_page(p), None, '/media/u/'), page, args.rounds)
+
+    print(f'Catalog of {count} items')
+    print(f'  dicts:      {legacy_bytes / 2 ** 20:8.1f} MiB ({legacy_bytes / count:6.0f} B/item)')
+    print(f'  MediaItem:  {item_bytes / 2 ** 20:8.1f} MiB ({item_bytes / count:6.0f} B/item)')
+    print('Process + serialize one 100-item page')
+    print(f'  dicts:      {legacy_time * 1000:8.3f} ms')
+    print(f'  MediaItem:  {item_time * 1000:8.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Bytes-per-slide and decode-time benchmark for the display size ladder.
+
+Serves synthetic photos through ImageCache for several display types and
+compares the fixed 1920x1080 JPEG every display used to get with the
+ladder rung picked for each screen, as JPEG and in each configured variant
+format. Upstream fetches go to an in-process fake, so no network is used.
+
+Usage: python benchmarks/bench_media_variants.py [--photos 5] [--rounds 5]
+"""
+
+import argparse
+import io
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from config import MEDIA_MASTER_SIZE
+from image_cache import DiskLRUCache, ImageCache, display_size, variant_formats
+
+DISPLAYS = [
+    ('720p kiosk', 1280, 720, 1.0),
+    ('1080p TV', 1920, 1080, 1.0),
+    ('laptop', 1440, 900, 2.0),
+    ('phone', 390, 844, 3.0),
+    ('4K TV', 3840, 2160, 1.0)
+]
+
+
+def synthetic_photo(seed, size=(4032, 3024)):
+    """Smooth gradients, shapes and sensor-like noise, so encoders see photo-like content"""
+    rng = random.Random(seed)
+    small = Image.new('RGB', (64, 48))
+    small.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(64 * 48)])
+    image = small.resize(size, Image.BICUBIC).filter(ImageFilter.GaussianBlur(40))
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        radius = rng.randrange(20, 400)
+        draw.ellipse((x, y, x + radius, y + radius), fill=tuple(rng.randrange(256) for _ in range(3)))
+    noise = Image.effect_noise(size, 24).convert('RGB')
+    return Image.blend(image.filter(ImageFilter.GaussianBlur(2)), noise, 0.08)
+
+
+class FakeTransport:
+    """Answers baseUrl=wW-hH requests like Google, by scaling a local original"""
+
+    def __init__(self, originals):
+        self.originals = originals
+
+    def get(self, url, **kwargs):
+        base_url, _, size = url.rpartition('=')
+        width, height = (int(part[1:]) for part in size.split('-'))
+        image = self.originals[base_url].copy()
+        image.thumbnail((width, height), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=90)
+        return FakeResponse(output.getvalue())
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {'Content-Type': 'image/jpeg'}
+
+    def __init__(self, content):
+        self.content = content
+
+
+def decode_seconds(path, rounds):
+    data = Path(path).read_bytes()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        with Image.open(io.BytesIO(data)) as image:
+            image.load()
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--photos', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=5, help='decodes timed per variant')
+    args = parser.parse_args()
+
+    originals = {f'https://photos.example/{n}': synthetic_photo(n) for n in range(args.photos)}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = ImageCache(DiskLRUCache(cache_dir), transport=FakeTransport(originals))
+
+        def measure(width, height, image_format):
+            total_bytes = total_decode = encode = 0.0
+            for n, base_url in enumerate(originals):
+                start = time.perf_counter()
+                path, _ = cache.get_image(str(n), lambda: base_url, width, height, image_format)
+                encode += time.perf_counter() - start
+                total_bytes += path.stat().st_size
+                total_decode += decode_seconds(path, args.rounds)
+            count = len(originals)
+            return total_bytes / count, total_decode / count, encode / count
+
+        baseline_bytes, baseline_decode, _ = measure(*MEDIA_MASTER_SIZE, 'jpeg')
+        print(f'Baseline: {MEDIA_MASTER_SIZE[0]}x{MEDIA_MASTER_SIZE[1]} JPEG for every display, '
+              f'{baseline_bytes / 1024:.0f} KiB/slide, decode {baseline_decode * 1000:.1f} ms')
+        print(f'\n{"display":<12} {"rung":>10} {"format":>6} {"KiB/slide":>10} {"vs base":>8} '
+              f'{"decode ms":>10} {"first ms":>9}')
+        for name, width, height, dpr in DISPLAYS:
+            rung = display_size(width, height, dpr)
+            for image_format in ('jpeg',) + variant_formats():
+                size, decode, first = measure(*rung, image_format)
+                print(f'{name:<12} {rung[0]:>5}x{rung[1]:<4} {image_format:>6} {size / 1024:>10.0f} '
+                      f'{size / baseline_bytes:>7.0%} {decode * 1000:>10.1f} {first * 1000:>9.1f}')
+        print(f'\n"first ms" is the cache miss: the upstream fetch (faked) plus any local transcode.')
+        print(f'Cache: {cache.stats()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Cost of recording metrics on the request hot path.
+
+Times histogram observations and counter increments from several threads
+at once with the per-thread sharded metrics, against the same histogram
+guarded by a single lock, and the cost of rendering /metrics.
+
+Usage: python benchmarks/bench_metrics.py [--threads 8] [--ops 200000]
+"""
+
+import argparse
+import bisect
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import METRICS_LATENCY_BUCKETS
+from metrics import Registry, Counter, Histogram
+
+
+class LockedHistogram:
+    """Baseline: one shared bucket array behind a lock"""
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 2)
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.counts[-1] += value
+
+
+def run_threads(threads, ops, fn):
+    def worker():
+        for n in range(ops):
+            fn(n)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return (time.perf_counter() - start) / (threads * ops) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=200000, help='observations per thread')
+    args = parser.parse_args()
+
+    registry = Registry()
+    histogram = registry.register(Histogram('bench_seconds', 'bench', ('endpoint',)))
+    counter = registry.register(Counter('bench_total', 'bench', ('endpoint', 'result')))
+    locked = LockedHistogram(METRICS_LATENCY_BUCKETS)
+    values = [0.001 * (n % 997) for n in range(1000)]
+
+    child = histogram.labels('mediaItems')
+    results = {
+        'sharded histogram (observe)': run_threads(
+            args.threads, args.ops, lambda n: child.observe(values[n % 1000])),
+        'sharded histogram (labels + observe)': run_threads(
+            args.threads, args.ops, lambda n: histogram.labels('mediaItems').observe(values[n % 1000])),
+        'locked histogram (observe)': run_threads(
+            args.threads, args.ops, lambda n: locked.observe(values[n % 1000])),
+        'sharded counter (labels + inc)': run_threads(
+            args.threads, args.ops, lambda n: counter.labels('mediaItems', 'sent').inc()),
+    }
+    print(f'{args.threads} threads x {args.ops} operations')
+    for name, nanoseconds in results.items():
+        print(f'  {name:38s} {nanoseconds:7.0f} ns/op')
+
+    expected = args.threads * args.ops
+    text = registry.expose()
+    assert f'bench_seconds_count{{endpoint="mediaItems"}} {expected * 2}' in text, 'lost histogram updates'
+    assert f'bench_total{{endpoint="mediaItems",result="sent"}} {expected}' in text, 'lost counter updates'
+
+    start = time.perf_counter()
+    for _ in range(100):
+        registry.expose()
+    print(f'  render /metrics                         {(time.perf_counter() - start) / 100 * 1e3:7.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
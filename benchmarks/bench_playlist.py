@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Server-side playlist batch latency over a large indexed library.
+
+Fills a temporary media index with synthetic items (every 20th a
+favorite), then times /api/playlist-sized batches for a plain shuffle, a
+type-filtered shuffle and a favorites/recency-weighted shuffle, and checks
+that one full pass visits every item exactly once.
+
+Usage: python benchmarks/bench_playlist.py [--items 50000] [--batch 50]
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from media_index import MediaIndex
+from playlist import Playlist
+
+
+def fill_index(index, total_items):
+    for start in range(0, total_items, 1000):
+        index.upsert_items([{
+            'id': f'item-{n:08d}',
+            'filename': f'IMG_{n:05d}.jpg',
+            'mimeType': 'image/jpeg' if n % 10 else 'video/mp4',
+            'baseUrl': f'https://lh3.googleusercontent.com/lr/{n:040d}',
+            'mediaMetadata': {'creationTime': f'20{10 + n % 14:02d}-{1 + n % 12:02d}-{1 + n % 28:02d}T12:00:00Z'}
+        } for n in range(start, min(start + 1000, total_items))])
+    with index._lock, index._conn:
+        index._conn.execute('UPDATE items SET favorite = 1 WHERE seq % 20 = 0')
+
+
+def time_batches(playlist, batches, batch, **filters):
+    cursor = playlist.start(seed=1)
+    timings = []
+    for _ in range(batches):
+        start = time.perf_counter()
+        playlist.next_batch(cursor, batch, **filters)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return statistics.median(timings) * 1000, timings[int(len(timings) * 0.99) - 1] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--items', type=int, default=50000)
+    parser.add_argument('--batch', type=int, default=50)
+    parser.add_argument('--batches', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = MediaIndex('bench', index_dir=tmp)
+        fill_index(index, args.items)
+        playlist = Playlist(index)
+
+        print(f'Library: {args.items} items, {args.batch} items per batch')
+        for label, filters in (
+            ('Shuffle', {}),
+            ('Images only', {'media_type': 'image'}),
+            ('Weighted', {'weights': ('favorites', 'recency')}),
+        ):
+            p50, p99 = time_batches(playlist, args.batches, args.batch, **filters)
+            print(f'{label:12s} p50 {p50:7.2f} ms   p99 {p99:7.2f} ms')
+
+        cursor = playlist.start(seed=2)
+        seen = set()
+        start = time.perf_counter()
+        while cursor.epoch == 0:
+            seen.update(item.id for item in playlist.next_batch(cursor, 500)['mediaItems'])
+        full_pass = time.perf_counter() - start
+        index.close()
+
+    print(f'Full pass:   {full_pass:7.2f} s, {len(seen)} distinct items')
+
+
+if __name__ == '__main__':
+    main()
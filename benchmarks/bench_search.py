@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Local search benchmark: index build time and query latency on a large library.
+
+Fills a media index in a temporary directory with synthetic items (dated
+filenames, some descriptions, a handful of cameras, a share of videos),
+builds the search index from it and times a mix of word, prefix and facet
+queries, each returning IDs and every facet count.
+
+Usage: python benchmarks/bench_search.py [--items 100000] [--rounds 20]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+CAMERAS = [('Canon', 'Canon EOS R5'), ('Apple', 'iPhone 12'), ('Apple', 'iPhone 15 Pro'),
+           ('NIKON CORPORATION', 'NIKON D750'), ('samsung', 'SM-G991B'), ('', '')]
+WORDS = ['beach', 'sunset', 'birthday', 'dog', 'hiking', 'snow', 'party', 'wedding', 'garden', 'city',
+         'grandma', 'lake', 'concert', 'school', 'christmas']
+
+QUERIES = [
+    ('word', 'beach', {}),
+    ('prefix', 'sun', {}),
+    ('two words', 'dog party', {}),
+    ('all items', '', {}),
+    ('year', '', {'year': ['2021']}),
+    ('year + camera', '', {'year': ['2019', '2020'], 'camera': ['Canon EOS R5']}),
+    ('word + month', 'snow', {'month': ['2018-12']}),
+    ('filename prefix', 'img_2023', {'type': ['image']})
+]
+
+
+def synthetic_items(count, seed=1):
+    rng = random.Random(seed)
+    for n in range(count):
+        year, month, day = rng.randint(2005, 2024), rng.randint(1, 12), rng.randint(1, 28)
+        make, model = rng.choice(CAMERAS)
+        video = rng.random() < 0.1
+        metadata = {'creationTime': f'{year}-{month:02d}-{day:02d}T{rng.randint(0, 23):02d}:00:00Z'}
+        metadata['video' if video else 'photo'] = {'cameraMake': make, 'cameraModel': model} if make else {}
+        yield {
+            'id': f'item-{n:07d}',
+            'filename': f'IMG_{year}{month:02d}{day:02d}_{n:06d}.{"mp4" if video else "jpg"}',
+            'mimeType': 'video/mp4' if video else 'image/jpeg',
+            'baseUrl': f'https://photos.example/{n}',
+            'description': ' '.join(rng.sample(WORDS, 2)) if rng.random() < 0.3 else '',
+            'mediaMetadata': metadata
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--rounds', type=int, default=20, help='times each query is run')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # The index lives under ./data; keep it out of the checkout
+        os.chdir(workdir)
+        from media_index import get_media_index
+        from search_index import get_search_index
+
+        index = get_media_index('bench')
+        batch = []
+        for item in synthetic_items(args.items):
+            batch.append(item)
+            if len(batch) == 1000:
+                index.upsert_items(batch)
+                batch = []
+        index.upsert_items(batch)
+
+        search = get_search_index('bench')
+        start = time.perf_counter()
+        search.search()
+        print(f'Build: {time.perf_counter() - start:.2f} s for {args.items} items, {search.stats()["terms"]} words')
+
+        print(f'\n{"query":<16} {"matches":>8} {"p50 ms":>8} {"p99 ms":>8}')
+        for name, text, filters in QUERIES:
+            timings = []
+            for _ in range(args.rounds):
+                start = time.perf_counter()
+                result = search.search(text, filters)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+            print(f'{name:<16} {result["total"]:>8} {statistics.median(timings):>8.2f} {p99:>8.2f}')
+        index.close()
+        os.chdir(Path(__file__).resolve().parent.parent)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark: import time of the app and time to first response.
+
+Runs `python -X importtime -c "import app"` and sums the self time of each
+top-level package, then starts `main.py` (development server, no reloader)
+and times how long it takes to answer the slideshow page and the first API
+request. Every run uses a fresh temporary working directory, so no real
+tokens or caches are touched. With --baseline the same measurements are
+taken from a git revision checked out into a temporary worktree.
+
+Exits non-zero when --max-first-response-ms is given and the median time to
+the first response exceeds it, so the check can gate a CI job.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 5] [--baseline HEAD~1] [--max-first-response-ms 1500]
+"""
+
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Placeholder credentials and an unreachable auth server: the working directory has no tokens to refresh
+ENV = {
+    'GOOGLE_CLIENT_ID': 'startup-bench',
+    'GOOGLE_CLIENT_SECRET': 'startup-bench',
+    'AUTH_BASE_URL': 'http://127.0.0.1:9',
+    'FLASK_ENV': 'production',
+    'PYTHONDONTWRITEBYTECODE': '1'
+}
+
+IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|\s+(\S+)')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def import_profile(source_dir, workdir):
+    """
+    Import the app once with -X importtime
+    Returns: (total ms for `import app`, {top-level package: self ms})
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=workdir, env={**os.environ, **ENV, 'PYTHONPATH': str(source_dir)},
+        capture_output=True, text=True, check=True
+    )
+    total = 0.0
+    packages = Counter()
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, name = match.groups()
+        packages[name.split('.')[0]] += int(self_us) / 1000
+        if name == 'app':
+            total = int(cumulative_us) / 1000
+    return total, packages
+
+
+def wait_for(url, deadline):
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                response.read()
+                return response.status
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.005)
+    raise TimeoutError(f'{url} did not answer in time')
+
+
+def first_responses(source_dir, workdir, timeout):
+    """
+    Start the server and time its first answers
+    Returns: (ms until GET / answers, ms until GET /api/accounts answers)
+    """
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, str(source_dir / 'main.py'), '--serve', 'development', '--port', str(port)],
+        cwd=workdir, env={**os.environ, **ENV}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = start + timeout
+        wait_for(f'http://127.0.0.1:{port}/', deadline)
+        page = time.perf_counter() - start
+        wait_for(f'http://127.0.0.1:{port}/api/accounts', deadline)
+        api = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+    return page * 1000, api * 1000
+
+
+def measure(source_dir, runs, timeout):
+    imports, pages, apis = [], [], []
+    packages = Counter()
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory(prefix='slideshow-startup-') as workdir:
+            total, run_packages = import_profile(source_dir, workdir)
+            imports.append(total)
+            packages.update(run_packages)
+        with tempfile.TemporaryDirectory(prefix='slideshow-startup-') as workdir:
+            page, api = first_responses(source_dir, workdir, timeout)
+            pages.append(page)
+            apis.append(api)
+    return {
+        'import_ms': statistics.median(imports),
+        'first_page_ms': statistics.median(pages),
+        'first_api_ms': statistics.median(apis),
+        'packages': {name: ms / runs for name, ms in packages.items()}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5, help='cold starts measured; medians are reported')
+    parser.add_argument('--top', type=int, default=12, help='heaviest packages listed')
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds to wait for the server')
+    parser.add_argument('--baseline', help='git revision to compare with')
+    parser.add_argument('--max-first-response-ms', type=float,
+                        help='fail when the median time to the first response is longer')
+    args = parser.parse_args()
+
+    results = {'current': measure(ROOT, args.runs, args.timeout)}
+    if args.baseline:
+        with tempfile.TemporaryDirectory(prefix='slideshow-baseline-') as worktree:
+            subprocess.run(['git', 'worktree', 'add', '--detach', worktree, args.baseline],
+                           cwd=ROOT, check=True, capture_output=True)
+            try:
+                results[args.baseline] = measure(Path(worktree), args.runs, args.timeout)
+            finally:
+                subprocess.run(['git', 'worktree', 'remove', '--force', worktree], cwd=ROOT, capture_output=True)
+
+    print(f'Medians of {args.runs} cold starts\n')
+    print(f'{"":<16}' + ''.join(f'{name:>14}' for name in results))
+    for metric, label in (('import_ms', 'import app'), ('first_page_ms', 'first page'),
+                          ('first_api_ms', 'first API call')):
+        print(f'{label:<16}' + ''.join(f'{result[metric]:>11.0f} ms' for result in results.values()))
+
+    current = results['current']['packages']
+    heaviest = sorted(current, key=current.get, reverse=True)[:args.top]
+    print('\nSelf import time by package (ms)')
+    for name in heaviest:
+        print(f'  {name:<24}' + ''.join(f'{result["packages"].get(name, 0.0):>8.1f}' for result in results.values()))
+    if args.baseline:
+        baseline = results[args.baseline]['packages']
+        deferred = sorted(set(baseline) - set(current), key=baseline.get, reverse=True)[:args.top]
+        if deferred:
+            print('\nNo longer imported at startup: ' +
+                  ', '.join(f'{name} ({baseline[name]:.1f} ms)' for name in deferred))
+
+    limit = args.max_first_response_ms
+    if limit is not None and results['current']['first_page_ms'] > limit:
+        print(f'\nFirst response took {results["current"]["first_page_ms"]:.0f} ms, over the {limit:.0f} ms limit')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Sync hub benchmark: cost of idle displays and how closely a group's slides arrive.
+
+Serves the sync hub from a temporary directory with synthetic slides, opens
+many event-stream connections to one group and lets the group play for a
+while. Reports the process's threads and memory per connected display, how
+far apart the displays received each slide (fan-out spread) and how long
+before its start time the last display had it.
+
+Memory is measured in this process, which also runs the clients, so the
+figure per display is an upper bound for the hub's share.
+
+Usage: python benchmarks/bench_sync.py [--displays 2000] [--seconds 15] [--speed 1]
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def rss_bytes():
+    """Resident memory of this process, from /proc where available"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def fake_slides(settings, cursor):
+    from media_item import MediaItem
+    start = int(cursor or 0)
+    items = [
+        MediaItem(f'item-{n:07d}', f'IMG_{n:06d}.jpg', 'image/jpeg', f'https://photos.example/{n}', '',
+                  '2024-01-01T00:00:00Z')
+        for n in range(start, start + 20)
+    ]
+    return items, str(start + 20)
+
+
+async def display(session, url, arrivals, connected):
+    """One display: read the stream, recording when each slide arrived and when it starts"""
+    import json
+    async with session.get(url) as response:
+        connected.release()
+        kind = None
+        async for line in response.content:
+            line = line.decode().rstrip('\n')
+            if line.startswith('event: '):
+                kind = line[7:]
+            elif line.startswith('data: ') and kind == 'slide':
+                payload = json.loads(line[6:])
+                arrivals.setdefault(payload['index'], []).append((time.time() * 1000, payload['startsAt']))
+
+
+async def run_clients(args, url):
+    import aiohttp
+    arrivals = {}
+    connected = asyncio.Semaphore(0)
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=None)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        threads_before, rss_before = threading.active_count(), rss_bytes()
+        start = time.perf_counter()
+        tasks = []
+        for n in range(args.displays):
+            tasks.append(asyncio.ensure_future(display(session, url, arrivals, connected)))
+            if n % 200 == 199:
+                await asyncio.sleep(0)  # let the batch connect before opening more
+        for _ in range(args.displays):
+            await connected.acquire()
+        connect_seconds = time.perf_counter() - start
+        await asyncio.sleep(1)
+        threads, rss = threading.active_count(), rss_bytes()
+
+        await asyncio.sleep(args.seconds)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    print(f'Connected {args.displays} displays in {connect_seconds:.2f} s')
+    print(f'Threads: {threads_before} before, {threads} with every display connected')
+    print(f'Memory: {(rss - rss_before) / 1e6:.1f} MB more, {(rss - rss_before) / args.displays / 1024:.1f} KiB '
+          f'per display (hub and client)')
+
+    spreads, leads = [], []
+    for index, received in sorted(arrivals.items()):
+        if len(received) < args.displays:
+            continue  # a slide announced while displays were still connecting
+        times = [arrived for arrived, _ in received]
+        spreads.append(max(times) - min(times))
+        leads.append(received[0][1] - max(times))
+    if not spreads:
+        print('No slide reached every display; try more --seconds')
+        return
+    spreads.sort()
+    print(f'\n{"slides":>6} {"spread p50 ms":>14} {"spread max ms":>14} {"lead min ms":>12}')
+    print(f'{len(spreads):>6} {statistics.median(spreads):>14.1f} {spreads[-1]:>14.1f} {min(leads):>12.1f}')
+    print('(lead: time between the last display receiving a slide and its start time; '
+          'a negative lead means displays switched late)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--displays', type=int, default=2000)
+    parser.add_argument('--seconds', type=float, default=15, help='how long the group plays')
+    parser.add_argument('--speed', type=float, default=1, help='seconds per slide')
+    args = parser.parse_args()
+
+    # Each display holds a socket at both ends
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = args.displays * 2 + 256
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+        if hard < wanted:
+            print(f'Open file limit is {hard}; raise it (ulimit -n) for {args.displays} displays')
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Groups live in the state store under ./data; keep it out of the checkout
+        os.chdir(workdir)
+        os.makedirs('data')
+        from sync_groups import save_group
+        from sync_hub import SyncHub, start_sync_hub
+
+        port = free_port()
+        save_group('bench', {'user_id': 'bench', 'speed': args.speed, 'seed': 1, 'type': 'image',
+                             'weights': [], 'dedupe': False, 'media': '/media/bench/'})
+        start_sync_hub(SyncHub(fake_slides), '127.0.0.1', port)
+        time.sleep(0.5)
+
+        url = f'http://127.0.0.1:{port}/events/bench?vw=1920&vh=1080&dpr=1&formats=image/webp'
+        asyncio.run(run_clients(args, url))
+        os.chdir(Path(__file__).resolve().parent.parent)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Token store stress test: concurrent refreshes, logins and reads across worker processes.
+
+Runs the same mix of operations from several processes with several threads
+each, first against per-user JSON token files written in place (how tokens
+were stored before) and then against the SQLite token store:
+
+- refresh: rewrite an account's access token and expiry
+- read: load an account's credentials and check they parse and belong to it
+- list: list every account
+
+Against the token store each thread also merges a counter field of its own
+into the accounts it refreshes. At the end every counter must equal the
+number of refreshes that thread made, so a lost or torn update fails the
+run. Reports operations per second, torn reads and account listing latency.
+
+Usage: python benchmarks/bench_token_store.py [--processes 4] [--threads 8] [--seconds 5] [--accounts 200]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+REFRESH_SHARE = 0.3
+LIST_SHARE = 0.05
+
+
+def credentials(user_id, serial):
+    return {
+        'token': f'{user_id}:access-{serial}',
+        'refresh_token': f'{user_id}:refresh',
+        'email': f'{user_id}@example.com',
+        'user_id': user_id,
+        'expiry': '2030-01-01 00:00:00.000000'
+    }
+
+
+def file_worker(workdir, worker, threads, seconds, accounts, results):
+    """Old layout: one JSON file per account, rewritten in place"""
+    tokens_dir = Path(workdir) / 'tokens'
+    counts = {'refresh': 0, 'read': 0, 'list': 0, 'torn_reads': 0, 'list_ms': []}
+    lock = threading.Lock()
+
+    def run(thread):
+        rng = random.Random(worker * 1000 + thread)
+        local = {'refresh': 0, 'read': 0, 'list': 0, 'torn_reads': 0, 'list_ms': []}
+        stop_at = time.time() + seconds
+        while time.time() < stop_at:
+            user_id = f'user-{rng.randrange(accounts)}'
+            roll = rng.random()
+            if roll < REFRESH_SHARE:
+                with open(tokens_dir / f'{user_id}.json', 'w') as f:
+                    json.dump(credentials(user_id, rng.random()), f)
+                local['refresh'] += 1
+            elif roll < REFRESH_SHARE + LIST_SHARE:
+                start = time.perf_counter()
+                listed = []
+                for token_file in tokens_dir.glob('*.json'):
+                    try:
+                        with open(token_file) as f:
+                            listed.append(json.load(f)['email'])
+                    except (json.JSONDecodeError, KeyError):
+                        local['torn_reads'] += 1
+                local['list_ms'].append((time.perf_counter() - start) * 1000)
+                local['list'] += 1
+            else:
+                try:
+                    with open(tokens_dir / f'{user_id}.json') as f:
+                        if not json.load(f)['token'].startswith(f'{user_id}:'):
+                            local['torn_reads'] += 1
+                except (json.JSONDecodeError, KeyError):
+                    local['torn_reads'] += 1
+                local['read'] += 1
+        with lock:
+            for key, value in local.items():
+                counts[key] += value
+
+    workers = [threading.Thread(target=run, args=(thread,)) for thread in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    results.put(counts)
+
+
+def store_worker(workdir, worker, threads, seconds, accounts, results):
+    """Token store: refreshes are merged updates in a transaction"""
+    from token_store import TokenStore
+    store = TokenStore(str(Path(workdir) / 'tokens.sqlite3'), str(Path(workdir) / 'none'))
+    counts = {'refresh': 0, 'read': 0, 'list': 0, 'torn_reads': 0, 'list_ms': [], 'expected': {}}
+    lock = threading.Lock()
+
+    def run(thread):
+        rng = random.Random(worker * 1000 + thread)
+        field = f'n_{worker}_{thread}'
+        local = {'refresh': 0, 'read': 0, 'list': 0, 'torn_reads': 0, 'list_ms': []}
+        expected = {}
+        versions = {}
+        stop_at = time.time() + seconds
+        while time.time() < stop_at:
+            user_id = f'user-{rng.randrange(accounts)}'
+            roll = rng.random()
+            if roll < REFRESH_SHARE:
+                expected[user_id] = expected.get(user_id, 0) + 1
+                store.update(user_id, {'token': f'{user_id}:access-{rng.random()}', field: expected[user_id]})
+                local['refresh'] += 1
+            elif roll < REFRESH_SHARE + LIST_SHARE:
+                start = time.perf_counter()
+                listed = store.accounts()
+                local['list_ms'].append((time.perf_counter() - start) * 1000)
+                if len(listed) != accounts:
+                    local['torn_reads'] += 1
+                local['list'] += 1
+            else:
+                creds, version = store.get(user_id)
+                # Versions only move forward, and a thread sees its own refreshes
+                if not creds['token'].startswith(f'{user_id}:') or version < versions.get(user_id, 0) or \
+                        creds.get(field, 0) != expected.get(user_id, 0):
+                    local['torn_reads'] += 1
+                versions[user_id] = version
+                local['read'] += 1
+        with lock:
+            for key, value in local.items():
+                counts[key] += value
+            counts['expected'].update({f'{user_id}/{field}': n for user_id, n in expected.items()})
+
+    workers = [threading.Thread(target=run, args=(thread,)) for thread in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    store.close()
+    results.put(counts)
+
+
+def run_phase(target, args, workdir):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [
+        context.Process(target=target, args=(workdir, n, args.threads, args.seconds, args.accounts, results))
+        for n in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    counts = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    total = {key: sum(count[key] for count in counts) for key in ('refresh', 'read', 'list', 'torn_reads')}
+    total['list_ms'] = [ms for count in counts for ms in count['list_ms']]
+    total['expected'] = {key: n for count in counts for key, n in count.get('expected', {}).items()}
+    return total
+
+
+def report(name, total, seconds):
+    ops = total['refresh'] + total['read'] + total['list']
+    list_ms = total['list_ms'] or [0]
+    print(f'{name:<12} {ops / seconds:>10.0f} {total["refresh"]:>9} {total["read"]:>9} {total["torn_reads"]:>6} '
+          f'{statistics.median(list_ms):>11.3f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--processes', type=int, default=4, help='worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='threads per process')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--accounts', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        tokens_dir = Path(workdir) / 'tokens'
+        tokens_dir.mkdir()
+        for n in range(args.accounts):
+            with open(tokens_dir / f'user-{n}.json', 'w') as f:
+                json.dump(credentials(f'user-{n}', 0), f)
+
+        from token_store import TokenStore
+        start = time.perf_counter()
+        store = TokenStore(str(Path(workdir) / 'tokens.sqlite3'), str(tokens_dir))
+        print(f'Migrated {len(store.accounts())} token files in {(time.perf_counter() - start) * 1000:.1f} ms')
+        store.close()
+
+        print(f'\n{args.processes} processes x {args.threads} threads, {args.seconds:g} s, {args.accounts} accounts')
+        print(f'{"":<12} {"ops/s":>10} {"refreshes":>9} {"reads":>9} {"torn":>6} {"list p50 ms":>11}')
+        report('json files', run_phase(file_worker, args, workdir), args.seconds)
+        total = run_phase(store_worker, args, workdir)
+        report('token store', total, args.seconds)
+
+        store = TokenStore(str(Path(workdir) / 'tokens.sqlite3'), str(tokens_dir))
+        lost = 0
+        for key, n in total['expected'].items():
+            user_id, field = key.split('/')
+            creds, _ = store.get(user_id)
+            if creds.get(field) != n:
+                lost += 1
+        integrity = store._conn.execute('PRAGMA integrity_check').fetchone()[0]
+        store.close()
+        print(f'\nToken store: {lost} lost updates out of {len(total["expected"])} counters, integrity {integrity}')
+        if lost or total['torn_reads'] or integrity != 'ok':
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+HTTP load test for comparing the development and production servers.
+
+Either points at a server that is already running (--url), or starts
+`main.py --serve <mode>` for each requested mode on a free port, drives it
+with concurrent keep-alive clients for a fixed duration, and prints
+requests/sec and latency percentiles per mode.
+
+Usage:
+    python benchmarks/load_test.py --modes development,production
+    python benchmarks/load_test.py --url http://localhost:5000 --paths /api/stats
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_PATHS = '/,/api/settings,/api/stats'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, port, workers, threads):
+    process = subprocess.Popen(
+        [sys.executable, 'main.py', '--serve', mode, '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--threads', str(threads)],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        env={**os.environ, 'FLASK_ENV': 'production'}
+    )
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(f'{url}/api/settings', timeout=1)
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+def run_load(url, paths, concurrency, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client(offset):
+        session = requests.Session()
+        local, failed, n = [], 0, offset
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                response = session.get(url + paths[n % len(paths)], timeout=30)
+                response.content
+                if response.status_code >= 500:
+                    failed += 1
+            except requests.RequestException:
+                failed += 1
+            local.append(time.perf_counter() - start)
+            n += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', help='load an already running server instead of starting one')
+    parser.add_argument('--modes', default='development,production')
+    parser.add_argument('--paths', default=DEFAULT_PATHS, help='comma-separated paths, requested round-robin')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per run')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    paths = args.paths.split(',')
+    targets = [('given', args.url)] if args.url else [(mode, None) for mode in args.modes.split(',')]
+
+    print(f'{args.concurrency} clients, {args.duration:.0f} s per run, paths: {", ".join(paths)}')
+    for mode, url in targets:
+        process = None
+        if url is None:
+            process, url = start_server(mode, free_port(), args.workers, args.threads)
+        try:
+            result = run_load(url, paths, args.concurrency, args.duration)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+        print(f'{mode:12s} {result["rps"]:8.0f} req/s  p50 {result["p50_ms"]:6.1f} ms  '
+              f'p95 {result["p95_ms"]:6.1f} ms  p99 {result["p99_ms"]:6.1f} ms  '
+              f'errors {result["errors"]}/{result["requests"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark scenarios against the local Photos API stand-in.
+
+Starts benchmarks/stub_server.py in-process, points the app at it through
+GOOGLE_PHOTOS_API_BASE / AUTH_BASE_URL / GOOGLE_OPENID_URL, and runs the
+app from a temporary working directory so no real tokens or caches are
+touched. Scenarios:
+
+    crawl    cold library crawl into an empty media index (serial and parallel)
+    displays concurrent displays paging /api/photos and loading /media images
+    storm    every account's token expired at once, hit by concurrent requests
+    mirror   offline mirror of albums, one download at a time and in parallel,
+             then an incremental re-sync
+    wire     bytes per /api/photos and /api/albums page, plain, compressed and
+             compact, and the cost of re-polling an unchanged page
+    video    time to the first byte and to the first seconds of each clip,
+             straight from Google, proxied cold, prefetched, and seeking
+
+Each scenario reports throughput and p50/p99 latencies. Results are written
+as JSON (benchmarks/results/<timestamp>.json by default) and can be
+compared with an earlier run.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--scenarios crawl,displays,storm] [--displays 50]
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<earlier>.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+
+from stub_server import StubPhotosServer
+
+SCENARIOS = ('crawl', 'displays', 'storm', 'mirror', 'wire', 'video')
+
+
+def percentiles(latencies):
+    """Returns: count, p50, p90 and p99 in milliseconds"""
+    ordered = sorted(latencies)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 2) if ordered else None
+
+    return {'count': len(ordered), 'p50_ms': pick(0.50), 'p90_ms': pick(0.90), 'p99_ms': pick(0.99)}
+
+
+class Recorder:
+    """Thread-safe latency samples per operation"""
+
+    def __init__(self):
+        self._samples = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, ok=True):
+        with self._lock:
+            self._samples.setdefault(name, []).append(seconds)
+            if not ok:
+                self._errors[name] = self._errors.get(name, 0) + 1
+
+    def report(self, elapsed):
+        with self._lock:
+            return {
+                name: {**percentiles(samples), 'per_second': round(len(samples) / elapsed, 1),
+                       'errors': self._errors.get(name, 0)}
+                for name, samples in sorted(self._samples.items())
+            }
+
+
+def write_token(user_id, token, expires_in):
+    from token_store import get_token_store
+    get_token_store().save(user_id, {
+        'token': token['access_token'],
+        'refresh_token': token['refresh_token'],
+        'email': f'{user_id}@example.com',
+        'user_id': user_id,
+        'expiry': datetime.datetime.utcnow() + datetime.timedelta(seconds=expires_in)
+    })
+
+
+def scenario_crawl(stub, args):
+    """Cold crawl of the whole stub library into a fresh index, serially and with per-year searches"""
+    from media_index import MediaIndex
+    from photos_api import GooglePhotosAPI
+    from rate_limiter import BACKGROUND, RateLimiter
+
+    token = stub.issue_token(ttl=24 * 3600)['access_token']
+    results = {}
+    for mode in ('serial', 'parallel'):
+        stub.reset_stats()
+        limiter = RateLimiter()
+        with tempfile.TemporaryDirectory() as index_dir:
+            index = MediaIndex(f'crawl-{mode}', index_dir)
+
+            def api_factory():
+                return GooglePhotosAPI(token, api_base=stub.api_base, account=f'crawl-{mode}',
+                                       priority=BACKGROUND, rate_limiter=limiter)
+
+            start = time.perf_counter()
+            added = index.sync(api_factory, parallel=mode == 'parallel')
+            elapsed = time.perf_counter() - start
+            upstream = stub.stats()
+            results[mode] = {
+                'seconds': round(elapsed, 2),
+                'items': added,
+                'complete': index.is_complete(),
+                'items_per_second': round(added / elapsed, 1),
+                'upstream_requests': upstream['requests'],
+                'upstream_throttled': upstream['throttled']
+            }
+            index.close()
+        print(f'  crawl {mode:8s} {added} items in {elapsed:.2f} s '
+              f'({upstream["requests"]} requests, {upstream["throttled"]} throttled)')
+    return results
+
+
+def scenario_displays(stub, args):
+    """Concurrent displays paging through /api/photos and loading each slide through /media"""
+    import app as app_module
+
+    flask_app = app_module.create_app()
+    user_ids = [f'display-account-{n}' for n in range(args.accounts)]
+    for user_id in user_ids:
+        write_token(user_id, stub.issue_token(ttl=24 * 3600), 24 * 3600)
+
+    stub.reset_stats()
+    recorder = Recorder()
+    stop_at = time.perf_counter() + args.duration
+
+    def display(n):
+        client = flask_app.test_client()
+        user_id = user_ids[n % len(user_ids)]
+        rng = random.Random(n)
+        page_token = None
+        while time.perf_counter() < stop_at:
+            query = f'?page_token={page_token}' if page_token else ''
+            start = time.perf_counter()
+            response = client.get(f'/api/photos/{user_id}{query}')
+            recorder.add('api_photos', time.perf_counter() - start, response.status_code == 200)
+            if response.status_code != 200:
+                continue
+            page = response.get_json()
+            page_token = page.get('nextPageToken')
+            for item in page['mediaItems'][:args.slides_per_page]:
+                if time.perf_counter() >= stop_at:
+                    break
+                width, height = rng.choice(((1920, 1080), (1280, 720), (3840, 2160)))
+                start = time.perf_counter()
+                response = client.get(f'/media/{user_id}/{item["id"]}?w={width}&h={height}')
+                response.get_data()
+                recorder.add('media', time.perf_counter() - start, response.status_code == 200)
+
+    threads = [threading.Thread(target=display, args=(n,)) for n in range(args.displays)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    upstream = stub.stats()
+    report = recorder.report(elapsed)
+    for name, stats in report.items():
+        print(f'  {name:12s} {stats["per_second"]:8.1f} req/s  p50 {stats["p50_ms"]} ms  '
+              f'p99 {stats["p99_ms"]} ms  errors {stats["errors"]}/{stats["count"]}')
+    return {
+        'displays': args.displays,
+        'accounts': args.accounts,
+        'seconds': round(elapsed, 2),
+        'routes': report,
+        'upstream_requests': upstream['requests'],
+        'upstream_throttled': upstream['throttled']
+    }
+
+
+def scenario_storm(stub, args):
+    """Every account's token has expired; concurrent requests must trigger one refresh per account"""
+    import app as app_module
+
+    flask_app = app_module.create_app()
+    app_module._init_services()
+    user_ids = [f'storm-account-{n}' for n in range(args.accounts)]
+    for user_id in user_ids:
+        write_token(user_id, stub.issue_token(ttl=1), -60)
+
+    stub.reset_stats()
+    recorder = Recorder()
+    barrier = threading.Barrier(args.storm_clients)
+
+    def client_thread(n):
+        client = flask_app.test_client()
+        rng = random.Random(n)
+        barrier.wait()
+        for _ in range(args.storm_requests):
+            user_id = rng.choice(user_ids)
+            start = time.perf_counter()
+            creds = app_module.auth_handler.read_credentials(user_id)
+            recorder.add('read_credentials', time.perf_counter() - start, creds is not None)
+            start = time.perf_counter()
+            response = client.get(f'/api/albums/{user_id}')
+            recorder.add('api_albums', time.perf_counter() - start, response.status_code == 200)
+
+    threads = [threading.Thread(target=client_thread, args=(n,)) for n in range(args.storm_clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    by_endpoint = stub.stats()['by_endpoint']
+    refreshes = by_endpoint.get('refresh 200', 0)
+    report = recorder.report(elapsed)
+    for name, stats in report.items():
+        print(f'  {name:16s} {stats["per_second"]:8.1f} /s  p50 {stats["p50_ms"]} ms  '
+              f'p99 {stats["p99_ms"]} ms  errors {stats["errors"]}/{stats["count"]}')
+    print(f'  token refreshes: {refreshes} for {len(user_ids)} expired accounts')
+    return {
+        'accounts': len(user_ids),
+        'clients': args.storm_clients,
+        'seconds': round(elapsed, 2),
+        'refreshes': refreshes,
+        'calls': report,
+        'upstream': by_endpoint
+    }
+
+
+def scenario_mirror(stub, args):
+    """Mirror albums into an empty store with one download worker and with MIRROR_WORKERS, then re-sync"""
+    from config import MIRROR_WORKERS
+    from mirror import MediaMirror
+    from photos_api import GooglePhotosAPI
+    from rate_limiter import BACKGROUND, RateLimiter
+
+    token = stub.issue_token(ttl=24 * 3600)['access_token']
+    limiter = RateLimiter()
+
+    def api_factory():
+        return GooglePhotosAPI(token, api_base=stub.api_base, account='mirror', priority=BACKGROUND,
+                               rate_limiter=limiter)
+
+    results = {}
+    for workers in sorted({1, MIRROR_WORKERS}):
+        with tempfile.TemporaryDirectory() as mirror_dir:
+            mirror = MediaMirror(mirror_dir, workers=workers)
+            for k in range(args.mirror_albums):
+                mirror.add_album('mirror', f'album-{k}')
+            stub.reset_stats()
+            start = time.perf_counter()
+            counts = mirror.sync('mirror', api_factory)
+            elapsed = time.perf_counter() - start
+            status = mirror.status('mirror')
+
+            start = time.perf_counter()
+            again = mirror.sync('mirror', api_factory)
+            resync = time.perf_counter() - start
+            mirror.close()
+
+        rate = counts['downloaded'] / elapsed
+        results[f'workers_{workers}'] = {
+            'seconds': round(elapsed, 2),
+            'items': counts['downloaded'],
+            'failed': counts['failed'],
+            'items_per_second': round(rate, 1),
+            'megabytes_per_second': round(status['bytes'] / elapsed / 1024 ** 2, 1),
+            'minutes_per_10k': round(10000 / rate / 60, 1) if rate else None,
+            'resync_seconds': round(resync, 2),
+            'resync_downloaded': again['downloaded']
+        }
+        print(f'  {workers:2d} workers  {counts["downloaded"]} images in {elapsed:.2f} s '
+              f'({rate:.0f}/s, ~{10000 / rate / 60 if rate else 0:.1f} min per 10k); '
+              f're-sync {resync:.2f} s, {again["downloaded"]} downloaded')
+    return results
+
+
+def scenario_wire(stub, args):
+    """Bytes on the wire per /api/photos and /api/albums page: plain, gzip, brotli, compact, and revalidated"""
+    import gzip
+    import app as app_module
+    from compression import ENCODINGS
+    from media_index import get_media_index
+
+    user_id = 'wire-account'
+    write_token(user_id, stub.issue_token(ttl=24 * 3600), 24 * 3600)
+    client = app_module.create_app().test_client()
+
+    # Let the index sync finish first, so every variant is served the same pages
+    client.get(f'/api/photos/{user_id}')
+    deadline = time.perf_counter() + 120
+    while not get_media_index(user_id).is_complete() and time.perf_counter() < deadline:
+        time.sleep(0.2)
+
+    variants = [('json', False, None), ('compact', True, None)]
+    for encoding in ENCODINGS:
+        variants += [(encoding, False, encoding), (f'compact+{encoding}', True, encoding)]
+
+    results = {}
+    for route in ('photos', 'albums'):
+        baseline = None
+        for name, compact, encoding in variants:
+            headers = {'Accept-Encoding': encoding or 'identity'}
+            query = {'vw': 1920, 'vh': 1080, 'compact': 'true' if compact else 'false'}
+            sizes, timings, page_token, etag = [], [], None, None
+            for _ in range(args.wire_pages):
+                start = time.perf_counter()
+                response = client.get(f'/api/{route}/{user_id}', headers=headers,
+                                      query_string={**query, **({'page_token': page_token} if page_token else {})})
+                timings.append(time.perf_counter() - start)
+                body = response.get_data()
+                sizes.append(len(body))
+                etag = etag or response.headers.get('ETag')
+                if encoding == 'gzip':
+                    body = gzip.decompress(body)
+                elif encoding == 'br':
+                    import brotli
+                    body = brotli.decompress(body)
+                page_token = json.loads(body).get('nextPageToken')
+                if not page_token:
+                    break
+
+            # A display re-polling the first page with the tag it was given
+            revalidated = client.get(f'/api/{route}/{user_id}', headers={**headers, 'If-None-Match': etag},
+                                     query_string=query)
+            per_page = sum(sizes) / len(sizes)
+            baseline = baseline or per_page
+            results[f'{route}_{name.replace("+", "_")}'] = {
+                'pages': len(sizes),
+                'bytes_per_page': round(per_page),
+                'vs_json': round(per_page / baseline, 3),
+                'p50_ms': percentiles(timings)['p50_ms'],
+                'revalidate_status': revalidated.status_code,
+                'revalidate_bytes': len(revalidated.get_data())
+            }
+            print(f'  {route:7s} {name:14s} {per_page / 1024:8.1f} KiB/page  {per_page / baseline:6.1%}  '
+                  f'p50 {percentiles(timings)["p50_ms"]} ms  re-poll: {revalidated.status_code}, '
+                  f'{len(revalidated.get_data())} bytes')
+    return results
+
+
+def scenario_video(stub, args):
+    """Startup of video clips: direct from Google, through the proxy cold, after prefetch, and seeking"""
+    import requests
+    import app as app_module
+    from config import VIDEO_HEAD_BYTES
+
+    user_id = 'video-account'
+    write_token(user_id, stub.issue_token(ttl=24 * 3600), 24 * 3600)
+    client = app_module.create_app().test_client()
+    app_module._init_services()
+    # Stub item n is a video when n % 10 == 9; use the oldest ones, past the pages other scenarios touch
+    videos = list(range(9, stub.library.size, 10))[-2 * args.video_clips:]
+    if len(videos) < 2 * args.video_clips:
+        print(f'  a {stub.library.size}-item library has {len(videos)} videos; '
+              f'--video-clips {args.video_clips} needs {2 * args.video_clips}')
+        return {}
+    clips, fresh = videos[:args.video_clips], videos[args.video_clips:]
+    errors = {}
+
+    def timed(name, read, length):
+        """
+        Read up to VIDEO_HEAD_BYTES of a clip, counting error statuses and short reads as errors
+        Returns: seconds to the first byte and to the first VIDEO_HEAD_BYTES, or None on an error
+        """
+        start = time.perf_counter()
+        first_byte, received = None, 0
+        chunks = read()
+        status = next(chunks)
+        if status in (200, 206):
+            for chunk in chunks:
+                first_byte = first_byte or time.perf_counter() - start
+                received += len(chunk)
+                if received >= VIDEO_HEAD_BYTES:
+                    break
+        elapsed = time.perf_counter() - start
+        chunks.close()
+        if status not in (200, 206) or received < min(VIDEO_HEAD_BYTES, length):
+            errors[name] = errors.get(name, 0) + 1
+            return None
+        return first_byte, elapsed
+
+    def direct(n):
+        def read():
+            with requests.get(f'{stub.library.media_url(n)}=dv', stream=True) as response:
+                yield response.status_code
+                yield from response.iter_content(64 * 1024)
+        return read
+
+    def proxied(n, headers=None):
+        def read():
+            response = client.get(f'/media/{user_id}/stub-{n:07d}/video', headers=headers or {}, buffered=False)
+            try:
+                yield response.status_code
+                yield from response.iter_encoded()
+            finally:
+                response.close()
+        return read
+
+    results = {
+        'direct': [timed('direct', direct(n), stub.video_bytes) for n in clips],
+        'proxy_cold': [timed('proxy_cold', proxied(n), stub.video_bytes) for n in clips]
+    }
+
+    # A display reporting other clips as its next slides, then playing them
+    client.post('/api/prefetch/video-display', json={
+        'user_id': user_id, 'type': 'all', 'position': 0, 'lookahead': len(fresh),
+        'items': [f'stub-{n:07d}' for n in fresh], 'videos': [f'stub-{n:07d}' for n in fresh]
+    })
+    deadline = time.perf_counter() + 60
+    while time.perf_counter() < deadline and \
+            not all(app_module.video_proxy.is_cached(f'stub-{n:07d}') for n in fresh):
+        time.sleep(0.05)
+    results['prefetched'] = [timed('prefetched', proxied(n), stub.video_bytes) for n in fresh]
+    middle = stub.video_bytes // 2
+    results['seek'] = [timed('seek', proxied(n, {'Range': f'bytes={middle}-'}), stub.video_bytes - middle)
+                       for n in fresh]
+
+    report = {}
+    for name, samples in results.items():
+        samples = [sample for sample in samples if sample is not None]
+        first_bytes = percentiles([first for first, _ in samples])
+        heads = percentiles([head for _, head in samples])
+        report[name] = {'first_byte_p50_ms': first_bytes['p50_ms'], 'first_byte_p99_ms': first_bytes['p99_ms'],
+                        'head_p50_ms': heads['p50_ms'], 'head_p99_ms': heads['p99_ms'],
+                        'errors': errors.get(name, 0)}
+        print(f'  {name:11s} first byte p50 {first_bytes["p50_ms"]:>8} ms   '
+              f'first {VIDEO_HEAD_BYTES // 1024} KiB p50 {heads["p50_ms"]:>8} ms   '
+              f'errors {errors.get(name, 0)}/{len(results[name])}')
+    report['video_stats'] = {key: value for key, value in app_module.video_proxy.stats().items()
+                             if isinstance(value, int)}
+    return report
+
+
+def flatten(results, prefix=''):
+    """Numeric leaves of a results tree keyed by dotted path"""
+    flat = {}
+    for key, value in results.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{path}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(previous, current):
+    """Print metrics that moved by more than 5% between two result files"""
+    before, after = flatten(previous['scenarios']), flatten(current['scenarios'])
+    watched = ('per_second', 'items_per_second', 'p50_ms', 'p99_ms', 'seconds', 'upstream_requests', 'refreshes')
+    print(f'\nCompared with {previous["meta"]["timestamp"]} ({previous["meta"].get("commit", "?")}):')
+    for path in sorted(set(before) & set(after)):
+        if not path.endswith(watched) or not before[path]:
+            continue
+        change = (after[path] - before[path]) / before[path]
+        if abs(change) >= 0.05:
+            print(f'  {path:55s} {before[path]:>10} -> {after[path]:>10}  ({change:+.0%})')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--items', type=int, default=20000, help='stub library size')
+    parser.add_argument('--latency', type=float, default=0.03, help='stub API latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of stub API calls answered with 429')
+    parser.add_argument('--max-rps', type=float, default=0.0, help='stub 429s above this many calls per second')
+    parser.add_argument('--refresh-latency', type=float, default=0.2, help='stub token refresh latency')
+    parser.add_argument('--displays', type=int, default=50)
+    parser.add_argument('--accounts', type=int, default=5)
+    parser.add_argument('--duration', type=float, default=15.0, help='seconds the displays scenario runs')
+    parser.add_argument('--slides-per-page', type=int, default=10)
+    parser.add_argument('--storm-clients', type=int, default=50)
+    parser.add_argument('--storm-requests', type=int, default=10, help='requests per storm client')
+    parser.add_argument('--mirror-albums', type=int, default=1, help='stub albums the mirror scenario copies')
+    parser.add_argument('--image-bytes', type=int, default=200000, help='size of stub images')
+    parser.add_argument('--wire-pages', type=int, default=5, help='pages per variant in the wire scenario')
+    parser.add_argument('--video-clips', type=int, default=6, help='clips per variant in the video scenario')
+    parser.add_argument('--video-bandwidth', type=float, default=2.5e6,
+                        help='stub video bytes per second per response')
+    parser.add_argument('--output', help='results file (default benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare with')
+    args = parser.parse_args()
+
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    stub = StubPhotosServer(items=args.items, latency=args.latency, jitter=args.jitter,
+                            throttle_rate=args.throttle_rate, max_rps=args.max_rps,
+                            refresh_latency=args.refresh_latency, image_bytes=args.image_bytes,
+                            video_bandwidth=args.video_bandwidth).start()
+    os.environ.update({
+        'GOOGLE_CLIENT_ID': 'stub-client',
+        'GOOGLE_CLIENT_SECRET': 'stub-secret',
+        'AUTH_BASE_URL': stub.url,
+        'GOOGLE_PHOTOS_API_BASE': stub.api_base,
+        'GOOGLE_OPENID_URL': f'{stub.url}/userinfo',
+        'DEDUPE_ENABLED': 'false'
+    })
+    output = Path(args.output).resolve() if args.output else \
+        ROOT / 'benchmarks' / 'results' / f'{datetime.datetime.utcnow():%Y%m%dT%H%M%SZ}.json'
+    previous = json.loads(Path(args.compare).read_text()) if args.compare else None
+
+    # The app keeps tokens, indexes and caches under ./data; keep them out of the checkout
+    workdir = tempfile.TemporaryDirectory(prefix='slideshow-bench-')
+    os.chdir(workdir.name)
+
+    results = {
+        'meta': {
+            'timestamp': datetime.datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'args': vars(args)
+        },
+        'scenarios': {}
+    }
+    try:
+        for name in scenarios:
+            print(f'{name}:')
+            results['scenarios'][name] = globals()[f'scenario_{name}'](stub, args)
+    finally:
+        os.chdir(ROOT)
+        stub.stop()
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f'\nResults written to {output}')
+    if previous:
+        compare(previous, results)
+    # Background sync threads may still be running against the stopped stub
+    shutil.rmtree(workdir.name, ignore_errors=True)
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Google Photos Library API and the auth server.
+
+Serves a synthetic, deterministic library over HTTP: mediaItems (list, get,
+batchGet, search with album/date/type/favorite filters), albums,
+sharedAlbums, the auth server's devicecode/token/refresh endpoints, the
+OpenID userinfo endpoint and a distinct JPEG behind every baseUrl (with
+Range support), or a video behind a video's baseUrl + '=dv'. Latency, page
+size caps, 429 injection, a requests-per-second cap, token lifetime, image
+and video size, video bandwidth and library size are configurable. Point the app at it with:
+
+    GOOGLE_PHOTOS_API_BASE=http://127.0.0.1:8765/v1 AUTH_BASE_URL=http://127.0.0.1:8765 \
+    GOOGLE_OPENID_URL=http://127.0.0.1:8765/userinfo python main.py
+
+Usage: python benchmarks/stub_server.py [--port 8765] [--items 20000] [--latency 0.05]
+"""
+
+import argparse
+import base64
+import bisect
+import datetime
+import hashlib
+import io
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+EPOCH = datetime.datetime(2024, 6, 1, 12, tzinfo=datetime.timezone.utc)
+ITEM_SPACING = 6 * 3600  # seconds between consecutive items, newest first
+
+
+def _tiny_jpeg():
+    try:
+        from PIL import Image
+    except ImportError:
+        return b'\xff\xd8\xff\xd9'
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), (90, 120, 160)).save(buffer, 'JPEG', quality=70)
+    return buffer.getvalue()
+
+
+class StubLibrary:
+    """Deterministic synthetic library: item n is 6 hours older than item n - 1"""
+
+    def __init__(self, items: int, albums: int, shared_albums: int, base_url: str):
+        self.size = items
+        self.albums = albums
+        self.shared_albums = shared_albums
+        self.base_url = base_url
+        # Ascending timestamps of items in reverse order, for date range lookups
+        self._ascending = [self.timestamp(n) for n in reversed(range(items))]
+        self._filtered = {}
+        self._filtered_lock = threading.Lock()
+
+    def timestamp(self, n: int) -> float:
+        return EPOCH.timestamp() - n * ITEM_SPACING
+
+    def item(self, n: int) -> dict:
+        video = n % 10 == 9
+        created = datetime.datetime.fromtimestamp(self.timestamp(n), datetime.timezone.utc)
+        metadata = {'creationTime': created.strftime('%Y-%m-%dT%H:%M:%SZ'), 'width': '4032', 'height': '3024'}
+        metadata['video' if video else 'photo'] = {}
+        return {
+            'id': f'stub-{n:07d}',
+            'filename': f'{"VID" if video else "IMG"}_{n:07d}.{"mp4" if video else "jpg"}',
+            'mimeType': 'video/mp4' if video else 'image/jpeg',
+            'baseUrl': self.media_url(n),
+            'productUrl': f'{self.base_url}/photo/stub-{n:07d}',
+            'mediaMetadata': metadata
+        }
+
+    def media_url(self, n: int) -> str:
+        """A baseUrl for item n, ending in an opaque token as long and as random as Google's"""
+        token = base64.urlsafe_b64encode(hashlib.blake2b(str(n).encode(), digest_size=64).digest() * 2)
+        return f'{self.base_url}/media/stub-{n:07d}/{token.decode()[:160]}'
+
+    @staticmethod
+    def parse_id(media_item_id: str):
+        if not media_item_id.startswith('stub-'):
+            return None
+        try:
+            return int(media_item_id[5:])
+        except ValueError:
+            return None
+
+    def album(self, k: int, shared: bool = False) -> dict:
+        prefix = 'shared' if shared else 'album'
+        count = len(range(k, self.size, self.albums + self.shared_albums))
+        return {
+            'id': f'{prefix}-{k}',
+            'title': f'{"Shared album" if shared else "Album"} {k}',
+            'mediaItemsCount': str(count),
+            'coverPhotoBaseUrl': self.media_url(k),
+            'isWriteable': not shared
+        }
+
+    def _date_range(self, date_range: dict) -> range:
+        def bound(date, end):
+            day = datetime.datetime(max(1, date.get('year') or 1), date.get('month') or 1, date.get('day') or 1,
+                                    tzinfo=datetime.timezone.utc)
+            return (day + datetime.timedelta(days=1) if end else day).timestamp()
+
+        low = bisect.bisect_left(self._ascending, bound(date_range['startDate'], False))
+        high = bisect.bisect_left(self._ascending, bound(date_range['endDate'], True))
+        # Positions in the ascending list map back to item numbers newest first
+        return range(self.size - high, self.size - low)
+
+    def matching(self, body: dict) -> list:
+        """Item numbers matching a mediaItems:search body, newest first"""
+        key = json.dumps({k: v for k, v in body.items() if k not in ('pageToken', 'pageSize')}, sort_keys=True)
+        with self._filtered_lock:
+            cached = self._filtered.get(key)
+        if cached is not None:
+            return cached
+
+        album_id = body.get('albumId')
+        filters = body.get('filters', {})
+        if album_id:
+            prefix, _, k = album_id.partition('-')
+            offset = int(k) + (self.albums if prefix == 'shared' else 0)
+            numbers = list(range(offset, self.size, self.albums + self.shared_albums))
+        elif 'dateFilter' in filters and filters['dateFilter'].get('ranges'):
+            numbers = sorted(set(itertools.chain.from_iterable(
+                self._date_range(date_range) for date_range in filters['dateFilter']['ranges']
+            )))
+        else:
+            numbers = range(self.size)
+
+        media_types = filters.get('mediaTypeFilter', {}).get('mediaTypes', ['ALL_MEDIA'])
+        if 'VIDEO' in media_types:
+            numbers = [n for n in numbers if n % 10 == 9]
+        elif 'PHOTO' in media_types:
+            numbers = [n for n in numbers if n % 10 != 9]
+        if 'FAVOURITES' in filters.get('featureFilter', {}).get('includedFeatures', []):
+            numbers = [n for n in numbers if n % 20 == 0]
+
+        numbers = list(numbers)
+        with self._filtered_lock:
+            self._filtered[key] = numbers
+        return numbers
+
+
+class StubPhotosServer:
+    """
+    Threaded HTTP server emulating the Photos Library API and auth server
+    Counts requests per endpoint and 429s served, for harness reports.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, items: int = 20000, albums: int = 20,
+                 shared_albums: int = 5, latency: float = 0.0, jitter: float = 0.0, max_page_size: int = 100,
+                 throttle_rate: float = 0.0, retry_after: float = 1.0, max_rps: float = 0.0,
+                 token_ttl: int = 3600, refresh_latency: float = 0.0, seed: int = 1, image_bytes: int = 0,
+                 video_bytes: int = 8 * 1024 ** 2, video_bandwidth: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.max_page_size = max_page_size
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.max_rps = max_rps
+        self.token_ttl = token_ttl
+        self.refresh_latency = refresh_latency
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = {}  # access token -> expiry (monotonic)
+        self._token_ids = itertools.count(1)
+        self._window = [time.monotonic(), 0]  # start of the current second, requests in it
+        self.counts = {}
+        self.jpeg = _tiny_jpeg()
+        self.image_bytes = image_bytes
+        self.video_bytes = video_bytes
+        self.video_bandwidth = video_bandwidth  # bytes per second per video response; 0 for unlimited
+
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.url = f'http://{host}:{self.httpd.server_address[1]}'
+        self.library = StubLibrary(items, albums, shared_albums, self.url)
+        self._thread = None
+
+    @property
+    def api_base(self) -> str:
+        return f'{self.url}/v1'
+
+    def start(self) -> 'StubPhotosServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='stub-photos', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def issue_token(self, ttl=None) -> dict:
+        """Mint an access/refresh token pair, as the auth server would"""
+        ttl = self.token_ttl if ttl is None else ttl
+        token = f'stub-access-{next(self._token_ids)}'
+        with self._lock:
+            self._tokens[token] = time.monotonic() + ttl
+        return {'access_token': token, 'refresh_token': f'stub-refresh-{token}', 'expires_in': ttl}
+
+    def token_valid(self, token: str) -> bool:
+        with self._lock:
+            expiry = self._tokens.get(token)
+        return expiry is not None and expiry > time.monotonic()
+
+    def count(self, endpoint: str, status: int):
+        key = f'{endpoint} {status}'
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self.counts)
+        return {
+            'requests': sum(counts.values()),
+            'throttled': sum(count for key, count in counts.items() if key.endswith(' 429')),
+            'by_endpoint': counts
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self.counts.clear()
+
+    def should_throttle(self) -> bool:
+        with self._lock:
+            if self.throttle_rate and self._random.random() < self.throttle_rate:
+                return True
+            if self.max_rps:
+                now = time.monotonic()
+                if now - self._window[0] >= 1.0:
+                    self._window = [now, 0]
+                self._window[1] += 1
+                return self._window[1] > self.max_rps
+        return False
+
+    def image(self, media_id: str) -> bytes:
+        """A JPEG unique to media_id, padded with comment segments to about image_bytes"""
+        comments = [media_id.encode()]
+        padding = self.image_bytes - len(self.jpeg)
+        while padding > 0:
+            chunk = min(padding, 65000)
+            comments.append(b'\0' * chunk)
+            padding -= chunk + 4
+        segments = b''.join(b'\xff\xfe' + (len(data) + 2).to_bytes(2, 'big') + data for data in comments)
+        return self.jpeg[:2] + segments + self.jpeg[2:]
+
+    def video(self, media_id: str) -> bytes:
+        """video_bytes of filler unique to media_id"""
+        prefix = media_id.encode()
+        return prefix + bytes(max(0, self.video_bytes - len(prefix)))
+
+    def delay(self):
+        if self.latency or self.jitter:
+            with self._lock:
+                jitter = self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+            time.sleep(max(0.0, self.latency + jitter))
+
+    def page(self, numbers, page_size, page_token) -> dict:
+        page_size = max(1, min(int(page_size or 25), self.max_page_size))
+        offset = int(page_token or 0)
+        result = {'mediaItems': [self.library.item(n) for n in numbers[offset:offset + page_size]]}
+        if offset + page_size < len(numbers):
+            result['nextPageToken'] = str(offset + page_size)
+        return result
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, endpoint, status, body, headers=()):
+                server.count(endpoint, status)
+                data = json.dumps(body, separators=(',', ':')).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_image(self, data):
+                status, start = 200, 0
+                requested = self.headers.get('Range', '')
+                if requested.startswith('bytes=') and requested.endswith('-'):
+                    start = int(requested[len('bytes='):-1] or 0)
+                    status = 206 if start < len(data) else 416
+                server.count('media', status)
+                self.send_response(status)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Accept-Ranges', 'bytes')
+                if status == 416:
+                    self.send_header('Content-Range', f'bytes */{len(data)}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if status == 206:
+                    self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+                self.send_header('Content-Length', str(len(data) - start))
+                self.end_headers()
+                self.wfile.write(data[start:])
+
+            def send_video(self, data):
+                """Send a video or one byte range of it, no faster than video_bandwidth"""
+                status, start, end = 200, 0, len(data) - 1
+                requested = self.headers.get('Range', '')
+                if requested.startswith('bytes='):
+                    first, _, last = requested[len('bytes='):].partition('-')
+                    if not first:
+                        start = max(0, len(data) - int(last))
+                    else:
+                        start = int(first)
+                        end = min(int(last), end) if last else end
+                    status = 206 if start <= end else 416
+                server.count('video', status)
+                self.send_response(status)
+                self.send_header('Content-Type', 'video/mp4')
+                self.send_header('Accept-Ranges', 'bytes')
+                if status == 416:
+                    self.send_header('Content-Range', f'bytes */{len(data)}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if status == 206:
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+                self.send_header('Content-Length', str(end + 1 - start))
+                self.end_headers()
+                chunk_bytes = 64 * 1024
+                started = time.monotonic()
+                try:
+                    for offset in range(start, end + 1, chunk_bytes):
+                        self.wfile.write(data[offset:min(offset + chunk_bytes, end + 1)])
+                        if server.video_bandwidth:
+                            sent = min(offset + chunk_bytes, end + 1) - start
+                            time.sleep(max(0.0, sent / server.video_bandwidth - (time.monotonic() - started)))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def read_body(self):
+                length = int(self.headers.get('Content-Length', 0))
+                raw = self.rfile.read(length) if length else b''
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    return json.loads(raw or b'{}')
+                return {key: values[0] for key, values in parse_qs(raw.decode()).items()}
+
+            def api_guard(self, endpoint):
+                """Apply auth, throttling and latency; returns False if a response was already sent"""
+                token = self.headers.get('Authorization', '')[len('Bearer '):]
+                if not server.token_valid(token):
+                    self.send_json(endpoint, 401, {'error': {'code': 401, 'status': 'UNAUTHENTICATED'}})
+                    return False
+                if server.should_throttle():
+                    self.send_json(endpoint, 429, {'error': {'code': 429, 'status': 'RESOURCE_EXHAUSTED'}},
+                                   [('Retry-After', f'{server.retry_after:g}')])
+                    return False
+                server.delay()
+                return True
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                query = parse_qs(url.query)
+                path = url.path
+
+                if path.startswith('/media/') and path.endswith('=dv'):
+                    server.delay()
+                    self.send_video(server.video(path[len('/media/'):].partition('/')[0]))
+                    return
+                if path.startswith('/media/'):
+                    server.delay()
+                    self.send_image(server.image(path[len('/media/'):].partition('/')[0].partition('=')[0]))
+                    return
+                if path == '/userinfo':
+                    token = self.headers.get('Authorization', '')[len('Bearer '):]
+                    if not server.token_valid(token):
+                        self.send_json('userinfo', 401, {'error': 'invalid_token'})
+                        return
+                    self.send_json('userinfo', 200, {'sub': 'stub-user', 'email': 'stub@example.com'})
+                    return
+                if path == '/__stats':
+                    self.send_json('stats', 200, server.stats())
+                    return
+
+                library = server.library
+                if path == '/v1/mediaItems':
+                    if self.api_guard('mediaItems'):
+                        self.send_json('mediaItems', 200, server.page(
+                            range(library.size), query.get('pageSize', [25])[0], query.get('pageToken', [None])[0]))
+                elif path == '/v1/mediaItems:batchGet':
+                    if self.api_guard('mediaItems:batchGet'):
+                        results = []
+                        for media_item_id in query.get('mediaItemIds', []):
+                            n = library.parse_id(media_item_id)
+                            if n is not None and 0 <= n < library.size:
+                                results.append({'mediaItem': library.item(n)})
+                            else:
+                                results.append({'status': {'code': 5, 'message': 'NOT_FOUND'}})
+                        self.send_json('mediaItems:batchGet', 200, {'mediaItemResults': results})
+                elif path.startswith('/v1/mediaItems/'):
+                    if self.api_guard('mediaItems/{id}'):
+                        n = library.parse_id(path[len('/v1/mediaItems/'):])
+                        if n is None or not 0 <= n < library.size:
+                            self.send_json('mediaItems/{id}', 404, {'error': {'code': 404}})
+                        else:
+                            self.send_json('mediaItems/{id}', 200, library.item(n))
+                elif path in ('/v1/albums', '/v1/sharedAlbums'):
+                    shared = path == '/v1/sharedAlbums'
+                    endpoint = path[4:]
+                    if self.api_guard(endpoint):
+                        total = library.shared_albums if shared else library.albums
+                        page_size = max(1, min(int(query.get('pageSize', [20])[0]), 50))
+                        offset = int(query.get('pageToken', [0])[0])
+                        body = {'sharedAlbums' if shared else 'albums': [
+                            library.album(k, shared) for k in range(offset, min(total, offset + page_size))
+                        ]}
+                        if offset + page_size < total:
+                            body['nextPageToken'] = str(offset + page_size)
+                        self.send_json(endpoint, 200, body)
+                else:
+                    self.send_json('unknown', 404, {'error': {'code': 404, 'message': path}})
+
+            def do_POST(self):
+                path = urlsplit(self.path).path
+                body = self.read_body()
+
+                if path == '/v1/mediaItems:search':
+                    if self.api_guard('mediaItems:search'):
+                        numbers = server.library.matching(body)
+                        self.send_json('mediaItems:search', 200,
+                                       server.page(numbers, body.get('pageSize'), body.get('pageToken')))
+                elif path.rstrip('/') == '/devicecode':
+                    self.send_json('devicecode', 200, {
+                        'device_code': 'stub-device', 'user_code': 'STUB-CODE',
+                        'verification_url': f'{server.url}/device', 'expires_in': 1800, 'interval': 1
+                    })
+                elif path.rstrip('/') in ('/token', '/refresh'):
+                    endpoint = path.strip('/')
+                    if server.refresh_latency:
+                        time.sleep(server.refresh_latency)
+                    self.send_json(endpoint, 200, server.issue_token())
+                else:
+                    self.send_json('unknown', 404, {'error': {'code': 404, 'message': path}})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--items', type=int, default=20000, help='library size')
+    parser.add_argument('--albums', type=int, default=20)
+    parser.add_argument('--shared-albums', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every API and image response')
+    parser.add_argument('--jitter', type=float, default=0.02, help='+/- seconds of random extra latency')
+    parser.add_argument('--max-page-size', type=int, default=100)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of API calls answered with 429')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After seconds sent with 429s')
+    parser.add_argument('--max-rps', type=float, default=0.0, help='429 above this many API calls per second')
+    parser.add_argument('--token-ttl', type=int, default=3600, help='lifetime of issued access tokens')
+    parser.add_argument('--refresh-latency', type=float, default=0.0, help='seconds to answer token refreshes')
+    parser.add_argument('--image-bytes', type=int, default=0, help='pad served images to about this size')
+    parser.add_argument('--video-bytes', type=int, default=8 * 1024 ** 2, help='size of served videos')
+    parser.add_argument('--video-bandwidth', type=float, default=0.0, help='bytes per second per video response')
+    args = parser.parse_args()
+
+    server = StubPhotosServer(
+        args.host, args.port, args.items, args.albums, args.shared_albums, args.latency, args.jitter,
+        args.max_page_size, args.throttle_rate, args.retry_after, args.max_rps, args.token_ttl,
+        args.refresh_latency, image_bytes=args.image_bytes, video_bytes=args.video_bytes,
+        video_bandwidth=args.video_bandwidth
+    )
+    token = server.issue_token(ttl=365 * 24 * 3600)
+    print(f'Stub Photos API on {server.api_base} ({args.items} items)')
+    print(f'Long-lived access token: {token["access_token"]}')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
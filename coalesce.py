@@ -0,0 +1,93 @@
+import threading
+from typing import Callable, Dict, Hashable, Tuple
+
+
+class _Call:
+    """An in-progress call that other callers with the same key can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls that share a key
+    The first caller for a key runs the function; callers arriving while it
+    is still running wait and receive the same result (or exception) instead
+    of issuing their own call. Nothing is cached once the call completes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {
+            'calls': 0,
+            'executed': 0,
+            'coalesced': 0,
+            'errors': 0,
+            'max_waiters': 0
+        }
+
+    def do(self, key: Hashable, fn: Callable[[], Dict]) -> Tuple[Dict, bool]:
+        """
+        Run fn for key unless an identical call is already in flight
+        Returns: (result, shared) where shared is True if another caller's result was reused
+        """
+        with self._lock:
+            self._stats['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                self._stats['executed'] += 1
+                call = self._calls[key] = _Call()
+            else:
+                self._stats['coalesced'] += 1
+                call.waiters += 1
+                self._stats['max_waiters'] = max(self._stats['max_waiters'], call.waiters)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self._stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        stats['coalesce_ratio'] = stats['coalesced'] / stats['calls'] if stats['calls'] else None
+        return stats
+
+
+_default_single_flight = None
+_default_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """Get the process-wide single-flight group for upstream API calls"""
+    global _default_single_flight
+    if _default_single_flight is None:
+        with _default_single_flight_lock:
+            if _default_single_flight is None:
+                _default_single_flight = SingleFlight()
+    return _default_single_flight
@@ -0,0 +1,52 @@
+import hashlib
+import zlib
+from typing import Iterable, Optional, Tuple
+
+from config import BROTLI_QUALITY, COMPRESS_MIN_BYTES, GZIP_LEVEL
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content codings this server can produce, most preferred first
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accepted: Iterable[Tuple[str, float]], size: int) -> Optional[str]:
+    """
+    Pick the content coding for a body of size bytes
+    accepted holds (coding, quality) pairs from the client's Accept-Encoding;
+    a quality of 0 refuses a coding and * stands for any other.
+    Returns: 'br', 'gzip', or None to send the body as it is
+    """
+    if size < COMPRESS_MIN_BYTES:
+        return None
+    qualities = {coding.lower(): quality for coding, quality in accepted}
+    wildcard = qualities.get('*', 0)
+    for encoding in ENCODINGS:
+        if qualities.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+
+def compress(data: bytes, encoding: Optional[str]) -> bytes:
+    """Encode data with a coding returned by choose_encoding()"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        # wbits=31 writes a gzip header with no timestamp, so equal bodies compress to equal bytes
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+    return data
+
+
+def content_etag(data: bytes, encoding: Optional[str] = None) -> str:
+    """
+    Strong entity tag for a body
+    The tag is a digest of the uncompressed content, suffixed with the coding,
+    since each compressed form is a different sequence of bytes.
+    Returns: the unquoted tag
+    """
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    return f'{digest}-{encoding}' if encoding else digest
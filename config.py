@@ -17,8 +17,9 @@ TOKEN_URL = 'token'
 REFRESH_URL = 'refresh'
 
 # Google Photos API Configuration
-GOOGLE_PHOTOS_API_BASE = 'https://photoslibrary.googleapis.com/v1'
-GOOGLE_OPENID_URL = 'https://openidconnect.googleapis.com/v1/userinfo'
+# Both can point at a local stand-in such as benchmarks/stub_server.py
+GOOGLE_PHOTOS_API_BASE = os.getenv('GOOGLE_PHOTOS_API_BASE', 'https://photoslibrary.googleapis.com/v1')
+GOOGLE_OPENID_URL = os.getenv('GOOGLE_OPENID_URL', 'https://openidconnect.googleapis.com/v1/userinfo')
 
 # OAuth Scopes
 SCOPES = [
@@ -33,11 +34,182 @@ FLASK_ENV = os.getenv('FLASK_ENV', 'development')
 
 # Application Configuration
 DATA_DIR = 'data'
-TOKENS_DIR = os.path.join(DATA_DIR, 'tokens')
+TOKENS_DIR = os.path.join(DATA_DIR, 'tokens')  # per-user JSON tokens of earlier versions, imported once
 CACHE_DIR = os.path.join(DATA_DIR, 'cache')
 MEDIA_CACHE_FILE = os.path.join(DATA_DIR, 'media_cache.pkl')
+MEDIA_INDEX_DIR = os.path.join(CACHE_DIR, 'index')
+MEDIA_CACHE_DIR = os.path.join(CACHE_DIR, 'media')
+VIDEO_CACHE_DIR = os.path.join(CACHE_DIR, 'video')
+STATE_DB_PATH = os.path.join(DATA_DIR, 'state.sqlite3')  # state shared by every server worker
+TOKEN_DB_PATH = os.path.join(DATA_DIR, 'tokens.sqlite3')  # every account's credentials
+MIRROR_DIR = os.path.join(DATA_DIR, 'mirror')
+
+# Server Configuration
+SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.getenv('SERVER_PORT', '5000'))
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', str(min(4, (os.cpu_count() or 1) * 2))))  # production worker processes
+SERVER_THREADS = int(os.getenv('SERVER_THREADS', '8'))  # request threads per worker
+# Processes serving the app at once; main.py sets it to the worker count in production mode.
+# Rate limits are split between them and shared caches are re-read from disk and the state store.
+SERVER_PROCESSES = int(os.getenv('SERVER_PROCESSES', '1'))
+SERVER_TIMEOUT = 120  # seconds before a stuck worker is restarted (NDJSON streams can run long)
+SERVER_GRACEFUL_TIMEOUT = 30  # seconds workers get to finish requests on reload or shutdown
+INDEX_SYNC_LEASE = 30 * 60  # seconds one worker may hold an account's index sync
+
+# Credential Cache Configuration
+TOKEN_REFRESH_MARGIN = 5 * 60  # seconds before expiry that tokens are renewed in the background
+TOKEN_REFRESH_INTERVAL = 60  # seconds between background refresh checks
+CREDENTIAL_STAT_INTERVAL = 1.0  # seconds cached credentials are trusted before re-checking their version
+
+# HTTP Transport Configuration
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '30'))  # seconds
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '3'))
+HTTP_BACKOFF_FACTOR = float(os.getenv('HTTP_BACKOFF_FACTOR', '0.5'))
+HTTP_POOL_CONNECTIONS = 10  # number of distinct hosts kept pooled
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '10'))  # connections per host
+HTTP_HOST_POOL_MAXSIZE = {
+    # Every page, search and batchGet call goes here, so give it the deepest pool
+    '/'.join(GOOGLE_PHOTOS_API_BASE.split('/')[:3]): int(os.getenv('HTTP_PHOTOS_POOL_MAXSIZE', '32')),
+}
+
+# Rate Limit Configuration
+RATE_LIMIT_GLOBAL_RATE = float(os.getenv('RATE_LIMIT_GLOBAL_RATE', '20'))  # Photos API requests per second, all accounts
+RATE_LIMIT_GLOBAL_BURST = 40
+RATE_LIMIT_ACCOUNT_RATE = float(os.getenv('RATE_LIMIT_ACCOUNT_RATE', '10'))  # requests per second per account
+RATE_LIMIT_ACCOUNT_BURST = 20
+RATE_LIMIT_MIN_RATE = 0.5  # floor the adaptive rate never drops below
+RATE_LIMIT_DECREASE = 0.5  # rate multiplier applied on each 429
+RATE_LIMIT_INCREASE = 0.1  # requests per second regained on each success
+RATE_LIMIT_THROTTLE_BACKOFF = 5.0  # seconds to pause after a 429 without Retry-After
+RATE_LIMIT_DAILY_QUOTA = int(os.getenv('RATE_LIMIT_DAILY_QUOTA', '10000'))  # Library API requests per day
+RATE_LIMIT_INTERACTIVE_RESERVE = 0.25  # share of burst and daily quota background work may not use
+RATE_LIMIT_MAX_WAIT = {'interactive': 5.0, 'background': 60.0}  # seconds a request may queue
+
+# Metrics Configuration
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'  # serve /metrics and time requests
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+METRICS_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)  # bytes
+
+# Media Index Configuration
+INDEX_SYNC_PAGE_SIZE = 100  # maximum allowed by mediaItems.list
+BASE_URL_MAX_AGE = 50 * 60  # seconds; Google expires baseUrls after 60 minutes
+INDEX_PARALLEL_CRAWL = os.getenv('INDEX_PARALLEL_CRAWL', 'true').lower() == 'true'
+INDEX_SYNC_MIN_INTERVAL = int(os.getenv('INDEX_SYNC_MIN_INTERVAL', '600'))  # seconds before an account is synced again
+INDEX_FAVORITES_INTERVAL = 6 * 3600  # seconds between re-reads of the whole favorites set
+INDEX_PARALLEL_MIN_SPEEDUP = 2.0  # first-page latency x crawl rate needed before a first sync crawls in parallel
+INDEX_CLOSE_TIMEOUT = 10  # seconds removing an account waits for its index sync or dedupe run to stop
+
+# Search Configuration
+SEARCH_CHECK_INTERVAL = 30  # seconds between checks for index changes; rebuilds happen in the background
+SEARCH_MAX_RESULTS = 1000  # IDs per /api/search response at most
+SEARCH_BITSET_DENSITY = 1 / 32  # terms on more than this share of items are stored as bitsets
+
+# Async Crawl Configuration
+ASYNC_MAX_CONCURRENCY = int(os.getenv('ASYNC_MAX_CONCURRENCY', '8'))  # requests in flight per crawl
+ASYNC_RATE_LIMIT = float(os.getenv('ASYNC_RATE_LIMIT', '10'))  # requests per second per crawl
+ASYNC_RATE_BURST = 10
+ASYNC_FIRST_YEAR = 2000  # earlier items are crawled as one partition
+
+# Media Proxy Configuration
+MEDIA_PROXY_ENABLED = os.getenv('MEDIA_PROXY_ENABLED', 'true').lower() == 'true'
+MEDIA_CACHE_MAX_BYTES = int(os.getenv('MEDIA_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+MEDIA_CACHE_RESCAN_INTERVAL = 60  # seconds between re-reads of a cache directory several workers share
+MEDIA_MASTER_SIZE = (1920, 1080)  # fetched once per item; smaller sizes are derived locally
+MEDIA_MAX_DIMENSION = 4096
+MEDIA_CACHE_MAX_AGE = 7 * 24 * 3600  # seconds browsers may reuse a proxied image
+
+# Display Size Configuration
+# Each display gets the smallest rung (long side x short side) that covers its screen
+DISPLAY_SIZE_LADDER = ((1280, 720), (1920, 1080), (2560, 1440), (3840, 2160))
+DISPLAY_MAX_DPR = 3.0
+# Formats offered to clients that accept them, most preferred first; 'avif' needs pillow-avif-plugin
+MEDIA_VARIANT_FORMATS = [f.strip() for f in os.getenv('MEDIA_VARIANT_FORMATS', 'webp').lower().split(',') if f.strip()]
+MEDIA_VARIANT_QUALITY = {'jpeg': 85, 'webp': 80, 'avif': 60}
+
+# Video Proxy Configuration
+# Videos are proxied with the images (MEDIA_PROXY_ENABLED); only the start of each clip is kept on disk
+VIDEO_CACHE_MAX_BYTES = int(os.getenv('VIDEO_CACHE_MAX_BYTES', str(1024 ** 3)))
+VIDEO_HEAD_BYTES = int(os.getenv('VIDEO_HEAD_BYTES', str(2 * 1024 ** 2)))  # about the first few seconds of a phone clip
+VIDEO_CHUNK_BYTES = 256 * 1024
+VIDEO_READ_AHEAD_CHUNKS = 16  # chunks read from Google ahead of each client
+VIDEO_READ_AHEAD_IDLE = 60  # seconds a read-ahead waits on a client that takes nothing before closing upstream
+VIDEO_STARTUP_HISTORY = 200  # recent per-clip startup reports kept for /api/video/stats
+
+# Response Compression Configuration
+COMPRESS_MIN_BYTES = 1024  # smaller JSON bodies are sent as they are
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '5'))  # brotli (optional package) is preferred when clients accept it
+
+# Response Cache Configuration
+# Listings carry cover photo baseUrls, so fresh plus stale time is capped at BASE_URL_MAX_AGE
+RESPONSE_CACHE_TTL = min(int(os.getenv('RESPONSE_CACHE_TTL', '300')), BASE_URL_MAX_AGE)  # seconds album listings are served as fresh
+RESPONSE_CACHE_STALE_TTL = min(  # further seconds served stale while refreshing
+    int(os.getenv('RESPONSE_CACHE_STALE_TTL', str(BASE_URL_MAX_AGE - RESPONSE_CACHE_TTL))),
+    BASE_URL_MAX_AGE - RESPONSE_CACHE_TTL
+)
+RESPONSE_CACHE_MAX_ENTRIES = 1000
+
+# Prefetch Configuration
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', '4'))
+PREFETCH_LOOKAHEAD = int(os.getenv('PREFETCH_LOOKAHEAD', '3'))  # slides warmed ahead of each display
+PREFETCH_MAX_LOOKAHEAD = 20
+PREFETCH_PAGE_TTL = 10 * 60  # seconds a prefetched API page stays usable
+PREFETCH_MAX_PAGES = 50
+PREFETCH_SESSION_IDLE = 10 * 60  # seconds before a silent display is forgotten
+
+# Merged Feed Configuration
+MERGE_WORKERS = int(os.getenv('MERGE_WORKERS', '16'))  # threads fetching account pages in parallel
+MERGE_ACCOUNT_TIMEOUT = float(os.getenv('MERGE_ACCOUNT_TIMEOUT', '5'))  # seconds before a slow account is left out of a page
+MERGE_PAGE_CACHE_TTL = 120  # seconds an account page is reused while its items are merged out
+MERGE_DEDUPE_WINDOW = 200  # recently served items remembered in the cursor for de-duplication
+
+# Playlist Configuration
+PLAYLIST_BATCH_SIZE = 50  # items per /api/playlist response by default
+PLAYLIST_MAX_BATCH = 500
+PLAYLIST_MAX_SCAN = 20000  # permutation positions examined per request before giving up
+PLAYLIST_NO_REPEAT_WINDOW = 100  # items from the end of one pass held back from the start of the next
+PLAYLIST_FAVORITE_WEIGHT = 4.0  # relative play frequency of favorites when weighting by favorites
+PLAYLIST_RECENCY_HALF_LIFE = 365  # days; when weighting by recency an item this old plays half as often
+PLAYLIST_MIN_RECENCY_WEIGHT = 0.1  # floor so old photos still come up
+
+# Duplicate Detection Configuration
+# A first run fetches every photo's thumbnail and about one batchGet per 50 photos; POST /api/dedupe runs it on demand
+DEDUPE_ENABLED = os.getenv('DEDUPE_ENABLED', 'false').lower() == 'true'  # hash new items after each index sync
+DEDUPE_WORKERS = int(os.getenv('DEDUPE_WORKERS', str(max(1, (os.cpu_count() or 2) - 1))))  # hashing processes
+DEDUPE_DOWNLOAD_WORKERS = int(os.getenv('DEDUPE_DOWNLOAD_WORKERS', '8'))  # concurrent thumbnail downloads
+DEDUPE_BATCH_SIZE = 500  # items hashed per batch; progress is saved after each
+DEDUPE_THUMBNAIL_SIZE = 64  # pixels; plenty for a 64-bit difference hash
+DEDUPE_MAX_DISTANCE = int(os.getenv('DEDUPE_MAX_DISTANCE', '6'))  # differing hash bits still counted as the same photo
+DEDUPE_RETRY_AFTER = 24 * 3600  # seconds before an item whose thumbnail failed is tried again
+DEDUPE_LEASE = 6 * 3600  # seconds a worker holds an account's hashing run before another may take over
+
+# Offline Mirror Configuration
+OFFLINE_MODE = os.getenv('OFFLINE_MODE', 'false').lower() == 'true'  # serve photos and media only from the mirror
+MIRROR_MAX_BYTES = int(os.getenv('MIRROR_MAX_BYTES', str(20 * 1024 ** 3)))
+MIRROR_IMAGE_SIZE = (1920, 1080)  # size mirrored images are downloaded at
+MIRROR_WORKERS = int(os.getenv('MIRROR_WORKERS', '8'))  # concurrent image downloads
+MIRROR_QUEUE_PER_WORKER = 4  # downloads queued per worker before listing the next album page
+MIRROR_LEASE = 6 * 3600  # seconds a worker holds an account's mirror sync before another may take over
+
+# Sync Hub Configuration
+# Displays in a sync group play one shared slideshow pushed over Server-Sent Events from a separate port
+SYNC_HUB_ENABLED = os.getenv('SYNC_HUB_ENABLED', 'true').lower() == 'true'
+SYNC_PORT = int(os.getenv('SYNC_PORT', str(SERVER_PORT + 1)))
+SYNC_PUBLIC_URL = os.getenv('SYNC_PUBLIC_URL', '')  # hub URL as displays reach it; default: the page's host on SYNC_PORT
+SYNC_POLL_INTERVAL = 1.0  # seconds between checks for group changes and playback commands
+SYNC_LEAD = 0.5  # seconds each slide is announced before displays switch to it together
+SYNC_PREFETCH_SLIDES = 3  # upcoming slides hinted to displays and warmed on the server
+SYNC_BATCH_SIZE = 20  # slides taken from a group's playlist at a time
+SYNC_HISTORY = 50  # slides remembered per group for going back
+SYNC_HEARTBEAT = 15  # seconds between keep-alive comments on idle connections
+SYNC_QUEUE_SIZE = 16  # events buffered per display before a stalled one is disconnected
+SYNC_IDLE_TIMEOUT = 60  # seconds a group's clock keeps running with no displays connected
+SYNC_RETRY_INTERVAL = 5  # seconds before a group with no slides to show (e.g. still indexing) tries again
+SYNC_LEASE = 30  # seconds; the worker serving the hub renews this, another takes over once it lapses
 
 # Slideshow Configuration
+DISPLAY_SIZE = (1920, 1080)  # size requested from Google for slides
+THUMBNAIL_SIZE = (300, 200)
 DEFAULT_SLIDESHOW_SPEED = 5  # seconds
 DEFAULT_TRANSITION = 'fade'
 MAX_IMAGES_PER_PAGE = 100
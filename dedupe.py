@@ -0,0 +1,261 @@
+import io
+import itertools
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from config import (
+    DEDUPE_WORKERS, DEDUPE_DOWNLOAD_WORKERS, DEDUPE_BATCH_SIZE, DEDUPE_THUMBNAIL_SIZE,
+    DEDUPE_MAX_DISTANCE, DEDUPE_RETRY_AFTER, DEDUPE_LEASE
+)
+from http_session import HttpTransport, get_transport
+from media_index import MediaIndex, get_media_index
+from photos_api import GooglePhotosAPI
+from state_store import get_state_store
+
+HASH_BITS = 64
+
+try:
+    popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+    def popcount(value: int) -> int:
+        return bin(value).count('1')
+
+
+def dhash(data: bytes) -> Optional[int]:
+    """
+    64-bit difference hash of an encoded image
+    The image is reduced to 9x8 grayscale and each bit records whether a
+    pixel is brighter than its right neighbour, so re-encodes, resizes and
+    small edits of the same shot land within a few bits of each other.
+    Returns: the hash, or None if the image cannot be decoded
+    """
+    from PIL import Image  # imported here so the server starts without loading Pillow
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft('L', (32, 32))
+            pixels = list(image.convert('L').resize((9, 8), Image.BILINEAR).getdata())
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    value = 0
+    for row in range(0, 72, 9):
+        for col in range(row, row + 8):
+            value = (value << 1) | (pixels[col] > pixels[col + 1])
+    return value
+
+
+def to_signed(value: int) -> int:
+    """Map an unsigned 64-bit hash into SQLite's signed INTEGER range"""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value: int) -> int:
+    return value & ((1 << HASH_BITS) - 1)
+
+
+class MultiIndexHash:
+    """
+    Hash table for radius queries over 64-bit hashes under Hamming distance
+    Hashes are split into chunks, each indexed in its own table. Two hashes
+    within radius r differ by at most r // chunks bits in at least one chunk
+    (pigeonhole), so a query only probes each chunk's table with its value
+    and the variants within that many bits, then checks those candidates.
+    """
+
+    def __init__(self, radius: int = DEDUPE_MAX_DISTANCE, chunks: int = 4,
+                 entries: Iterable[Tuple[int, str]] = ()):
+        self.radius = radius
+        self.chunk_bits = HASH_BITS // chunks
+        self._chunk_mask = (1 << self.chunk_bits) - 1
+        self._tables = [{} for _ in range(chunks)]  # chunk value -> [(hash, key)]
+        chunk_radius = radius // chunks
+        # Every chunk value within chunk_radius bits, as XOR masks
+        self._probes = [
+            sum(1 << bit for bit in bits)
+            for flipped in range(chunk_radius + 1)
+            for bits in itertools.combinations(range(self.chunk_bits), flipped)
+        ]
+        self._size = 0
+        for value, key in entries:
+            self.add(value, key)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _chunks(self, value: int):
+        for table_index, table in enumerate(self._tables):
+            yield table, (value >> (table_index * self.chunk_bits)) & self._chunk_mask
+
+    def add(self, value: int, key: str):
+        entry = (value, key)
+        for table, chunk in self._chunks(value):
+            bucket = table.get(chunk)
+            if bucket is None:
+                table[chunk] = [entry]
+            else:
+                bucket.append(entry)
+        self._size += 1
+
+    def find(self, value: int) -> Optional[Tuple[int, str]]:
+        """
+        Closest entry within radius of value
+        Returns: (distance, key), or None when nothing is that close
+        """
+        best = None
+        for table, chunk in self._chunks(value):
+            for probe in self._probes:
+                for candidate, key in table.get(chunk ^ probe, ()):
+                    distance = popcount(value ^ candidate)
+                    if distance <= self.radius and (best is None or distance < best[0]):
+                        if distance == 0:
+                            return distance, key
+                        best = (distance, key)
+        return best
+
+
+class DedupePipeline:
+    """
+    Incremental near-duplicate detection for one account's media index
+    Each batch takes images that have no hash yet, downloads small
+    thumbnails on a thread pool, hashes them on a process pool and looks
+    each hash up in a multi-index table of the photos already kept. A photo
+    within the distance threshold of a kept one is marked as its duplicate;
+    any other photo becomes a kept photo itself. Progress is stored per batch,
+    so an interrupted run picks up where it stopped.
+    """
+
+    def __init__(self, index: MediaIndex, api_factory: Callable[[], Optional[GooglePhotosAPI]],
+                 transport: Optional[HttpTransport] = None, max_distance: int = DEDUPE_MAX_DISTANCE,
+                 workers: int = DEDUPE_WORKERS, download_workers: int = DEDUPE_DOWNLOAD_WORKERS,
+                 batch_size: int = DEDUPE_BATCH_SIZE, thumbnail_size: int = DEDUPE_THUMBNAIL_SIZE):
+        self.index = index
+        self.api_factory = api_factory
+        self.transport = transport or get_transport()
+        self.max_distance = max_distance
+        self.workers = workers
+        self.download_workers = download_workers
+        self.batch_size = batch_size
+        self.thumbnail_size = thumbnail_size
+
+    def run(self) -> Dict:
+        """
+        Hash every image not hashed yet
+        Returns: counts of hashed, failed and duplicate items found in this run
+        """
+        counts = {'hashed': 0, 'failed': 0, 'duplicates': 0}
+        rows = self.index.items_to_hash(self.batch_size, time.time() - DEDUPE_RETRY_AFTER)
+        if not rows:
+            return counts
+        kept = MultiIndexHash(self.max_distance, entries=(
+            (to_unsigned(row['phash']), row['id']) for row in self.index.hashed_representatives()
+        ))
+
+        # Spawned rather than forked: the server process has many threads running
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(self.workers, mp_context=context) as hashers, \
+                ThreadPoolExecutor(self.download_workers, thread_name_prefix='dedupe-download') as downloads:
+            while rows and not self.index.closing:
+                api = self.api_factory()
+                if api is None:
+                    print(f'Dedupe for {self.index.user_id} stopped: no valid credentials')
+                    break
+
+                page = {
+                    'mediaItems': [_Thumbnail(row['id'], row['base_url']) for row in rows],
+                    'fetchedAt': [row['fetched_at'] for row in rows]
+                }
+                self.index.refresh_base_urls(page, api)
+                urls = [
+                    api.build_thumbnail_url(item.base_url, self.thumbnail_size, self.thumbnail_size)
+                    for item in page['mediaItems']
+                ]
+                blobs = list(downloads.map(self._download, urls))
+                hashes = hashers.map(_hash_or_none, blobs, chunksize=max(1, len(blobs) // (self.workers * 4)))
+
+                results = []
+                for item, value in zip(page['mediaItems'], hashes):
+                    if value is None:
+                        counts['failed'] += 1
+                        results.append((item.id, None, None))
+                        continue
+                    counts['hashed'] += 1
+                    match = kept.find(value)
+                    if match is None:
+                        kept.add(value, item.id)
+                        results.append((item.id, to_signed(value), None))
+                    else:
+                        counts['duplicates'] += 1
+                        results.append((item.id, to_signed(value), match[1]))
+                self.index.set_hashes(results)
+                rows = self.index.items_to_hash(self.batch_size, time.time() - DEDUPE_RETRY_AFTER)
+        return counts
+
+    def _download(self, url: str) -> Optional[bytes]:
+        try:
+            response = self.transport.get(url)
+        except Exception as e:
+            print(f'Error downloading thumbnail for hashing: {e}')
+            return None
+        return response.content if response.status_code == 200 else None
+
+
+class _Thumbnail:
+    """Minimal stand-in for MediaItem so refresh_base_urls can update baseUrls in place"""
+
+    __slots__ = ('id', 'base_url')
+
+    def __init__(self, media_item_id: str, base_url: str):
+        self.id = media_item_id
+        self.base_url = base_url
+
+
+def _hash_or_none(data: Optional[bytes]) -> Optional[int]:
+    return dhash(data) if data else None
+
+
+_running = set()
+_running_lock = threading.Lock()
+
+
+def start_background_dedupe(user_id: str, api_factory: Callable[[], Optional[GooglePhotosAPI]]) -> bool:
+    """
+    Start hashing an account's new images in the background
+    Returns: False if a run is already going in this or another worker process
+    """
+    with _running_lock:
+        if user_id in _running:
+            return False
+        store = get_state_store()
+        lease = f'dedupe:{user_id}'
+        if not store.acquire_lease(lease, DEDUPE_LEASE):
+            return False
+        _running.add(user_id)
+
+    def run():
+        index = get_media_index(user_id)
+        # Removing the account waits for this run before closing the index
+        started = index.begin_job()
+        try:
+            if started:
+                counts = DedupePipeline(index, api_factory).run()
+                print(f'Dedupe for {user_id}: {counts}')
+        except Exception as e:
+            print(f'Dedupe for {user_id} failed: {e}')
+        finally:
+            if started:
+                index.end_job()
+            with _running_lock:
+                _running.discard(user_id)
+            store.release_lease(lease)
+
+    thread = threading.Thread(target=run, name=f'dedupe-{user_id}', daemon=True)
+    thread.start()
+    return True
+
+
+def is_deduping(user_id: str) -> bool:
+    with _running_lock:
+        return user_id in _running
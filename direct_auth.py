@@ -1,12 +1,13 @@
 import webbrowser
 import urllib.parse
-import requests
 import json
 from flask import request, redirect, url_for
 from config import GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, SCOPES
+from http_session import get_transport
 
 class DirectOAuth:
-    def __init__(self):
+    def __init__(self, transport=None):
+        self.transport = transport or get_transport()
         self.client_id = GOOGLE_CLIENT_ID
         self.client_secret = GOOGLE_CLIENT_SECRET
         self.scopes = ' '.join(SCOPES)
@@ -28,6 +29,7 @@ class DirectOAuth:
     
     def exchange_code_for_token(self, code):
         """Exchange authorization code for access token"""
+        import requests
         token_url = 'https://oauth2.googleapis.com/token'
         
         data = {
@@ -39,7 +41,7 @@ class DirectOAuth:
         }
         
         try:
-            response = requests.post(token_url, data=data, timeout=30)
+            response = self.transport.post(token_url, data=data)
             if response.status_code == 200:
                 return response.json()
             else:
@@ -51,11 +53,12 @@ class DirectOAuth:
     
     def get_user_info(self, access_token):
         """Get user information from Google"""
+        import requests
         user_info_url = 'https://www.googleapis.com/oauth2/v2/userinfo'
         headers = {'Authorization': f'Bearer {access_token}'}
         
         try:
-            response = requests.get(user_info_url, headers=headers, timeout=30)
+            response = self.transport.get(user_info_url, headers=headers)
             if response.status_code == 200:
                 return response.json()
             else:
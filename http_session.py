@@ -0,0 +1,137 @@
+import functools
+import threading
+from typing import TYPE_CHECKING, Dict, Optional
+
+from config import (
+    HTTP_TIMEOUT, HTTP_RETRIES, HTTP_BACKOFF_FACTOR,
+    HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_HOST_POOL_MAXSIZE
+)
+
+if TYPE_CHECKING:
+    import requests
+    from requests.adapters import HTTPAdapter
+
+# 429s are left to the caller: the Photos API client backs off through its rate limiter
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+@functools.lru_cache(maxsize=None)
+def _retry_class():
+    """
+    urllib3 Retry that leaves 429s alone
+    Defined on first use: requests and urllib3 are imported when the first
+    transport is built, not when the app is imported.
+    """
+    from urllib3.util.retry import Retry
+
+    class _Retry(Retry):
+        # urllib3 retries any 429 carrying Retry-After regardless of status_forcelist
+        RETRY_AFTER_STATUS_CODES = frozenset({503})
+
+    return _Retry
+
+
+class HttpTransport:
+    """
+    Pooled keep-alive HTTP transport shared by the API and auth clients
+    Connection pools live in adapters shared by every thread; each thread
+    gets its own requests.Session on top of them, so session state such as
+    cookies is never mutated concurrently.
+    """
+
+    def __init__(self, timeout: float = HTTP_TIMEOUT, retries: int = HTTP_RETRIES,
+                 backoff_factor: float = HTTP_BACKOFF_FACTOR,
+                 pool_connections: int = HTTP_POOL_CONNECTIONS,
+                 pool_maxsize: int = HTTP_POOL_MAXSIZE,
+                 host_pool_maxsize: Optional[Dict[str, int]] = None):
+        self.timeout = timeout
+        self._retry = _retry_class()(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,  # mediaItems:search and token refresh are safe to repeat
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+
+        self._adapters = {
+            'https://': self._make_adapter(pool_connections, pool_maxsize),
+            'http://': self._make_adapter(pool_connections, pool_maxsize)
+        }
+        host_pool_maxsize = HTTP_HOST_POOL_MAXSIZE if host_pool_maxsize is None else host_pool_maxsize
+        for prefix, maxsize in host_pool_maxsize.items():
+            self._adapters[prefix] = self._make_adapter(1, maxsize)
+
+        self._local = threading.local()
+
+    def _make_adapter(self, pool_connections: int, pool_maxsize: int) -> 'HTTPAdapter':
+        from requests.adapters import HTTPAdapter
+        return HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=self._retry
+        )
+
+    @property
+    def session(self) -> 'requests.Session':
+        """The calling thread's session, mounted on the shared adapters"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            import requests
+            session = requests.Session()
+            for prefix, adapter in self._adapters.items():
+                session.mount(prefix, adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method: str, url: str, timeout: Optional[float] = None, **kwargs) -> 'requests.Response':
+        return self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+
+    def get(self, url: str, **kwargs) -> 'requests.Response':
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> 'requests.Response':
+        return self.request('POST', url, **kwargs)
+
+    def stats(self) -> Dict:
+        """
+        Connection reuse counters per host
+        requests - connections is the number of TLS handshakes avoided.
+        """
+        hosts = {}
+        for adapter in set(self._adapters.values()):
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                host = f'{pool.scheme}://{pool.host}'
+                entry = hosts.setdefault(host, {'requests': 0, 'connections': 0})
+                entry['requests'] += pool.num_requests
+                entry['connections'] += pool.num_connections
+
+        total_requests = sum(entry['requests'] for entry in hosts.values())
+        total_connections = sum(entry['connections'] for entry in hosts.values())
+        return {
+            'requests': total_requests,
+            'connections': total_connections,
+            'reused': total_requests - total_connections,
+            'hosts': hosts
+        }
+
+    def close(self):
+        for adapter in set(self._adapters.values()):
+            adapter.close()
+
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+
+def get_transport() -> HttpTransport:
+    """Get the process-wide shared transport"""
+    global _default_transport
+    if _default_transport is None:
+        with _default_transport_lock:
+            if _default_transport is None:
+                _default_transport = HttpTransport()
+    return _default_transport
@@ -0,0 +1,379 @@
+import hashlib
+import io
+import mimetypes
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from config import (
+    MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES, MEDIA_CACHE_RESCAN_INTERVAL, MEDIA_MASTER_SIZE, SERVER_PROCESSES,
+    DISPLAY_SIZE_LADDER, DISPLAY_MAX_DPR, MEDIA_VARIANT_FORMATS, MEDIA_VARIANT_QUALITY
+)
+from http_session import HttpTransport, get_transport
+
+VARIANT_TYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp', 'avif': 'image/avif'}
+for _content_type, _extension in (('image/webp', '.webp'), ('image/avif', '.avif')):
+    mimetypes.add_type(_content_type, _extension)
+
+
+_variant_formats = None
+_variant_formats_lock = threading.Lock()
+
+
+def _pillow():
+    """
+    Import Pillow on first use rather than at startup
+    Pillow and its format plugins take tens of milliseconds to load on a
+    Raspberry Pi, and a server that only lists photos never needs them.
+    Returns: the PIL.Image module
+    """
+    from PIL import Image
+    try:
+        import pillow_avif  # noqa: F401  registers an AVIF encoder with Pillow
+    except ImportError:
+        pass
+    return Image
+
+
+def variant_formats() -> Tuple[str, ...]:
+    """
+    The configured variant formats this Pillow build can encode, checked once
+    Returns: formats from MEDIA_VARIANT_FORMATS, most preferred first
+    """
+    global _variant_formats
+    if _variant_formats is None:
+        with _variant_formats_lock:
+            if _variant_formats is None:
+                Image = _pillow()
+                Image.init()
+                formats = []
+                for image_format in MEDIA_VARIANT_FORMATS:
+                    if image_format in VARIANT_TYPES and image_format.upper() in Image.SAVE:
+                        formats.append(image_format)
+                    else:
+                        print(f'Image format {image_format} is not available; serving JPEG instead')
+                _variant_formats = tuple(formats)
+    return _variant_formats
+
+
+def display_size(width: float, height: float, dpr: float = 1.0) -> Tuple[int, int]:
+    """
+    Pick the smallest size ladder rung that covers a viewport in device pixels
+    Snapping to a few fixed sizes keeps one cached variant per rung instead
+    of one per screen. The rung is turned to match portrait viewports.
+    Returns: (width, height) to request
+    """
+    dpr = max(1.0, min(dpr, DISPLAY_MAX_DPR))
+    long_side, short_side = max(width, height) * dpr, min(width, height) * dpr
+    rung = DISPLAY_SIZE_LADDER[-1]
+    for candidate in DISPLAY_SIZE_LADDER:
+        if candidate[0] >= long_side and candidate[1] >= short_side:
+            rung = candidate
+            break
+    return rung if width >= height else (rung[1], rung[0])
+
+
+def negotiate_format(accepted: Iterable[str]) -> str:
+    """
+    Choose the preferred variant format among the content types a client accepts
+    Returns: 'jpeg' unless the client accepts one of variant_formats()
+    """
+    accepted = {content_type.split(';')[0].strip() for content_type in accepted}
+    for image_format in variant_formats():
+        if VARIANT_TYPES[image_format] in accepted:
+            return image_format
+    return 'jpeg'
+
+
+class DiskLRUCache:
+    """
+    Size-bounded least-recently-used cache of files on disk
+    When several server processes share the directory (shared=True), each
+    one re-reads it every MEDIA_CACHE_RESCAN_INTERVAL seconds, so its byte
+    count and eviction order cover the other workers' files too, and a key
+    it hasn't seen is looked up on disk before counting as a miss.
+    """
+
+    def __init__(self, cache_dir: str = MEDIA_CACHE_DIR, max_bytes: int = MEDIA_CACHE_MAX_BYTES,
+                 shared: bool = SERVER_PROCESSES > 1, rescan_interval: float = MEDIA_CACHE_RESCAN_INTERVAL):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.rescan_interval = rescan_interval
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (filename, size), least recent first
+        self._bytes = 0
+        self._scanned_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load()
+
+    def _scan(self) -> OrderedDict:
+        """Read the files on disk in least recently used order"""
+        files = []
+        now = time.time()
+        for path in self.cache_dir.glob('*/*'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # evicted by another worker meanwhile
+            if path.suffix == '.tmp':
+                # Left behind by a crash; a recent one may still be being written by another worker
+                if now - stat.st_mtime > 60:
+                    path.unlink(missing_ok=True)
+                continue
+            files.append((stat.st_mtime, path.stem, path.name, stat.st_size))
+        return OrderedDict((key, (filename, size)) for _, key, filename, size in sorted(files))
+
+    def _load(self):
+        """Rebuild the LRU order from the files already on disk"""
+        entries = self._scan()
+        with self._lock:
+            self._entries = entries
+            self._bytes = sum(size for _, size in entries.values())
+            self._scanned_at = time.monotonic()
+            self._evict()
+
+    def _maybe_rescan(self):
+        if self.shared and time.monotonic() - self._scanned_at > self.rescan_interval:
+            self._scanned_at = time.monotonic()
+            self._load()
+
+    def _adopt(self, key: str) -> bool:
+        """Pick up an entry another worker stored since the last scan (call with the lock held)"""
+        for path in (self.cache_dir / key[:2]).glob(f'{key}.*'):
+            if path.suffix != '.tmp' and path.stem == key:
+                try:
+                    size = path.stat().st_size
+                except FileNotFoundError:
+                    return False
+                self._entries[key] = (path.name, size)
+                self._bytes += size
+                return True
+        return False
+
+    def _path(self, filename: str) -> Path:
+        return self.cache_dir / filename[:2] / filename
+
+    def get(self, key: str) -> Optional[Path]:
+        """Get the path of a cached entry, marking it as recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self.shared and self._adopt(key):
+                entry = self._entries[key]
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        path = self._path(entry[0])
+        try:
+            # Persist recency so the LRU order survives restarts
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._drop(key)
+            return None
+        return path
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries or (self.shared and self._adopt(key))
+
+    def put(self, key: str, data: bytes, content_type: str = 'image/jpeg') -> Path:
+        """Store an entry atomically and evict old entries past the size limit"""
+        extension = mimetypes.guess_extension(content_type) or '.bin'
+        filename = f'{key}{extension}'
+        path = self._path(filename)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = path.with_name(f'{filename}.{threading.get_ident()}.tmp')
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._drop(key, unlink=False)
+            self._entries[key] = (filename, len(data))
+            self._bytes += len(data)
+            self._evict()
+        self._maybe_rescan()
+        return path
+
+    def _drop(self, key: str, unlink: bool = True):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry[1]
+        if unlink:
+            try:
+                self._path(entry[0]).unlink()
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._drop(key)
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'shared': self.shared,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+class ImageCache:
+    """
+    Fetches Google Photos images once and serves every size from disk
+    The master copy is fetched at MEDIA_MASTER_SIZE; smaller sizes and
+    WebP/AVIF variants are re-derived from it locally with Pillow instead of
+    being refetched. Sizes above the master are fetched at that size.
+    """
+
+    def __init__(self, disk_cache: Optional[DiskLRUCache] = None,
+                 transport: Optional[HttpTransport] = None,
+                 master_size: Tuple[int, int] = MEDIA_MASTER_SIZE):
+        self.disk_cache = disk_cache or DiskLRUCache()
+        self.transport = transport or get_transport()
+        self.master_size = master_size
+        self.upstream_fetches = 0
+        self.upstream_bytes = 0
+        self.derived = 0
+
+        self._locks_lock = threading.Lock()
+        self._locks = {}
+
+    @staticmethod
+    def cache_key(item_id: str, width: int, height: int, image_format: str = 'jpeg') -> str:
+        variant = f'{item_id}=w{width}-h{height}'
+        if image_format != 'jpeg':
+            variant += f'.{image_format}'
+        return hashlib.sha1(variant.encode()).hexdigest()
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        """Per-key fill lock; every call must be paired with _release_key_lock()"""
+        with self._locks_lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+            return entry[0]
+
+    def _release_key_lock(self, key: str):
+        # The lock is dropped only once no request holds or waits on it
+        with self._locks_lock:
+            entry = self._locks[key]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def is_cached(self, item_id: str, width: int, height: int, image_format: str = 'jpeg') -> bool:
+        return self.disk_cache.contains(self.cache_key(item_id, width, height, image_format))
+
+    def get_image(self, item_id: str, base_url_provider: Callable[[], Optional[str]],
+                  width: int, height: int, image_format: str = 'jpeg') -> Optional[Tuple[Path, str]]:
+        """
+        Get a cached image of at most width x height, fetching it if needed
+        base_url_provider is only called on a cache miss.
+        Returns: (path, etag) or None if the image could not be fetched
+        """
+        key = self.cache_key(item_id, width, height, image_format)
+        path = self.disk_cache.get(key)
+        if path is not None:
+            return path, key
+
+        lock = self._key_lock(key)
+        try:
+            with lock:
+                # Another request may have filled the entry while we waited
+                if self.disk_cache.contains(key):
+                    path = self.disk_cache.get(key)
+                    if path is not None:
+                        return path, key
+
+                master_width, master_height = self.master_size
+                if width <= master_width and height <= master_height and \
+                        ((width, height) != self.master_size or image_format != 'jpeg'):
+                    source = self.get_image(item_id, base_url_provider, master_width, master_height)
+                elif image_format != 'jpeg':
+                    source = self.get_image(item_id, base_url_provider, width, height)
+                else:
+                    data, content_type = self._fetch(base_url_provider, width, height)
+                    if data is None:
+                        return None
+                    return self.disk_cache.put(key, data, content_type), key
+
+                if source is None:
+                    return None
+                data = self._encode(source[0], width, height, image_format)
+                if data is None:
+                    # Pillow can't decode the original; serve it as it is
+                    content_type = mimetypes.guess_type(source[0].name)[0] or 'application/octet-stream'
+                    return self.disk_cache.put(key, source[0].read_bytes(), content_type), key
+                return self.disk_cache.put(key, data, VARIANT_TYPES[image_format]), key
+        finally:
+            self._release_key_lock(key)
+
+    def _fetch(self, base_url_provider: Callable[[], Optional[str]], width: int, height: int):
+        import requests
+        base_url = base_url_provider()
+        if not base_url:
+            return None, None
+
+        try:
+            response = self.transport.get(f'{base_url}=w{width}-h{height}')
+        except requests.RequestException as e:
+            print(f'Error fetching image: {e}')
+            return None, None
+
+        if response.status_code != 200:
+            print(f'Error fetching image: {response.status_code}')
+            return None, None
+
+        self.upstream_fetches += 1
+        self.upstream_bytes += len(response.content)
+        content_type = response.headers.get('Content-Type', 'image/jpeg').split(';')[0]
+        return response.content, content_type
+
+    def _encode(self, source: Path, width: int, height: int, image_format: str) -> Optional[bytes]:
+        """
+        Scale an image down to fit width x height and encode it in image_format
+        Returns: the encoded image, or None if Pillow can't read the source
+        """
+        Image = _pillow()
+        try:
+            with Image.open(source) as image:
+                # draft() lets the JPEG decoder skip straight to a nearby power-of-two scale
+                image.draft('RGB', (width, height))
+                image.thumbnail((width, height), Image.LANCZOS)
+                if image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                output = io.BytesIO()
+                options = {'optimize': True} if image_format == 'jpeg' else {}
+                image.save(output, image_format.upper(), quality=MEDIA_VARIANT_QUALITY[image_format], **options)
+        except (OSError, Image.DecompressionBombError) as e:
+            # UnidentifiedImageError is an OSError too
+            print(f'Error resizing {source.name}: {e}')
+            return None
+        self.derived += 1
+        return output.getvalue()
+
+    def stats(self) -> Dict:
+        return {
+            **self.disk_cache.stats(),
+            'upstream_fetches': self.upstream_fetches,
+            'upstream_bytes': self.upstream_bytes,
+            'derived': self.derived
+        }
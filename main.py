@@ -2,8 +2,13 @@
 """
 Google Photos Slideshow Application
 A standalone slideshow application for Google Photos that works without Kodi.
+
+Usage:
+    python main.py                         # development server
+    python main.py --serve production      # multi-worker gunicorn server
 """
 
+import argparse
 import os
 import sys
 from pathlib import Path
@@ -12,30 +17,121 @@ from pathlib import Path
 current_dir = Path(__file__).parent
 sys.path.insert(0, str(current_dir))
 
-from app import app
-from config import FLASK_ENV
+from config import (
+    FLASK_ENV, SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_THREADS,
+    SERVER_TIMEOUT, SERVER_GRACEFUL_TIMEOUT
+)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Google Photos Slideshow')
+    parser.add_argument('--serve', choices=('development', 'production'),
+                        default='production' if FLASK_ENV == 'production' else 'development',
+                        help='development: Werkzeug dev server; production: gunicorn with several workers')
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS, help='worker processes (production)')
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS, help='threads per worker (production)')
+    return parser.parse_args(argv)
+
+def serve_development(args):
+    """
+    Run the single-process Werkzeug development server
+    In debug mode the reloader re-runs this script in a child process that
+    serves; the parent only watches files, so it must not build the app and
+    start its token refresher, index syncs and sync hub a second time.
+    """
+    debug = FLASK_ENV == 'development'
+    if debug and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        from werkzeug.serving import run_simple
+        run_simple(args.host, args.port, None, use_reloader=True)
+        return
+
+    from app import create_app
+
+    create_app().run(
+        debug=debug,
+        host=args.host,
+        port=args.port,
+        threaded=True
+    )
+
+def serve_production(args):
+    """
+    Run the app under gunicorn with several threaded workers
+    The app is created in each worker rather than preloaded in the master,
+    so every worker starts its own background threads. Send SIGHUP to the
+    master to reload workers gracefully.
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("Production mode needs gunicorn: pip install gunicorn (not available on Windows)")
+        sys.exit(1)
+
+    class SlideshowApplication(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
 
-def main():
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app import create_app
+            return create_app()
+
+    # Workers import the app after forking from this process, so they see the count
+    import config
+    config.SERVER_PROCESSES = args.workers
+    os.environ['SERVER_PROCESSES'] = str(args.workers)
+
+    SlideshowApplication({
+        'bind': f'{args.host}:{args.port}',
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread',
+        'timeout': SERVER_TIMEOUT,
+        'graceful_timeout': SERVER_GRACEFUL_TIMEOUT,
+        'keepalive': 5,
+        'preload_app': False,
+        'accesslog': None
+    }).run()
+
+def use_sync_port(args):
+    """Put the sync hub next to the web server's port unless SYNC_PORT is set"""
+    if 'SYNC_PORT' in os.environ:
+        return
+    # The app reads the port from config when it is first imported, after this
+    import config
+    config.SYNC_PORT = args.port + 1
+    os.environ['SYNC_PORT'] = str(config.SYNC_PORT)
+
+def main(argv=None):
     """Main entry point for the application"""
+    args = parse_args(argv)
+    use_sync_port(args)
+
     print("Google Photos Slideshow")
     print("=" * 30)
     print(f"Environment: {FLASK_ENV}")
-    print("Starting server...")
-    print("Open your browser and go to: http://localhost:5000")
+    if args.serve == 'production':
+        print(f"Starting production server ({args.workers} workers x {args.threads} threads)...")
+    else:
+        print("Starting server...")
+    print(f"Open your browser and go to: http://localhost:{args.port}")
     print("Press Ctrl+C to stop the server")
     print()
-    
+
     # Create necessary directories
     os.makedirs('data/tokens', exist_ok=True)
     os.makedirs('data/cache', exist_ok=True)
-    
+
     try:
-        app.run(
-            debug=(FLASK_ENV == 'development'),
-            host='0.0.0.0',
-            port=5000,
-            threaded=True
-        )
+        if args.serve == 'production':
+            serve_production(args)
+        else:
+            serve_development(args)
     except KeyboardInterrupt:
         print("\nShutting down server...")
     except Exception as e:
@@ -0,0 +1,661 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from config import (
+    MEDIA_INDEX_DIR, MAX_IMAGES_PER_PAGE, INDEX_SYNC_PAGE_SIZE, BASE_URL_MAX_AGE, INDEX_PARALLEL_CRAWL,
+    INDEX_PARALLEL_MIN_SPEEDUP, INDEX_SYNC_LEASE, INDEX_SYNC_MIN_INTERVAL, INDEX_FAVORITES_INTERVAL, ASYNC_RATE_LIMIT,
+    INDEX_CLOSE_TIMEOUT
+)
+from media_item import MediaItem
+from photos_api import GooglePhotosAPI
+from state_store import get_state_store
+
+# Page tokens handed out for index-backed pages, so they can be told apart
+# from the opaque tokens returned by the Photos Library API
+LOCAL_PAGE_PREFIX = 'idx:'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    seq INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    filename TEXT NOT NULL,
+    mime_type TEXT NOT NULL,
+    type TEXT NOT NULL,
+    base_url TEXT NOT NULL,
+    description TEXT NOT NULL,
+    creation_time TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    favorite INTEGER NOT NULL DEFAULT 0,
+    phash INTEGER,
+    phash_at REAL,
+    dup_of TEXT
+);
+CREATE INDEX IF NOT EXISTS items_type_time ON items (type, creation_time DESC, seq DESC);
+CREATE INDEX IF NOT EXISTS items_time ON items (creation_time DESC, seq DESC);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Columns added after the first release, created on older index files at open
+COLUMN_MIGRATIONS = {
+    'favorite': 'INTEGER NOT NULL DEFAULT 0',
+    'phash': 'INTEGER',
+    'phash_at': 'REAL',
+    'dup_of': 'TEXT'
+}
+
+
+class MediaIndex:
+    """On-disk index of processed media items for a single account"""
+
+    def __init__(self, user_id: str, index_dir: str = MEDIA_INDEX_DIR):
+        self.user_id = user_id
+        self.path = Path(index_dir) / f"{user_id}.sqlite3"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        # Background jobs (syncs, dedupe runs) using the connection; close() waits for them
+        self._jobs = 0
+        self._jobs_changed = threading.Condition()
+        self.closing = False
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+            columns = {row['name'] for row in self._conn.execute('PRAGMA table_info(items)')}
+            for column, definition in COLUMN_MIGRATIONS.items():
+                if column not in columns:
+                    self._conn.execute(f'ALTER TABLE items ADD COLUMN {column} {definition}')
+
+    def _get_meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else default
+
+    def _set_meta(self, **values):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                [(key, None if value is None else str(value)) for key, value in values.items()]
+            )
+
+    def is_complete(self) -> bool:
+        """Whether a full crawl of the library has finished at least once"""
+        return self._get_meta('complete') == '1'
+
+    def is_syncing(self) -> bool:
+        return self._sync_lock.locked()
+
+    def begin_job(self) -> bool:
+        """
+        Register a background job that will use the index
+        The job should stop once closing is set and call end_job() when done.
+        Returns: False if the index is being closed
+        """
+        with self._jobs_changed:
+            if self.closing:
+                return False
+            self._jobs += 1
+            return True
+
+    def end_job(self):
+        with self._jobs_changed:
+            self._jobs -= 1
+            self._jobs_changed.notify_all()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+    def status(self) -> Dict:
+        return {
+            'user_id': self.user_id,
+            'complete': self.is_complete(),
+            'syncing': self.is_syncing(),
+            'items': self.count(),
+            'last_sync': float(self._get_meta('last_sync', '0')),
+            'last_sync_added': int(self._get_meta('last_sync_added', '0'))
+        }
+
+    def known_ids(self, media_item_ids: List[str]) -> set:
+        """Return the subset of the given IDs already in the index"""
+        if not media_item_ids:
+            return set()
+        placeholders = ','.join('?' * len(media_item_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT id FROM items WHERE id IN ({placeholders})', media_item_ids
+            ).fetchall()
+        return {row['id'] for row in rows}
+
+    def upsert_items(self, media_items: List[Dict], fetched_at: Optional[float] = None) -> int:
+        """
+        Insert or update raw API media items
+        Returns: number of items that were not in the index before
+        """
+        fetched_at = fetched_at or time.time()
+        rows = []
+        for item in media_items:
+            if 'baseUrl' not in item:
+                continue
+            mime_type = item.get('mimeType', '')
+            metadata = item.get('mediaMetadata', {})
+            rows.append((
+                item['id'],
+                item.get('filename', ''),
+                mime_type,
+                mime_type.split('/')[0] if mime_type else 'unknown',
+                item['baseUrl'],
+                item.get('description', ''),
+                metadata.get('creationTime', ''),
+                json.dumps(metadata, separators=(',', ':')),
+                fetched_at
+            ))
+
+        known = self.known_ids([row[0] for row in rows])
+        with self._lock, self._conn:
+            self._conn.executemany(
+                '''INSERT INTO items
+                   (id, filename, mime_type, type, base_url, description, creation_time, metadata, fetched_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(id) DO UPDATE SET
+                       filename = excluded.filename,
+                       mime_type = excluded.mime_type,
+                       type = excluded.type,
+                       base_url = excluded.base_url,
+                       description = excluded.description,
+                       creation_time = excluded.creation_time,
+                       metadata = excluded.metadata,
+                       fetched_at = excluded.fetched_at''',
+                rows
+            )
+        return len(rows) - len(known)
+
+    def _build_query(self, media_type: str = 'all', start_date: Optional[str] = None,
+                     end_date: Optional[str] = None, exclude_duplicates: bool = False):
+        clauses = []
+        params = []
+        if exclude_duplicates:
+            # Favorites are always shown, even when they duplicate another photo
+            clauses.append('(dup_of IS NULL OR favorite = 1)')
+        if media_type != 'all':
+            clauses.append('type = ?')
+            params.append(media_type)
+        if start_date and end_date:
+            # creationTime is RFC 3339, so day bounds compare correctly as strings
+            clauses.append('creation_time >= ? AND creation_time <= ?')
+            params.extend([_normalize_date(start_date), _normalize_date(end_date) + 'T99'])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        return where, params
+
+    def query_page(self, media_type: str = 'all', start_date: Optional[str] = None,
+                   end_date: Optional[str] = None, page_token: Optional[str] = None,
+                   page_size: int = MAX_IMAGES_PER_PAGE, exclude_duplicates: bool = False) -> Dict:
+        """
+        Get one page of indexed items, newest first
+        Page tokens carry the (creation_time, seq) of the last item served, so
+        every page is an index seek rather than an OFFSET scan.
+        Returns: dict with MediaItems under mediaItems and nextPageToken
+        """
+        where, params = self._build_query(media_type, start_date, end_date, exclude_duplicates)
+        if page_token and page_token.startswith(LOCAL_PAGE_PREFIX):
+            creation_time, _, seq = page_token[len(LOCAL_PAGE_PREFIX):].rpartition('|')
+            where = f"{where} {'AND' if where else 'WHERE'} (creation_time, seq) < (?, ?)"
+            params.extend([creation_time, int(seq)])
+
+        with self._lock:
+            rows = self._conn.execute(
+                f'''SELECT seq, id, filename, mime_type, base_url, description, creation_time, fetched_at
+                    FROM items {where} ORDER BY creation_time DESC, seq DESC LIMIT ?''',
+                params + [page_size + 1]
+            ).fetchall()
+
+        next_page_token = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            next_page_token = f"{LOCAL_PAGE_PREFIX}{last['creation_time']}|{last['seq']}"
+
+        return {
+            'mediaItems': [
+                MediaItem(row[1], row[2], row[3], row[4], row[5], row[6]) for row in rows
+            ],
+            'fetchedAt': [row[7] for row in rows],
+            'nextPageToken': next_page_token
+        }
+
+    def max_seq(self) -> int:
+        """Highest item sequence number; seqs are dense from 1 as items are never deleted"""
+        with self._lock:
+            return self._conn.execute('SELECT COALESCE(MAX(seq), 0) FROM items').fetchone()[0]
+
+    def items_by_seq(self, seqs: List[int], media_type: str = 'all', start_date: Optional[str] = None,
+                     end_date: Optional[str] = None, exclude_duplicates: bool = False) -> Dict[int, sqlite3.Row]:
+        """
+        Look up items by sequence number, keeping only those matching the filters
+        Returns: dict of seq to row (seq, id, filename, mime_type, base_url,
+        description, creation_time, fetched_at, favorite)
+        """
+        if not seqs:
+            return {}
+        where, params = self._build_query(media_type, start_date, end_date, exclude_duplicates)
+        where = f"{where} {'AND' if where else 'WHERE'} seq IN ({','.join('?' * len(seqs))})"
+        # NOT INDEXED keeps the planner on primary key lookups instead of scanning the type index
+        with self._lock:
+            rows = self._conn.execute(
+                f'''SELECT seq, id, filename, mime_type, base_url, description, creation_time, fetched_at, favorite
+                    FROM items NOT INDEXED {where}''',
+                params + list(seqs)
+            ).fetchall()
+        return {row['seq']: row for row in rows}
+
+    def duplicate_ids(self, media_item_ids: List[str]) -> set:
+        """Return the subset of the given IDs known to duplicate another (non-favorite) item"""
+        if not media_item_ids:
+            return set()
+        placeholders = ','.join('?' * len(media_item_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT id FROM items WHERE id IN ({placeholders}) AND dup_of IS NOT NULL AND favorite = 0',
+                media_item_ids
+            ).fetchall()
+        return {row['id'] for row in rows}
+
+    def items_to_hash(self, limit: int, retry_before: float) -> List[sqlite3.Row]:
+        """
+        Images without a perceptual hash, oldest first
+        Items whose thumbnail failed are skipped until retry_before has passed.
+        Returns: rows (seq, id, base_url, fetched_at)
+        """
+        with self._lock:
+            return self._conn.execute(
+                '''SELECT seq, id, base_url, fetched_at FROM items
+                   WHERE type = 'image' AND phash IS NULL AND (phash_at IS NULL OR phash_at < ?)
+                   ORDER BY seq LIMIT ?''',
+                (retry_before, limit)
+            ).fetchall()
+
+    def hashed_representatives(self) -> List[sqlite3.Row]:
+        """
+        Hashed items that are not duplicates themselves
+        Returns: rows (id, phash)
+        """
+        with self._lock:
+            return self._conn.execute(
+                'SELECT id, phash FROM items WHERE phash IS NOT NULL AND dup_of IS NULL ORDER BY seq'
+            ).fetchall()
+
+    def set_hashes(self, hashes: List[tuple], hashed_at: Optional[float] = None):
+        """
+        Store perceptual hashes as (id, phash, dup_of) tuples
+        A phash of None records a failed attempt so it is retried later.
+        """
+        hashed_at = hashed_at or time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'UPDATE items SET phash = ?, phash_at = ?, dup_of = ? WHERE id = ?',
+                [(phash, hashed_at, dup_of, media_item_id) for media_item_id, phash, dup_of in hashes]
+            )
+
+    def dedupe_status(self) -> Dict:
+        with self._lock:
+            row = self._conn.execute(
+                '''SELECT COUNT(*) AS images, COUNT(phash) AS hashed, COUNT(dup_of) AS duplicates
+                   FROM items WHERE type = 'image' '''
+            ).fetchone()
+        return {'images': row['images'], 'hashed': row['hashed'], 'duplicates': row['duplicates']}
+
+    def get_item(self, media_item_id: str) -> Optional[Dict]:
+        """
+        Look up a single indexed item
+        Returns: raw media item with its fetchedAt time, or None
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM items WHERE id = ?', (media_item_id,)).fetchone()
+        if row is None:
+            return None
+        return {**_row_to_media_item(row), 'fetchedAt': row['fetched_at']}
+
+    def items_by_id(self, media_item_ids: List[str]) -> Dict:
+        """
+        Look up indexed items, keeping the order of the given IDs
+        Returns: dict with MediaItems under mediaItems and their fetchedAt times
+        """
+        rows = {}
+        for start in range(0, len(media_item_ids), 500):
+            chunk = media_item_ids[start:start + 500]
+            with self._lock:
+                for row in self._conn.execute(
+                    f'''SELECT id, filename, mime_type, base_url, description, creation_time, fetched_at
+                        FROM items WHERE id IN ({','.join('?' * len(chunk))})''',
+                    chunk
+                ):
+                    rows[row[0]] = row
+        found = [rows[media_item_id] for media_item_id in media_item_ids if media_item_id in rows]
+        return {
+            'mediaItems': [MediaItem(row[0], row[1], row[2], row[3], row[4], row[5]) for row in found],
+            'fetchedAt': [row[6] for row in found]
+        }
+
+    def search_rows(self) -> List[tuple]:
+        """
+        Every item's searchable fields, newest first
+        Returns: tuples of (id, filename, mime_type, type, description,
+        creation_time, camera_make, camera_model, favorite, duplicate, seq)
+        """
+        with self._lock:
+            return self._conn.execute(
+                '''SELECT id, filename, mime_type, type, description, creation_time,
+                          COALESCE(json_extract(metadata, '$.photo.cameraMake'),
+                                   json_extract(metadata, '$.video.cameraMake'), ''),
+                          COALESCE(json_extract(metadata, '$.photo.cameraModel'),
+                                   json_extract(metadata, '$.video.cameraModel'), ''),
+                          favorite, dup_of IS NOT NULL, seq
+                   FROM items ORDER BY creation_time DESC, seq DESC'''
+            ).fetchall()
+
+    def search_version(self) -> tuple:
+        """Changes whenever items are added, a sync finishes or duplicates and favorites are marked"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT COUNT(*), COUNT(dup_of), COALESCE(SUM(favorite), 0) FROM items'
+            ).fetchone()
+        return tuple(row) + (self._get_meta('last_sync'),)
+
+    def refresh_base_urls(self, page: Dict, api: GooglePhotosAPI, max_age: float = BASE_URL_MAX_AGE):
+        """Re-fetch baseUrls that are about to expire, in batches of 50"""
+        now = time.time()
+        stale = [
+            item.id for item, fetched_at in zip(page['mediaItems'], page['fetchedAt'])
+            if now - fetched_at > max_age
+        ]
+        if not stale:
+            return
+
+        fresh = {}
+        for start in range(0, len(stale), 50):
+            result = api.batch_get_media_items(stale[start:start + 50])
+            for entry in result.get('mediaItemResults', []):
+                media_item = entry.get('mediaItem')
+                if media_item:
+                    fresh[media_item['id']] = media_item
+
+        if not fresh:
+            return
+
+        self.upsert_items(list(fresh.values()), now)
+        for index, item in enumerate(page['mediaItems']):
+            if item.id in fresh:
+                item.base_url = fresh[item.id]['baseUrl']
+                page['fetchedAt'][index] = now
+
+    def sync(self, api_factory: Callable[[], Optional[GooglePhotosAPI]],
+             page_size: int = INDEX_SYNC_PAGE_SIZE, parallel: bool = INDEX_PARALLEL_CRAWL) -> int:
+        """
+        Pull the library into the index
+        The first sync crawls everything, either as concurrent per-year searches
+        (when parallel and the first page shows that pays off) or serially,
+        resuming where an interrupted crawl stopped; later syncs only page
+        until already-known items are reached.
+        Returns: number of new items added, or -1 if a sync is already running
+        """
+        if not self.begin_job():
+            return 0
+        if not self._sync_lock.acquire(blocking=False):
+            self.end_job()
+            return -1
+
+        try:
+            added = 0
+            if self.is_complete():
+                added += self._crawl(api_factory, page_size, None, stop_on_known=True)
+            elif parallel and not self._get_meta('resume_token'):
+                added += self._crawl_probed(api_factory, page_size)
+            else:
+                resume_token = self._get_meta('resume_token')
+                added += self._crawl(api_factory, page_size, resume_token, stop_on_known=False)
+                if resume_token and self.is_complete():
+                    # Items added while the crawl was interrupted sit at the head of the library
+                    added += self._crawl(api_factory, page_size, None, stop_on_known=True)
+
+            # Favorites can only be listed in full, so they are re-read on a slower schedule
+            favorites_age = time.time() - float(self._get_meta('favorites_synced', '0'))
+            if self.is_complete() and favorites_age >= INDEX_FAVORITES_INTERVAL:
+                self._sync_favorites(api_factory)
+            self._set_meta(last_sync=time.time(), last_sync_added=added)
+            return added
+        finally:
+            self._sync_lock.release()
+            self.end_job()
+
+    def _sync_favorites(self, api_factory):
+        """Mark the items currently favorited in Google Photos"""
+        favorite_ids = []
+        page_token = None
+        while True:
+            if self.closing:
+                return
+            api = api_factory()
+            if api is None:
+                return
+            result = api.search_media_items(api.create_favorites_filter(), page_token)
+            if not result:
+                print(f'Index sync for {self.user_id}: failed to fetch favorites')
+                return
+            media_items = result.get('mediaItems', [])
+            self.upsert_items(media_items)
+            favorite_ids.extend(item['id'] for item in media_items)
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                break
+
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE items SET favorite = 0 WHERE favorite = 1')
+            self._conn.executemany('UPDATE items SET favorite = 1 WHERE id = ?', [(i,) for i in favorite_ids])
+        self._set_meta(favorites_synced=time.time())
+
+    def _crawl(self, api_factory, page_size: int, page_token: Optional[str], stop_on_known: bool) -> int:
+        added = 0
+        while True:
+            if self.closing:
+                return added
+            api = api_factory()
+            if api is None:
+                print(f'Index sync for {self.user_id} stopped: no valid credentials')
+                return added
+
+            result = api.get_media_items(page_token, page_size=page_size)
+            if not result:
+                print(f'Index sync for {self.user_id} stopped: failed to fetch page')
+                return added
+
+            media_items = result.get('mediaItems', [])
+            new_items = self.upsert_items(media_items)
+            added += new_items
+            page_token = result.get('nextPageToken')
+
+            if stop_on_known:
+                if new_items < len(media_items) or not page_token:
+                    return added
+            else:
+                self._set_meta(resume_token=page_token)
+                if not page_token:
+                    self._set_meta(complete=1)
+                    return added
+
+    def _crawl_probed(self, api_factory, page_size: int) -> int:
+        """
+        Fetch the first page serially and crawl the rest in parallel only if that is faster
+        The per-year searches cost a request per year on top of the pages and
+        are held to the same request rate, so they only beat a serial walk
+        when page latency, not the rate limit, is what holds the walk back.
+        """
+        api = api_factory()
+        if api is None:
+            print(f'Index sync for {self.user_id} stopped: no valid credentials')
+            return 0
+
+        start = time.perf_counter()
+        result = api.get_media_items(None, page_size=page_size)
+        latency = time.perf_counter() - start
+        if not result:
+            print(f'Index sync for {self.user_id} stopped: failed to fetch page')
+            return 0
+
+        added = self.upsert_items(result.get('mediaItems', []))
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            self._set_meta(complete=1)
+            return added
+
+        rate = min(ASYNC_RATE_LIMIT, api.rate_limiter.account_rate)
+        if latency * rate >= INDEX_PARALLEL_MIN_SPEEDUP:
+            return added + self._crawl_parallel(api_factory)
+        self._set_meta(resume_token=page_token)
+        return added + self._crawl(api_factory, page_size, page_token, stop_on_known=False)
+
+    def _crawl_parallel(self, api_factory) -> int:
+        # asyncio and aiohttp are only needed to crawl a library; keep them off the startup path
+        import asyncio
+        from async_photos_api import crawl_sources, year_partitions
+
+        api = api_factory()
+        if api is None:
+            print(f'Index sync for {self.user_id} stopped: no valid credentials')
+            return 0
+
+        added = 0
+
+        def on_page(source, media_items):
+            nonlocal added
+            if self.closing:
+                return False
+            added += self.upsert_items(media_items)
+
+        def token_provider():
+            if self.closing:
+                return None
+            fresh_api = api_factory()
+            return fresh_api.access_token if fresh_api else None
+
+        complete = asyncio.run(crawl_sources(
+            api.access_token, year_partitions(), on_page, token_provider, api.api_base,
+            quota=api.rate_limiter, account=api.account
+        ))
+        if complete and not self.closing:
+            self._set_meta(complete=1, resume_token=None)
+        else:
+            print(f'Index sync for {self.user_id} incomplete: some partitions failed')
+        return added
+
+    def close(self, timeout: float = INDEX_CLOSE_TIMEOUT) -> bool:
+        """
+        Stop background jobs and close the database
+        Jobs check closing between pages and batches; the connection is only
+        closed once they have all finished, so none fails halfway through.
+        Returns: False if a job was still running after timeout; the connection
+        is then left for the job to drop
+        """
+        with self._jobs_changed:
+            self.closing = True
+            if not self._jobs_changed.wait_for(lambda: self._jobs == 0, timeout):
+                return False
+        with self._lock:
+            self._conn.close()
+        return True
+
+
+def _normalize_date(date_str: str) -> str:
+    """Turn YYYY-M-D into zero-padded YYYY-MM-DD"""
+    year, month, day = (int(part) for part in date_str.split('-'))
+    return f'{year:04d}-{month:02d}-{day:02d}'
+
+
+def _row_to_media_item(row: sqlite3.Row) -> Dict:
+    """Rebuild the raw API media item shape from an index row"""
+    media_item = {
+        'id': row['id'],
+        'filename': row['filename'],
+        'mimeType': row['mime_type'],
+        'baseUrl': row['base_url'],
+        'mediaMetadata': json.loads(row['metadata'])
+    }
+    if row['description']:
+        media_item['description'] = row['description']
+    return media_item
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_media_index(user_id: str) -> MediaIndex:
+    """Get the shared MediaIndex for an account"""
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is None:
+            index = _indexes[user_id] = MediaIndex(user_id)
+        return index
+
+
+def start_background_sync(user_id: str, api_factory: Callable[[], Optional[GooglePhotosAPI]],
+                          on_complete: Optional[Callable[[int], None]] = None, force: bool = False) -> bool:
+    """
+    Start a background index sync for an account
+    Unless forced, an account synced less than INDEX_SYNC_MIN_INTERVAL ago
+    is left alone, so displays loading their first page don't each start one.
+    on_complete is called with the number of new items after the sync finishes.
+    Returns: False if a sync is already running in this or another worker
+    process, or the last one was too recent
+    """
+    index = get_media_index(user_id)
+    if index.is_syncing():
+        return False
+    if not force and time.time() - float(index._get_meta('last_sync', '0')) < INDEX_SYNC_MIN_INTERVAL:
+        return False
+
+    store = get_state_store()
+    lease = f'index-sync:{user_id}'
+    if not store.acquire_lease(lease, INDEX_SYNC_LEASE):
+        return False
+
+    def run():
+        added = None
+        try:
+            added = index.sync(api_factory)
+        finally:
+            # -1 means another thread of this process is syncing and still holds the lease
+            if added != -1:
+                store.release_lease(lease)
+        if on_complete is not None and added is not None and added != -1 and not index.closing:
+            on_complete(added)
+
+    thread = threading.Thread(target=run, name=f'index-sync-{user_id}', daemon=True)
+    thread.start()
+    return True
+
+
+def remove_media_index(user_id: str) -> bool:
+    """Drop an account's index from memory and disk"""
+    with _indexes_lock:
+        index = _indexes.pop(user_id, None)
+    if index is not None and not index.close():
+        print(f'Index for {user_id} removed while a background job was still using it')
+
+    removed = False
+    for suffix in ('', '-wal', '-shm'):
+        path = Path(MEDIA_INDEX_DIR) / f"{user_id}.sqlite3{suffix}"
+        if path.exists():
+            path.unlink()
+            removed = True
+    return removed
@@ -0,0 +1,179 @@
+import json
+import sys
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import DISPLAY_SIZE, THUMBNAIL_SIZE
+
+_intern = sys.intern
+
+
+class MediaItem:
+    """
+    Compact representation of one media item
+    Only the fields the slideshow needs are kept, in __slots__; the item
+    type and the display/thumbnail/video URLs are derived on demand instead
+    of being stored alongside the baseUrl they are built from.
+    """
+
+    __slots__ = ('id', 'filename', 'mime_type', 'base_url', 'description', 'creation_time')
+
+    def __init__(self, id: str, filename: str, mime_type: str, base_url: str,
+                 description: str = '', creation_time: str = ''):
+        self.id = id
+        self.filename = filename
+        # A library has a handful of distinct MIME types; share one string for each
+        self.mime_type = _intern(mime_type)
+        self.base_url = base_url
+        self.description = description
+        self.creation_time = creation_time
+
+    @classmethod
+    def from_api(cls, item: Dict) -> 'MediaItem':
+        """Build from a raw Photos Library API media item"""
+        return cls(
+            item['id'],
+            item['filename'],
+            item.get('mimeType', ''),
+            item['baseUrl'],
+            item.get('description', ''),
+            item.get('mediaMetadata', {}).get('creationTime', '')
+        )
+
+    @classmethod
+    def from_page(cls, media_items: Iterable[Dict]) -> List['MediaItem']:
+        """Build items for a whole API page in one pass"""
+        new = cls.__new__
+        items = []
+        append = items.append
+        for raw in media_items:
+            item = new(cls)
+            item.id = raw['id']
+            item.filename = raw['filename']
+            item.mime_type = _intern(raw.get('mimeType', ''))
+            item.base_url = raw['baseUrl']
+            item.description = raw.get('description', '')
+            item.creation_time = raw.get('mediaMetadata', {}).get('creationTime', '')
+            append(item)
+        return items
+
+    @property
+    def type(self) -> str:
+        return self.mime_type.partition('/')[0] or 'unknown'
+
+    @property
+    def display_url(self) -> str:
+        return f'{self.base_url}=w{DISPLAY_SIZE[0]}-h{DISPLAY_SIZE[1]}'
+
+    @property
+    def thumbnail_url(self) -> str:
+        return f'{self.base_url}=w{THUMBNAIL_SIZE[0]}-h{THUMBNAIL_SIZE[1]}'
+
+    @property
+    def video_url(self) -> str:
+        return f'{self.base_url}=dv'
+
+    def to_dict(self, media_url_prefix: Optional[str] = None,
+                display_size: Optional[Tuple[int, int]] = None) -> Dict:
+        """
+        Convert to the shape served to the frontend
+        With media_url_prefix, image, poster, thumbnail and video URLs point
+        at the local media proxy (prefix + item id) instead of Google.
+        display_size sets the slide image and poster size, e.g. the rung
+        picked for the client's screen.
+        """
+        item_type = self.type
+        processed_item = {
+            'id': self.id,
+            'filename': self.filename,
+            'mimeType': self.mime_type,
+            'type': item_type,
+            'baseUrl': self.base_url,
+            'description': self.description,
+            'creationTime': self.creation_time
+        }
+
+        if item_type in ('image', 'video'):
+            # A video's slide image is its poster frame, shown until the clip plays
+            slide_key = 'displayUrl' if item_type == 'image' else 'posterUrl'
+            if media_url_prefix is None:
+                processed_item[slide_key] = self.display_url if display_size is None else \
+                    f'{self.base_url}=w{display_size[0]}-h{display_size[1]}'
+                processed_item['thumbnailUrl'] = self.thumbnail_url
+            else:
+                processed_item[slide_key] = media_url_prefix + self.id if display_size is None else \
+                    f'{media_url_prefix}{self.id}?w={display_size[0]}&h={display_size[1]}'
+                processed_item['thumbnailUrl'] = f'{media_url_prefix}{self.id}?w={THUMBNAIL_SIZE[0]}&h={THUMBNAIL_SIZE[1]}'
+        if item_type == 'video':
+            processed_item['videoUrl'] = self.video_url if media_url_prefix is None else \
+                f'{media_url_prefix}{self.id}/video'
+
+        return processed_item
+
+    def to_compact_dict(self, keep_base_url: bool = True) -> Dict:
+        """
+        Convert to the compact wire shape, without derived fields
+        Clients rebuild type and the display/poster/thumbnail/video URLs from
+        mimeType, baseUrl and the page's urls (see page_urls()). Proxied
+        items don't need baseUrl, so keep_base_url=False leaves it out.
+        """
+        compact = {
+            'id': self.id,
+            'filename': self.filename,
+            'mimeType': self.mime_type,
+            'creationTime': self.creation_time
+        }
+        if self.description:
+            compact['description'] = self.description
+        if keep_base_url:
+            compact['baseUrl'] = self.base_url
+        return compact
+
+
+def page_urls(media_url_prefix=None, display_size: Optional[Tuple[int, int]] = None) -> Dict:
+    """
+    What a client needs to rebuild the URLs of compact items, the same way to_dict() does
+    media is the media proxy prefix (or, for pages mixing accounts, a dict of
+    prefixes by user ID), or None when images come straight from Google.
+    display is the slide size, or None for the proxy's default size.
+    """
+    if display_size is None and media_url_prefix is None:
+        display_size = DISPLAY_SIZE
+    return {
+        'media': media_url_prefix,
+        'display': list(display_size) if display_size else None,
+        'thumbnail': list(THUMBNAIL_SIZE)
+    }
+
+
+def filter_by_type(items: List[MediaItem], media_type: str = 'image') -> List[MediaItem]:
+    """Keep items of one type ('image', 'video' or 'all')"""
+    if media_type == 'all':
+        return items
+    prefix = f'{media_type}/'
+    return [item for item in items if item.mime_type.startswith(prefix)]
+
+
+def dumps_page(items: List[MediaItem], next_page_token: Optional[str] = None,
+               media_url_prefix: Optional[str] = None, display_size: Optional[Tuple[int, int]] = None,
+               compact: bool = False) -> str:
+    """
+    Serialize a page of items straight to the /api/photos JSON body
+    compact sends items without their derived fields, plus the page's urls.
+    """
+    if compact:
+        keep_base_url = media_url_prefix is None
+        return json.dumps(
+            {
+                'mediaItems': [item.to_compact_dict(keep_base_url) for item in items],
+                'nextPageToken': next_page_token,
+                'urls': page_urls(media_url_prefix, display_size)
+            },
+            separators=(',', ':')
+        )
+    return json.dumps(
+        {
+            'mediaItems': [item.to_dict(media_url_prefix, display_size) for item in items],
+            'nextPageToken': next_page_token
+        },
+        separators=(',', ':')
+    )
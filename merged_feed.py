@@ -0,0 +1,171 @@
+import base64
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import MERGE_WORKERS, MERGE_ACCOUNT_TIMEOUT, MERGE_PAGE_CACHE_TTL, MERGE_DEDUPE_WINDOW
+from media_item import MediaItem
+from response_cache import ResponseCache
+
+POLICIES = ('time', 'interleave')
+
+
+def _dedupe_key(item: MediaItem) -> str:
+    """Short key identifying the same photo across accounts (item IDs differ per account)"""
+    basis = f'{item.filename}|{item.creation_time}' if item.creation_time else item.id
+    return hashlib.blake2b(basis.encode(), digest_size=6).hexdigest()
+
+
+class FeedCursor:
+    """
+    Composite position in a merged feed, serialized into an opaque token
+    Each account keeps its own upstream page token plus how many items of
+    that page were already served.
+    """
+
+    def __init__(self, accounts: Optional[Dict[str, Dict]] = None, turn: int = 0,
+                 recent: Optional[List[str]] = None):
+        self.accounts = accounts or {}  # user_id -> {'t': page token, 'o': offset, 'd': done}
+        self.turn = turn
+        self.recent = recent or []
+
+    def account(self, user_id: str) -> Dict:
+        return self.accounts.setdefault(user_id, {'t': None, 'o': 0, 'd': False})
+
+    def encode(self) -> str:
+        state = {'a': self.accounts, 'r': self.turn, 'k': self.recent}
+        return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode().rstrip('=')
+
+    @classmethod
+    def decode(cls, token: str) -> Optional['FeedCursor']:
+        """Returns: the cursor, or None if the token is malformed"""
+        try:
+            state = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            cursor = cls(dict(state['a']), int(state['r']), list(state['k']))
+        except (ValueError, TypeError, KeyError):
+            return None
+        if cursor.turn < 0 or not all(isinstance(key, str) for key in cursor.recent):
+            return None
+        if not all(_valid_account(account) for account in cursor.accounts.values()):
+            return None
+        return cursor
+
+
+def _valid_account(account) -> bool:
+    """Check one decoded account position has the shape FeedCursor.account() gives it"""
+    return (
+        isinstance(account, dict)
+        and (account.get('t') is None or isinstance(account['t'], str))
+        and type(account.get('o')) is int and account['o'] >= 0
+        and isinstance(account.get('d'), bool)
+    )
+
+
+class MergedFeed:
+    """
+    One feed over several accounts, fetched in parallel
+    Each account's pages are fetched on a shared thread pool with a common
+    deadline; accounts that miss it are left out of that page (their
+    position is kept, so they rejoin later) instead of stalling the rest.
+    Items are merged newest first or round-robin, and photos shared between
+    accounts are only served once.
+    """
+
+    def __init__(self, max_workers: int = MERGE_WORKERS, timeout: float = MERGE_ACCOUNT_TIMEOUT,
+                 dedupe_window: int = MERGE_DEDUPE_WINDOW):
+        self.timeout = timeout
+        self.dedupe_window = dedupe_window
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='merged-feed')
+        # Account pages are served out over several merged pages; keep them briefly
+        self._pages = ResponseCache(ttl=MERGE_PAGE_CACHE_TTL, stale_ttl=0)
+
+    def next_page(self, user_ids: List[str], page_fetcher: Callable[[str, Optional[str]], Dict],
+                  cursor: Optional[FeedCursor] = None, page_size: int = 100, policy: str = 'time',
+                  source_key: Tuple = ()) -> Dict:
+        """
+        Get the next merged page
+        page_fetcher(user_id, page_token) returns {'mediaItems': [MediaItem], 'nextPageToken'}
+        or {} on failure; source_key distinguishes filters in the page cache.
+        Returns: dict with (user_id, MediaItem) pairs under items, the next cursor
+        (None when every account is exhausted) and per-account status
+        """
+        cursor = cursor or FeedCursor()
+        deadline = time.monotonic() + self.timeout
+        buffers = {}
+        next_tokens = {}
+        status = {}
+        recent = set(cursor.recent)
+
+        def refill(accounts):
+            futures = {}
+            for user_id in accounts:
+                state = cursor.account(user_id)
+                key = (user_id, source_key, state['t'])
+                futures[self._executor.submit(
+                    self._pages.get, key, lambda user_id=user_id, token=state['t']: page_fetcher(user_id, token)
+                )] = user_id
+            done, _ = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+            for future, user_id in futures.items():
+                if future not in done:
+                    status[user_id] = 'timeout'
+                    continue
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f'Error fetching merged page for {user_id}: {e}')
+                    result = {}
+                if not result:
+                    status[user_id] = 'error'
+                    continue
+                status[user_id] = 'ok'
+                buffers[user_id] = result.get('mediaItems', [])[cursor.account(user_id)['o']:]
+                next_tokens[user_id] = result.get('nextPageToken')
+
+        refill([user_id for user_id in user_ids if not cursor.account(user_id)['d']])
+
+        items = []
+        while len(items) < page_size:
+            active = [user_id for user_id in user_ids if user_id in buffers]
+            dry = [user_id for user_id in active if not buffers[user_id]]
+            if dry:
+                # Move exhausted accounts to their next page before merging further
+                for user_id in dry:
+                    del buffers[user_id]
+                    state = cursor.account(user_id)
+                    state['t'], state['o'] = next_tokens.pop(user_id), 0
+                    state['d'] = state['t'] is None
+                    if state['d']:
+                        status[user_id] = 'done'
+                refill([user_id for user_id in dry if not cursor.account(user_id)['d']])
+                continue
+            if not active:
+                break
+
+            if policy == 'interleave':
+                user_id = active[cursor.turn % len(active)]
+                cursor.turn += 1
+            else:
+                user_id = max(active, key=lambda uid: (buffers[uid][0].creation_time, uid))
+
+            item = buffers[user_id].pop(0)
+            cursor.account(user_id)['o'] += 1
+            key = _dedupe_key(item)
+            if key in recent:
+                continue
+            recent.add(key)
+            cursor.recent.append(key)
+            items.append((user_id, item))
+
+        del cursor.recent[:-self.dedupe_window]
+        finished = all(cursor.account(user_id)['d'] for user_id in user_ids)
+        return {
+            'items': items,
+            'cursor': None if finished else cursor.encode(),
+            'accounts': {user_id: status.get(user_id, 'done') for user_id in user_ids},
+            'partial': any(state in ('timeout', 'error') for state in status.values())
+        }
+
+    def stats(self) -> Dict:
+        return {'page_cache': self._pages.stats()}
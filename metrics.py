@@ -0,0 +1,404 @@
+import bisect
+import threading
+import time
+import weakref
+from typing import Callable, Iterable, List, Sequence, Tuple
+
+from config import METRICS_LATENCY_BUCKETS, METRICS_SIZE_BUCKETS
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Shards:
+    """
+    Per-thread value arrays that are summed when read
+    Each thread only ever writes its own pre-allocated list, so hot-path
+    updates take no lock; the lock is held once per thread, when its shard
+    is created, and once more when the thread ends and its values are
+    folded into a shared base total.
+    """
+
+    __slots__ = ('_width', '_local', '_shards', '_base', '_next_key', '_lock')
+
+    def __init__(self, width: int):
+        self._width = width
+        self._local = threading.local()
+        self._shards = {}
+        self._base = [0] * width
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    def get(self) -> List[float]:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = [0] * self._width
+            # The holder goes away with the thread's locals, i.e. when the thread ends
+            holder = self._local.holder = _ShardHolder()
+            with self._lock:
+                key = self._next_key
+                self._next_key += 1
+                self._shards[key] = shard
+            weakref.finalize(holder, self._retire, key)
+            return shard
+
+    def _retire(self, key: int):
+        """Fold a finished thread's shard into the base total and forget it"""
+        with self._lock:
+            shard = self._shards.pop(key, None)
+            if shard is not None:
+                self._base = [base + value for base, value in zip(self._base, shard)]
+
+    def total(self) -> List[float]:
+        with self._lock:
+            shards = [self._base] + list(self._shards.values())
+        return [sum(values) for values in zip(*shards)]
+
+    def __len__(self) -> int:
+        """Live shards, one per thread that has written and is still running"""
+        return len(self._shards)
+
+
+class _ShardHolder:
+    __slots__ = ('__weakref__',)
+
+
+class _CounterChild:
+    __slots__ = ('_shards',)
+
+    def __init__(self):
+        self._shards = _Shards(1)
+
+    def inc(self, amount: float = 1):
+        self._shards.get()[0] += amount
+
+    def samples(self, name: str, labels: str) -> Iterable[str]:
+        yield f'{name}{labels} {_format(self._shards.total()[0])}'
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1):
+        self._shards.get()[0] -= amount
+
+    def track(self) -> '_Tracking':
+        """Context manager that counts the block as in progress"""
+        return _Tracking(self)
+
+
+class _Tracking:
+    __slots__ = ('_gauge',)
+
+    def __init__(self, gauge: _GaugeChild):
+        self._gauge = gauge
+
+    def __enter__(self):
+        self._gauge.inc()
+
+    def __exit__(self, *exc_info):
+        self._gauge.dec()
+
+
+class _HistogramChild:
+    __slots__ = ('_bounds', '_shards')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._bounds = bounds
+        # One slot per bucket, one for +Inf, then the sum of observations
+        self._shards = _Shards(len(bounds) + 2)
+
+    def observe(self, value: float):
+        shard = self._shards.get()
+        shard[bisect.bisect_left(self._bounds, value)] += 1
+        shard[-1] += value
+
+    def time(self) -> '_Timer':
+        """Context manager that observes the block's duration in seconds"""
+        return _Timer(self)
+
+    def samples(self, name: str, labels: str) -> Iterable[str]:
+        totals = self._shards.total()
+        prefix = f'{labels[:-1]},' if labels else '{'
+        cumulative = 0
+        for bound, count in zip(self._bounds + (float('inf'),), totals):
+            cumulative += count
+            yield f'{name}_bucket{prefix}le="{_format(bound)}"}} {_format(cumulative)}'
+        yield f'{name}_sum{labels} {_format(totals[-1])}'
+        yield f'{name}_count{labels} {_format(cumulative)}'
+
+
+class _Timer:
+    __slots__ = ('_histogram', '_start')
+
+    def __init__(self, histogram: _HistogramChild):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._start)
+
+
+class Metric:
+    """
+    A named metric with optional labels
+    Children for each label combination are created once and then looked up
+    without locking, so call sites can resolve labels on every request.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lookup = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        # Keyed by the values as passed, so repeat lookups skip the str() conversion
+        child = self._lookup.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}')
+            key = tuple(str(value) for value in values)
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+                self._lookup[values] = child
+        return child
+
+    def collect(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        for values, child in sorted(self._children.copy().items()):
+            yield from child.samples(self.name, _labels(self.labelnames, values))
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._default.dec(amount)
+
+    def track(self) -> _Tracking:
+        return self._default.track()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = METRICS_LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def time(self) -> _Timer:
+        return self._default.time()
+
+
+class CallbackMetric(Metric):
+    """
+    Metric whose samples are read from a callback at scrape time
+    Used to expose counters that components already keep in their stats().
+    The callback returns (label values, value) pairs.
+    """
+
+    def __init__(self, name: str, help_text: str, kind: str, labelnames: Sequence[str],
+                 callback: Callable[[], Iterable[Tuple[Sequence, float]]]):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._callback = callback
+
+    def labels(self, *values):
+        raise TypeError(f'{self.name} is read from a callback')
+
+    def collect(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        try:
+            samples = list(self._callback())
+        except Exception as e:
+            print(f'Error collecting metric {self.name}: {e}')
+            return
+        for values, value in samples:
+            if value is not None:
+                labels = _labels(self.labelnames, tuple(str(v) for v in values))
+                yield f'{self.name}{labels} {_format(value)}'
+
+
+class Registry:
+    """Set of metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Add a metric, or return the one already registered under its name
+        Returns: the registered metric
+        """
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f'Metric {metric.name} is already registered differently')
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def unregister(self, name: str):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def expose(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+def _format(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def get_registry() -> Registry:
+    """Get the process-wide metrics registry"""
+    global _default_registry
+    if _default_registry is None:
+        with _default_registry_lock:
+            if _default_registry is None:
+                _default_registry = Registry()
+    return _default_registry
+
+
+def counter(name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+    return get_registry().register(Counter(name, help_text, labelnames))
+
+
+def gauge(name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return get_registry().register(Gauge(name, help_text, labelnames))
+
+
+def histogram(name: str, help_text: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = METRICS_LATENCY_BUCKETS) -> Histogram:
+    return get_registry().register(Histogram(name, help_text, labelnames, buckets))
+
+
+def callback(name: str, help_text: str, kind: str, labelnames: Sequence[str],
+             fn: Callable[[], Iterable[Tuple[Sequence, float]]]) -> CallbackMetric:
+    """Register a scrape-time metric, replacing any earlier callback of that name"""
+    registry = get_registry()
+    registry.unregister(name)
+    return registry.register(CallbackMetric(name, help_text, kind, labelnames, fn))
+
+
+# Flask request metrics
+
+HTTP_REQUEST_SECONDS = histogram(
+    'http_request_duration_seconds', 'Time to build a response, by route template', ('method', 'route', 'status')
+)
+HTTP_RESPONSE_BYTES = histogram(
+    'http_response_size_bytes', 'Size of non-streamed response bodies', ('route',), METRICS_SIZE_BUCKETS
+)
+HTTP_IN_FLIGHT = gauge('http_requests_in_flight', 'Requests currently being handled')
+
+
+def instrument_app(app, exclude: Sequence[str] = ('/metrics',)):
+    """
+    Record latency, response size and concurrency for every Flask request
+    Latency is labelled by route template rather than URL, so user and item
+    IDs don't multiply series. Streamed responses are timed until their
+    first byte is ready.
+    """
+    from flask import g, request
+
+    excluded = set(exclude)
+
+    @app.before_request
+    def start_timer():
+        if request.path in excluded:
+            return
+        g.metrics_start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+
+    @app.after_request
+    def record_size(response):
+        if 'metrics_start' in g:
+            g.metrics_status = response.status_code
+            if not response.is_streamed and response.content_length is not None:
+                HTTP_RESPONSE_BYTES.labels(_route()).observe(response.content_length)
+        return response
+
+    @app.teardown_request
+    def record_latency(exc):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        HTTP_IN_FLIGHT.dec()
+        status = g.pop('metrics_status', 500)
+        HTTP_REQUEST_SECONDS.labels(request.method, _route(), status).observe(time.perf_counter() - start)
+
+
+def _route() -> str:
+    from flask import request
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+_process_start = time.time()
+callback('process_start_time_seconds', 'Start time of the process since the epoch', 'gauge', (),
+         lambda: [((), _process_start)])
@@ -0,0 +1,560 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import (
+    MIRROR_DIR, MIRROR_MAX_BYTES, MIRROR_IMAGE_SIZE, MIRROR_WORKERS, MIRROR_QUEUE_PER_WORKER, MIRROR_LEASE,
+    MAX_IMAGES_PER_PAGE
+)
+from http_session import HttpTransport, get_transport
+from media_item import MediaItem
+from photos_api import GooglePhotosAPI
+from state_store import get_state_store
+
+# Page tokens handed out for mirror-backed pages
+MIRROR_PAGE_PREFIX = 'mir:'
+
+CHUNK_SIZE = 64 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS albums (
+    user_id TEXT NOT NULL,
+    album_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    added_at REAL NOT NULL,
+    synced_at REAL,
+    PRIMARY KEY (user_id, album_id)
+);
+CREATE TABLE IF NOT EXISTS album_items (
+    user_id TEXT NOT NULL,
+    album_id TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (user_id, album_id, item_id)
+);
+CREATE INDEX IF NOT EXISTS album_items_position ON album_items (user_id, album_id, position);
+CREATE INDEX IF NOT EXISTS album_items_item ON album_items (user_id, item_id);
+CREATE TABLE IF NOT EXISTS items (
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    mime_type TEXT NOT NULL,
+    description TEXT NOT NULL,
+    creation_time TEXT NOT NULL,
+    digest TEXT,
+    PRIMARY KEY (user_id, id)
+);
+CREATE INDEX IF NOT EXISTS items_time ON items (user_id, creation_time DESC, id DESC);
+CREATE INDEX IF NOT EXISTS items_digest ON items (digest);
+CREATE TABLE IF NOT EXISTS objects (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    content_type TEXT NOT NULL,
+    last_access REAL NOT NULL
+);
+"""
+
+
+class MediaMirror:
+    """
+    Local copy of selected albums for offline playback
+    Image bytes live in a content-addressed store (objects/<sha256>), so a
+    photo that is in several albums or accounts is kept once. A SQLite
+    manifest maps accounts, albums and items to those objects. Syncs list
+    each album, keep only images, and download the ones not mirrored yet on
+    a thread pool; interrupted downloads resume from their .part file. Disk
+    use is bounded: objects of lower-priority albums are evicted least
+    recently shown first, and a sync stops downloading once nothing of lower
+    priority is left to evict.
+    """
+
+    def __init__(self, mirror_dir: str = MIRROR_DIR, max_bytes: int = MIRROR_MAX_BYTES,
+                 transport: Optional[HttpTransport] = None, image_size: Tuple[int, int] = MIRROR_IMAGE_SIZE,
+                 workers: int = MIRROR_WORKERS):
+        self.mirror_dir = Path(mirror_dir)
+        self.objects_dir = self.mirror_dir / 'objects'
+        self.partial_dir = self.mirror_dir / 'partial'
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.partial_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.transport = transport or get_transport()
+        self.image_size = image_size
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.mirror_dir / 'manifest.sqlite3'), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+            self._bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+            with self._conn:
+                # MIRROR_MAX_BYTES may have been lowered since the last run
+                self._make_room(0, None)
+
+    def _object_path(self, digest: str) -> Path:
+        return self.objects_dir / digest[:2] / digest
+
+    def _part_path(self, user_id: str, item_id: str) -> Path:
+        return self.partial_dir / f'{user_id}-{item_id}.part'
+
+    # Albums
+
+    def add_album(self, user_id: str, album_id: str, title: str = '', priority: int = 0):
+        """Mirror an album; higher-priority albums are kept when the disk budget runs out"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                '''INSERT INTO albums (user_id, album_id, title, priority, added_at) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(user_id, album_id) DO UPDATE SET title = excluded.title, priority = excluded.priority''',
+                (user_id, album_id, title, priority, time.time())
+            )
+
+    def remove_album(self, user_id: str, album_id: str) -> bool:
+        """Stop mirroring an album and delete objects nothing else refers to"""
+        with self._lock, self._conn:
+            removed = self._conn.execute(
+                'DELETE FROM albums WHERE user_id = ? AND album_id = ?', (user_id, album_id)
+            ).rowcount
+            self._conn.execute('DELETE FROM album_items WHERE user_id = ? AND album_id = ?', (user_id, album_id))
+            self._collect_garbage()
+        return bool(removed)
+
+    def remove_user(self, user_id: str):
+        """Forget everything mirrored for an account"""
+        with self._lock, self._conn:
+            for table in ('albums', 'album_items', 'items'):
+                self._conn.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+            self._collect_garbage()
+
+    def albums(self, user_id: str) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                '''SELECT a.album_id, a.title, a.priority, a.synced_at,
+                          COUNT(i.id) AS items, COUNT(i.digest) AS mirrored
+                   FROM albums a
+                   LEFT JOIN album_items ai ON ai.user_id = a.user_id AND ai.album_id = a.album_id
+                   LEFT JOIN items i ON i.user_id = ai.user_id AND i.id = ai.item_id
+                   WHERE a.user_id = ?
+                   GROUP BY a.album_id
+                   ORDER BY a.priority DESC, a.added_at''',
+                (user_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    # Sync
+
+    def sync(self, user_id: str, api_factory: Callable[[], Optional[GooglePhotosAPI]]) -> Dict:
+        """
+        Bring every mirrored album of an account up to date, highest priority first
+        Returns: counts of listed, downloaded, failed and no_space items
+        """
+        counts = {'listed': 0, 'downloaded': 0, 'failed': 0, 'no_space': 0}
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='mirror-download') as executor:
+            for album in self.albums(user_id):
+                album_counts = self.sync_album(user_id, album['album_id'], album['priority'], api_factory, executor)
+                for key, value in album_counts.items():
+                    counts[key] += value
+        self._clean_partials(user_id)
+        return counts
+
+    def sync_album(self, user_id: str, album_id: str, priority: int,
+                   api_factory: Callable[[], Optional[GooglePhotosAPI]], executor: ThreadPoolExecutor) -> Dict:
+        """
+        List an album and download the images not mirrored yet
+        Downloads start while later pages are still being listed, with a
+        bounded queue, so each baseUrl is used soon after it was handed out.
+        Items that left the album are dropped once a listing completes.
+        Returns: counts of listed, downloaded, failed and no_space items
+        """
+        counts = {'listed': 0, 'downloaded': 0, 'failed': 0, 'no_space': 0}
+        started = time.time()
+        pending = set()
+        full = False
+        position = 0
+        page_token = None
+
+        def settle(done):
+            nonlocal full
+            for future in done:
+                result = future.result()
+                counts[result] += 1
+                full = full or result == 'no_space'
+
+        while True:
+            api = api_factory()
+            if api is None:
+                print(f'Mirror sync for {user_id} stopped: no valid credentials')
+                break
+            result = api.get_album_media(album_id, page_token)
+            if not result:
+                print(f'Mirror sync for album {album_id} stopped: listing failed')
+                break
+
+            images = [
+                item for item in result.get('mediaItems', [])
+                if item.get('mimeType', '').startswith('image/') and 'baseUrl' in item
+            ]
+            missing = self._record_listing(user_id, album_id, images, position, started)
+            position += len(images)
+            counts['listed'] += len(images)
+
+            for item in images:
+                if item['id'] not in missing:
+                    continue
+                if full:
+                    counts['no_space'] += 1
+                    continue
+                while len(pending) >= self.workers * MIRROR_QUEUE_PER_WORKER:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    settle(done)
+                url = api.build_image_url(item['baseUrl'], *self.image_size)
+                pending.add(executor.submit(self._mirror_item, user_id, item['id'], url, priority))
+
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                with self._lock, self._conn:
+                    self._conn.execute(
+                        'DELETE FROM album_items WHERE user_id = ? AND album_id = ? AND seen_at < ?',
+                        (user_id, album_id, started)
+                    )
+                    self._conn.execute(
+                        'UPDATE albums SET synced_at = ? WHERE user_id = ? AND album_id = ?',
+                        (time.time(), user_id, album_id)
+                    )
+                    self._collect_garbage()
+                break
+
+        settle(wait(pending).done)
+        return counts
+
+    def _record_listing(self, user_id: str, album_id: str, media_items: List[Dict],
+                        position: int, seen_at: float) -> set:
+        """
+        Store one listed page of an album
+        Returns: IDs of the page's items that have no mirrored object yet
+        """
+        if not media_items:
+            return set()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                '''INSERT INTO items (user_id, id, filename, mime_type, description, creation_time)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(user_id, id) DO UPDATE SET
+                       filename = excluded.filename, description = excluded.description''',
+                [(
+                    user_id, item['id'], item.get('filename', ''), item.get('mimeType', ''),
+                    item.get('description', ''), item.get('mediaMetadata', {}).get('creationTime', '')
+                ) for item in media_items]
+            )
+            self._conn.executemany(
+                '''INSERT OR REPLACE INTO album_items (user_id, album_id, item_id, position, seen_at)
+                   VALUES (?, ?, ?, ?, ?)''',
+                [(user_id, album_id, item['id'], position + n, seen_at) for n, item in enumerate(media_items)]
+            )
+            ids = [item['id'] for item in media_items]
+            rows = self._conn.execute(
+                f'''SELECT id FROM items WHERE user_id = ? AND digest IS NULL
+                    AND id IN ({','.join('?' * len(ids))})''',
+                [user_id] + ids
+            ).fetchall()
+        return {row['id'] for row in rows}
+
+    def _mirror_item(self, user_id: str, item_id: str, url: str, priority: int) -> str:
+        """
+        Download one image into the store
+        Returns: 'downloaded', 'failed' or 'no_space'
+        """
+        part = self._part_path(user_id, item_id)
+        content_type = self._download(url, part)
+        if content_type is None:
+            return 'failed'
+
+        digest = hashlib.sha256()
+        with open(part, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        size = part.stat().st_size
+
+        with self._lock, self._conn:
+            stored = self._conn.execute('SELECT 1 FROM objects WHERE digest = ?', (digest,)).fetchone()
+            if stored:
+                part.unlink()
+            else:
+                if not self._make_room(size, priority):
+                    part.unlink()
+                    return 'no_space'
+                path = self._object_path(digest)
+                path.parent.mkdir(exist_ok=True)
+                os.replace(part, path)
+                self._conn.execute(
+                    'INSERT INTO objects (digest, size, content_type, last_access) VALUES (?, ?, ?, ?)',
+                    (digest, size, content_type, time.time())
+                )
+                self._bytes += size
+            self._conn.execute('UPDATE items SET digest = ? WHERE user_id = ? AND id = ?', (digest, user_id, item_id))
+        return 'downloaded'
+
+    def _download(self, url: str, part: Path, resume: bool = True) -> Optional[str]:
+        """
+        Download url into part, continuing a previous partial download with a Range request
+        Returns: the content type, or None if the download failed (the partial file is kept)
+        """
+        import requests
+        offset = part.stat().st_size if resume and part.exists() else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        try:
+            with self.transport.get(url, headers=headers, stream=True) as response:
+                content_type = response.headers.get('Content-Type', 'image/jpeg').split(';')[0]
+                if response.status_code == 416 and offset:
+                    # Nothing left to fetch only if the partial file is the whole image
+                    total = response.headers.get('Content-Range', '').rpartition('/')[2]
+                    if total.isdigit() and int(total) == offset:
+                        return content_type
+                    return self._download(url, part, resume=False)
+                if response.status_code not in (200, 206):
+                    print(f'Error mirroring image: {response.status_code}')
+                    return None
+                # A 200 means the server ignored the Range header and sent the whole image
+                with open(part, 'ab' if response.status_code == 206 else 'wb') as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+            return content_type
+        except (requests.RequestException, OSError) as e:
+            print(f'Error mirroring image: {e}')
+            return None
+
+    def _make_room(self, size: int, priority: Optional[int]) -> bool:
+        """
+        Evict objects until size more bytes fit in the budget
+        Only objects whose albums all have a lower priority are evicted,
+        least recently shown first; None allows evicting anything.
+        Caller holds the lock and commits.
+        Returns: whether there is room now
+        """
+        if self._bytes + size <= self.max_bytes:
+            return True
+        having = '' if priority is None else 'HAVING priority < ?'
+        rows = self._conn.execute(
+            f'''SELECT o.digest, o.size, COALESCE(MAX(a.priority), -1) AS priority FROM objects o
+                LEFT JOIN items i ON i.digest = o.digest
+                LEFT JOIN album_items ai ON ai.user_id = i.user_id AND ai.item_id = i.id
+                LEFT JOIN albums a ON a.user_id = ai.user_id AND a.album_id = ai.album_id
+                GROUP BY o.digest {having}
+                ORDER BY priority, o.last_access''',
+            () if priority is None else (priority,)
+        ).fetchall()
+        for row in rows:
+            if self._bytes + size <= self.max_bytes:
+                break
+            self._conn.execute('UPDATE items SET digest = NULL WHERE digest = ?', (row['digest'],))
+            self._delete_object(row['digest'], row['size'])
+        return self._bytes + size <= self.max_bytes
+
+    def _delete_object(self, digest: str, size: int):
+        self._conn.execute('DELETE FROM objects WHERE digest = ?', (digest,))
+        self._bytes -= size
+        try:
+            self._object_path(digest).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _collect_garbage(self):
+        """Drop items no mirrored album contains and objects no item refers to; caller holds the lock"""
+        self._conn.execute(
+            '''DELETE FROM items WHERE NOT EXISTS (
+                   SELECT 1 FROM album_items ai WHERE ai.user_id = items.user_id AND ai.item_id = items.id
+               )'''
+        )
+        rows = self._conn.execute(
+            '''SELECT digest, size FROM objects
+               WHERE NOT EXISTS (SELECT 1 FROM items WHERE items.digest = objects.digest)'''
+        ).fetchall()
+        for row in rows:
+            self._delete_object(row['digest'], row['size'])
+
+    def _clean_partials(self, user_id: str):
+        """Delete partial downloads of an account's items that are mirrored or no longer wanted"""
+        with self._lock:
+            pending = {
+                row['id'] for row in self._conn.execute(
+                    'SELECT id FROM items WHERE user_id = ? AND digest IS NULL', (user_id,)
+                )
+            }
+        prefix = f'{user_id}-'
+        for part in self.partial_dir.glob(f'{prefix}*.part'):
+            if part.stem[len(prefix):] not in pending:
+                part.unlink()
+
+    # Playback
+
+    def query_page(self, user_id: str, album_id: Optional[str] = None, media_type: str = 'image',
+                   start_date: Optional[str] = None, end_date: Optional[str] = None,
+                   page_token: Optional[str] = None, page_size: int = MAX_IMAGES_PER_PAGE) -> Dict:
+        """
+        Get one page of mirrored items
+        Album pages keep the album's order; otherwise items are newest first.
+        Only images are mirrored, so a video listing is empty.
+        Raises ValueError for a page token this listing never handed out.
+        Returns: dict with MediaItems under mediaItems and nextPageToken
+        """
+        if media_type == 'video':
+            return {'mediaItems': [], 'nextPageToken': None}
+
+        clauses = ['i.user_id = ?', 'i.digest IS NOT NULL']
+        params = [user_id]
+        if start_date and end_date:
+            clauses.append('i.creation_time >= ? AND i.creation_time <= ?')
+            params.extend([_day(start_date), _day(end_date) + 'T99'])
+        after = page_token[len(MIRROR_PAGE_PREFIX):] if page_token and page_token.startswith(MIRROR_PAGE_PREFIX) else None
+
+        if album_id:
+            query = '''SELECT i.id, i.filename, i.mime_type, i.description, i.creation_time, ai.position
+                       FROM album_items ai JOIN items i ON i.user_id = ai.user_id AND i.id = ai.item_id
+                       WHERE ai.album_id = ? AND {where} ORDER BY ai.position LIMIT ?'''
+            params.insert(0, album_id)
+            if after is not None:
+                if not after.isdigit():
+                    raise ValueError(f'Invalid mirror page token: {page_token}')
+                clauses.append('ai.position > ?')
+                params.append(int(after))
+        else:
+            query = '''SELECT i.id, i.filename, i.mime_type, i.description, i.creation_time
+                       FROM items i WHERE {where} ORDER BY i.creation_time DESC, i.id DESC LIMIT ?'''
+            if after is not None:
+                creation_time, separator, item_id = after.rpartition('|')
+                if not separator or not creation_time or not item_id:
+                    raise ValueError(f'Invalid mirror page token: {page_token}')
+                clauses.append('(i.creation_time, i.id) < (?, ?)')
+                params.extend([creation_time, item_id])
+
+        with self._lock:
+            rows = self._conn.execute(
+                query.format(where=' AND '.join(clauses)), params + [page_size + 1]
+            ).fetchall()
+
+        next_page_token = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            cursor = last['position'] if album_id else f"{last['creation_time']}|{last['id']}"
+            next_page_token = f'{MIRROR_PAGE_PREFIX}{cursor}'
+
+        return {
+            'mediaItems': [
+                MediaItem(row['id'], row['filename'], row['mime_type'], '', row['description'], row['creation_time'])
+                for row in rows
+            ],
+            'nextPageToken': next_page_token
+        }
+
+    def open_item(self, user_id: str, item_id: str) -> Optional[Tuple[Path, str, str]]:
+        """
+        Find a mirrored image, marking it as recently shown
+        Returns: (path, digest, content_type), or None if it isn't mirrored
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                '''SELECT o.digest, o.content_type FROM items i JOIN objects o ON o.digest = i.digest
+                   WHERE i.user_id = ? AND i.id = ?''',
+                (user_id, item_id)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE objects SET last_access = ? WHERE digest = ?', (time.time(), row['digest']))
+        return self._object_path(row['digest']), row['digest'], row['content_type']
+
+    def has_items(self, user_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                'SELECT 1 FROM items WHERE user_id = ? AND digest IS NOT NULL LIMIT 1', (user_id,)
+            ).fetchone() is not None
+
+    def status(self, user_id: str) -> Dict:
+        albums = self.albums(user_id)
+        with self._lock:
+            account_bytes = self._conn.execute(
+                '''SELECT COALESCE(SUM(size), 0) FROM objects
+                   WHERE digest IN (SELECT digest FROM items WHERE user_id = ?)''',
+                (user_id,)
+            ).fetchone()[0]
+            store_bytes = self._bytes
+        return {
+            'user_id': user_id,
+            'syncing': is_mirroring(user_id),
+            'albums': albums,
+            'items': sum(album['items'] for album in albums),
+            'mirrored': sum(album['mirrored'] for album in albums),
+            'bytes': account_bytes,
+            'store_bytes': store_bytes,
+            'max_bytes': self.max_bytes
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _day(date_str: str) -> str:
+    """Turn YYYY-M-D into zero-padded YYYY-MM-DD"""
+    year, month, day = (int(part) for part in date_str.split('-'))
+    return f'{year:04d}-{month:02d}-{day:02d}'
+
+
+_mirror = None
+_mirror_lock = threading.Lock()
+_running = set()
+_running_lock = threading.Lock()
+
+
+def get_mirror() -> MediaMirror:
+    """Get the shared MediaMirror"""
+    global _mirror
+    if _mirror is None:
+        with _mirror_lock:
+            if _mirror is None:
+                _mirror = MediaMirror()
+    return _mirror
+
+
+def start_background_mirror(user_id: str, api_factory: Callable[[], Optional[GooglePhotosAPI]]) -> bool:
+    """
+    Start syncing an account's mirrored albums in the background
+    Returns: False if a sync is already running in this or another worker process
+    """
+    with _running_lock:
+        if user_id in _running:
+            return False
+        store = get_state_store()
+        lease = f'mirror:{user_id}'
+        if not store.acquire_lease(lease, MIRROR_LEASE):
+            return False
+        _running.add(user_id)
+
+    def run():
+        try:
+            counts = get_mirror().sync(user_id, api_factory)
+            print(f'Mirror sync for {user_id}: {counts}')
+        except Exception as e:
+            print(f'Mirror sync for {user_id} failed: {e}')
+        finally:
+            with _running_lock:
+                _running.discard(user_id)
+            store.release_lease(lease)
+
+    thread = threading.Thread(target=run, name=f'mirror-{user_id}', daemon=True)
+    thread.start()
+    return True
+
+
+def is_mirroring(user_id: str) -> bool:
+    with _running_lock:
+        return user_id in _running
@@ -1,13 +1,106 @@
-import requests
 import json
+import time
 from typing import Dict, List, Optional, Tuple
-from config import GOOGLE_PHOTOS_API_BASE, MAX_IMAGES_PER_PAGE
+from config import (
+    GOOGLE_PHOTOS_API_BASE, MAX_IMAGES_PER_PAGE, DISPLAY_SIZE, THUMBNAIL_SIZE, HTTP_RETRIES, METRICS_SIZE_BUCKETS
+)
+from http_session import HttpTransport, get_transport
+from coalesce import SingleFlight, get_single_flight
+from rate_limiter import INTERACTIVE, RateLimiter, get_rate_limiter, parse_retry_after
+from media_item import MediaItem
+from metrics import counter, gauge, histogram
+
+API_CALL_SECONDS = histogram(
+    'photos_api_call_duration_seconds',
+    'Photos API call latency as seen by callers, including rate limiting, retries and coalescing',
+    ('endpoint',)
+)
+API_REQUEST_SECONDS = histogram(
+    'photos_api_request_duration_seconds', 'Photos API HTTP round trips', ('endpoint', 'status')
+)
+API_RESPONSE_BYTES = histogram(
+    'photos_api_response_size_bytes', 'Photos API response body sizes', ('endpoint',), METRICS_SIZE_BUCKETS
+)
+API_CALLS = counter('photos_api_calls_total', 'Photos API calls by whether they were sent or joined one in flight',
+                    ('endpoint', 'result'))
+API_IN_FLIGHT = gauge('photos_api_requests_in_flight', 'Photos API HTTP requests currently being sent')
+RATE_LIMIT_WAIT_SECONDS = histogram(
+    'photos_api_rate_limit_wait_seconds', 'Time Photos API requests queued in the rate limiter', ('priority',)
+)
 
 
 class GooglePhotosAPI:
-    def __init__(self, access_token: str):
+    def __init__(self, access_token: str, transport: Optional[HttpTransport] = None,
+                 api_base: str = GOOGLE_PHOTOS_API_BASE, single_flight: Optional[SingleFlight] = None,
+                 account: Optional[str] = None, priority: str = INTERACTIVE,
+                 rate_limiter: Optional[RateLimiter] = None):
         self.access_token = access_token
+        self.api_base = api_base
         self.headers = {'Authorization': f'Bearer {access_token}'}
+        self.transport = transport or get_transport()
+        self.single_flight = single_flight or get_single_flight()
+        self.account = account or 'default'
+        self.priority = priority
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+    
+    def _call(self, method: str, path: str, action: str, **kwargs) -> Dict:
+        """
+        Send a request to the Photos Library API
+        Identical calls already in flight (same token, endpoint and
+        parameters) are joined rather than sent again.
+        Returns: decoded JSON body, or {} on failure
+        """
+        key = (
+            self.access_token, method, f'{self.api_base}/{path}',
+            json.dumps(kwargs.get('params'), sort_keys=True),
+            json.dumps(kwargs.get('json'), sort_keys=True)
+        )
+        endpoint = _endpoint(path)
+        start = time.perf_counter()
+        result, shared = self.single_flight.do(key, lambda: self._send(method, path, action, endpoint, **kwargs))
+        API_CALL_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+        API_CALLS.labels(endpoint, 'coalesced' if shared else 'sent').inc()
+        return result
+    
+    def _send(self, method: str, path: str, action: str, endpoint: str, **kwargs) -> Dict:
+        """Send one call through the rate limiter, backing off and retrying on 429"""
+        import requests
+        for attempt in range(HTTP_RETRIES + 1):
+            start = time.perf_counter()
+            acquired = self.rate_limiter.acquire(self.account, self.priority)
+            RATE_LIMIT_WAIT_SECONDS.labels(self.priority).observe(time.perf_counter() - start)
+            if not acquired:
+                print(f'Error {action}: rate limited ({self.priority} request for {self.account})')
+                return {}
+            
+            start = time.perf_counter()
+            try:
+                with API_IN_FLIGHT.track():
+                    response = self.transport.request(
+                        method,
+                        f'{self.api_base}/{path}',
+                        headers=self.headers,
+                        **kwargs
+                    )
+            except requests.RequestException as e:
+                API_REQUEST_SECONDS.labels(endpoint, 'error').observe(time.perf_counter() - start)
+                print(f'Error {action}: {e}')
+                return {}
+            API_REQUEST_SECONDS.labels(endpoint, response.status_code).observe(time.perf_counter() - start)
+            API_RESPONSE_BYTES.labels(endpoint).observe(len(response.content))
+            
+            if response.status_code == 429:
+                self.rate_limiter.record_throttle(self.account, parse_retry_after(response.headers.get('Retry-After')))
+                if attempt < HTTP_RETRIES:
+                    continue
+            
+            if response.status_code != 200:
+                print(f'Error {action}: {response.status_code} - {response.text}')
+                return {}
+            
+            self.rate_limiter.record_success(self.account)
+            return response.json()
+        return {}
     
     def get_media_items(self, page_token: Optional[str] = None, page_size: int = MAX_IMAGES_PER_PAGE) -> Dict:
         """
@@ -18,23 +111,7 @@ class GooglePhotosAPI:
         if page_token:
             params['pageToken'] = page_token
         
-        try:
-            response = requests.get(
-                f'{GOOGLE_PHOTOS_API_BASE}/mediaItems',
-                headers=self.headers,
-                params=params,
-                timeout=30
-            )
-            
-            if response.status_code != 200:
-                print(f'Error fetching media items: {response.status_code} - {response.text}')
-                return {}
-            
-            return response.json()
-            
-        except requests.RequestException as e:
-            print(f'Error fetching media items: {e}')
-            return {}
+        return self._call('GET', 'mediaItems', 'fetching media items', params=params)
     
     def search_media_items(self, filters: Dict, page_token: Optional[str] = None, page_size: int = MAX_IMAGES_PER_PAGE) -> Dict:
         """
@@ -49,23 +126,7 @@ class GooglePhotosAPI:
         if page_token:
             params['pageToken'] = page_token
         
-        try:
-            response = requests.post(
-                f'{GOOGLE_PHOTOS_API_BASE}/mediaItems:search',
-                headers=self.headers,
-                json=params,
-                timeout=30
-            )
-            
-            if response.status_code != 200:
-                print(f'Error searching media items: {response.status_code} - {response.text}')
-                return {}
-            
-            return response.json()
-            
-        except requests.RequestException as e:
-            print(f'Error searching media items: {e}')
-            return {}
+        return self._call('POST', 'mediaItems:search', 'searching media items', json=params)
     
     def get_album_media(self, album_id: str, page_token: Optional[str] = None, page_size: int = MAX_IMAGES_PER_PAGE) -> Dict:
         """
@@ -80,23 +141,7 @@ class GooglePhotosAPI:
         if page_token:
             params['pageToken'] = page_token
         
-        try:
-            response = requests.post(
-                f'{GOOGLE_PHOTOS_API_BASE}/mediaItems:search',
-                headers=self.headers,
-                data=params,
-                timeout=30
-            )
-            
-            if response.status_code != 200:
-                print(f'Error fetching album media: {response.status_code} - {response.text}')
-                return {}
-            
-            return response.json()
-            
-        except requests.RequestException as e:
-            print(f'Error fetching album media: {e}')
-            return {}
+        return self._call('POST', 'mediaItems:search', 'fetching album media', json=params)
     
     def get_albums(self, page_token: Optional[str] = None) -> Dict:
         """
@@ -107,23 +152,7 @@ class GooglePhotosAPI:
         if page_token:
             params['pageToken'] = page_token
         
-        try:
-            response = requests.get(
-                f'{GOOGLE_PHOTOS_API_BASE}/albums',
-                headers=self.headers,
-                params=params,
-                timeout=30
-            )
-            
-            if response.status_code != 200:
-                print(f'Error fetching albums: {response.status_code} - {response.text}')
-                return {}
-            
-            return response.json()
-            
-        except requests.RequestException as e:
-            print(f'Error fetching albums: {e}')
-            return {}
+        return self._call('GET', 'albums', 'fetching albums', params=params)
     
     def get_shared_albums(self, page_token: Optional[str] = None) -> Dict:
         """
@@ -134,31 +163,31 @@ class GooglePhotosAPI:
         if page_token:
             params['pageToken'] = page_token
         
-        try:
-            response = requests.get(
-                f'{GOOGLE_PHOTOS_API_BASE}/sharedAlbums',
-                headers=self.headers,
-                params=params,
-                timeout=30
-            )
-            
-            if response.status_code != 200:
-                print(f'Error fetching shared albums: {response.status_code} - {response.text}')
-                return {}
-            
-            return response.json()
-            
-        except requests.RequestException as e:
-            print(f'Error fetching shared albums: {e}')
-            return {}
+        return self._call('GET', 'sharedAlbums', 'fetching shared albums', params=params)
+    
+    def get_media_item(self, media_item_id: str) -> Dict:
+        """
+        Get a single media item by ID
+        Returns: media item dict
+        """
+        return self._call('GET', f'mediaItems/{media_item_id}', 'fetching media item')
     
-    def build_image_url(self, base_url: str, width: int = 1920, height: int = 1080) -> str:
+    def batch_get_media_items(self, media_item_ids: List[str]) -> Dict:
+        """
+        Get up to 50 media items by ID in a single call
+        Returns: dict with mediaItemResults
+        """
+        params = [('mediaItemIds', media_item_id) for media_item_id in media_item_ids]
+        
+        return self._call('GET', 'mediaItems:batchGet', 'batch fetching media items', params=params)
+    
+    def build_image_url(self, base_url: str, width: int = DISPLAY_SIZE[0], height: int = DISPLAY_SIZE[1]) -> str:
         """
         Build optimized image URL for display
         """
         return f"{base_url}=w{width}-h{height}"
     
-    def build_thumbnail_url(self, base_url: str, width: int = 300, height: int = 200) -> str:
+    def build_thumbnail_url(self, base_url: str, width: int = THUMBNAIL_SIZE[0], height: int = THUMBNAIL_SIZE[1]) -> str:
         """
         Build thumbnail URL
         """
@@ -170,6 +199,12 @@ class GooglePhotosAPI:
         """
         return f"{base_url}=dv"
     
+    def process_media_item(self, item: Dict) -> Dict:
+        """
+        Convert a raw API media item into the shape served to the frontend
+        """
+        return MediaItem.from_api(item).to_dict()
+    
     def filter_media_by_type(self, media_items: List[Dict], media_type: str = 'image') -> List[Dict]:
         """
         Filter media items by type (image, video, etc.)
@@ -177,15 +212,8 @@ class GooglePhotosAPI:
         if media_type == 'all':
             return media_items
         
-        filtered = []
-        for item in media_items:
-            mime_type = item.get('mimeType', '')
-            if media_type == 'image' and mime_type.startswith('image/'):
-                filtered.append(item)
-            elif media_type == 'video' and mime_type.startswith('video/'):
-                filtered.append(item)
-        
-        return filtered
+        prefix = f'{media_type}/'
+        return [item for item in media_items if item.get('mimeType', '').startswith(prefix)]
     
     def create_date_filter(self, start_date: str, end_date: str) -> Dict:
         """
@@ -234,3 +262,9 @@ class GooglePhotosAPI:
                 'includedFeatures': ['FAVOURITES']
             }
         }
+
+
+def _endpoint(path: str) -> str:
+    """Metrics label for an API path, with item and album IDs replaced by a placeholder"""
+    collection, _, resource = path.partition('/')
+    return f'{collection}/{{id}}' if resource else collection
@@ -0,0 +1,242 @@
+import base64
+import datetime
+import hashlib
+import json
+import random
+from typing import Dict, List, Optional, Sequence
+
+from config import (
+    PLAYLIST_BATCH_SIZE, PLAYLIST_MAX_SCAN, PLAYLIST_NO_REPEAT_WINDOW, PLAYLIST_FAVORITE_WEIGHT,
+    PLAYLIST_RECENCY_HALF_LIFE, PLAYLIST_MIN_RECENCY_WEIGHT
+)
+from media_index import MediaIndex
+from media_item import MediaItem
+
+WEIGHTS = ('favorites', 'recency')
+
+
+class FeistelPermutation:
+    """
+    Keyed pseudorandom permutation of range(size)
+    A balanced Feistel network permutes the next even power of two; values
+    that land outside range(size) are re-encrypted until they fall inside
+    (cycle walking). Any position, and the inverse of any value, is computed
+    in O(1) memory without materializing the order.
+    """
+
+    def __init__(self, size: int, key: bytes, rounds: int = 4):
+        self.size = size
+        self.key = key
+        self.rounds = rounds
+        bits = max(2, (size - 1).bit_length())
+        self.half_bits = (bits + 1) // 2
+        self.mask = (1 << self.half_bits) - 1
+        # Keyed hash state per round, copied for each call rather than re-keyed
+        self._round_hashes = [
+            hashlib.blake2b(digest_size=8, key=key, salt=round_.to_bytes(16, 'little'))
+            for round_ in range(rounds)
+        ]
+
+    def _f(self, round_: int, value: int) -> int:
+        h = self._round_hashes[round_].copy()
+        h.update(value.to_bytes(8, 'little'))
+        return int.from_bytes(h.digest(), 'little') & self.mask
+
+    def _encrypt(self, value: int) -> int:
+        left, right = value >> self.half_bits, value & self.mask
+        for round_ in range(self.rounds):
+            left, right = right, left ^ self._f(round_, right)
+        return (left << self.half_bits) | right
+
+    def _decrypt(self, value: int) -> int:
+        left, right = value >> self.half_bits, value & self.mask
+        for round_ in reversed(range(self.rounds)):
+            left, right = right ^ self._f(round_, left), left
+        return (left << self.half_bits) | right
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, position: int) -> int:
+        value = self._encrypt(position)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+    def index(self, value: int) -> int:
+        """Position at which value appears"""
+        position = self._decrypt(value)
+        while position >= self.size:
+            position = self._decrypt(position)
+        return position
+
+
+class PlaylistCursor:
+    """
+    Resumable playlist position, serialized into an opaque token
+    A pass (epoch) walks one permutation of the catalog as it was when the
+    pass started; items added later join the next pass.
+    """
+
+    __slots__ = ('seed', 'epoch', 'position', 'size', 'previous_size', 'deferred')
+
+    def __init__(self, seed: int, epoch: int = 0, position: int = 0, size: int = 0,
+                 previous_size: int = 0, deferred: Optional[List[int]] = None):
+        self.seed = seed
+        self.epoch = epoch
+        self.position = position
+        self.size = size
+        self.previous_size = previous_size
+        self.deferred = deferred or []
+
+    def encode(self) -> str:
+        state = [self.seed, self.epoch, self.position, self.size, self.previous_size, self.deferred]
+        return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode().rstrip('=')
+
+    @classmethod
+    def decode(cls, token: str, max_size: Optional[int] = None) -> Optional['PlaylistCursor']:
+        """
+        max_size is the index's max_seq(); a cursor can't cover more items than
+        the index has ever held, since seqs are never reused.
+        Returns: the cursor, or None if the token is malformed or out of range
+        """
+        try:
+            state = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            seed, epoch, position, size, previous_size, deferred = state
+            cursor = cls(int(seed), int(epoch), int(position), int(size), int(previous_size),
+                         [int(seq) for seq in deferred])
+        except (ValueError, TypeError):
+            return None
+        if min(cursor.epoch, cursor.position, cursor.size, cursor.previous_size) < 0:
+            return None
+        if max_size is not None:
+            if max(cursor.size, cursor.previous_size) > max_size:
+                return None
+            if not all(0 < seq <= max_size for seq in cursor.deferred):
+                return None
+        return cursor
+
+    def next_epoch(self, size: int):
+        self.epoch += 1
+        self.previous_size = self.size
+        self.size = size
+        self.position = 0
+
+    def permutation(self, epoch: Optional[int] = None, size: Optional[int] = None) -> FeistelPermutation:
+        epoch = self.epoch if epoch is None else epoch
+        key = hashlib.blake2b(f'{self.seed}:{epoch}'.encode(), digest_size=16).digest()
+        return FeistelPermutation(self.size if size is None else size, key)
+
+
+class Playlist:
+    """
+    Endless shuffled playlist over an account's full media index
+    Items are addressed by their dense index seq, so each batch only looks
+    up the rows it returns. Optional weighting thins out items by a
+    deterministic per-pass coin flip, so favorites or recent photos come up
+    more often while the order stays reproducible from the cursor.
+    """
+
+    def __init__(self, index: MediaIndex, no_repeat_window: int = PLAYLIST_NO_REPEAT_WINDOW,
+                 max_scan: int = PLAYLIST_MAX_SCAN):
+        self.index = index
+        self.no_repeat_window = no_repeat_window
+        self.max_scan = max_scan
+
+    def start(self, seed: Optional[int] = None) -> PlaylistCursor:
+        """Cursor at the beginning of a new playlist"""
+        seed = random.getrandbits(48) if seed is None else seed
+        return PlaylistCursor(seed, size=self.index.max_seq())
+
+    def next_batch(self, cursor: PlaylistCursor, count: int = PLAYLIST_BATCH_SIZE,
+                   media_type: str = 'all', start_date: Optional[str] = None,
+                   end_date: Optional[str] = None, weights: Sequence[str] = (),
+                   exclude_duplicates: bool = False) -> Dict:
+        """
+        Get the next items of the playlist, advancing cursor in place
+        exclude_duplicates skips items marked as near-duplicates of another photo.
+        Returns: dict with MediaItems under mediaItems, their fetchedAt times and the next cursor
+        """
+        rows = []
+        scanned = 0
+        newest = self._newest_timestamp() if 'recency' in weights else None
+        while len(rows) < count and scanned < self.max_scan:
+            if cursor.position >= cursor.size:
+                if cursor.deferred:
+                    # Items held back by the no-repeat window close out the pass
+                    take, cursor.deferred = cursor.deferred[:count - len(rows)], cursor.deferred[count - len(rows):]
+                    found = self.index.items_by_seq(take, media_type, start_date, end_date, exclude_duplicates)
+                    rows.extend(found[seq] for seq in take if seq in found)
+                    continue
+                size = self.index.max_seq()
+                if size == 0:
+                    break
+                cursor.next_epoch(size)
+
+            permutation = cursor.permutation()
+            end = min(cursor.size, cursor.position + max(count - len(rows), 16) * 2)
+            positions = range(cursor.position, end)
+            seqs = [permutation[position] + 1 for position in positions]
+            found = self.index.items_by_seq(seqs, media_type, start_date, end_date, exclude_duplicates)
+
+            for position, seq in zip(positions, seqs):
+                cursor.position = position + 1
+                scanned += 1
+                row = found.get(seq)
+                if row is None:
+                    continue
+                if weights and not self._accepted(cursor, row, weights, newest):
+                    continue
+                if self._recently_played(cursor, position, seq - 1):
+                    cursor.deferred.append(seq)
+                    continue
+                rows.append(row)
+                if len(rows) == count:
+                    break
+
+        return {
+            'mediaItems': [MediaItem(row[1], row[2], row[3], row[4], row[5], row[6]) for row in rows],
+            'fetchedAt': [row[7] for row in rows],
+            'cursor': cursor.encode(),
+            'epoch': cursor.epoch,
+            'position': cursor.position,
+            'size': cursor.size
+        }
+
+    def _recently_played(self, cursor: PlaylistCursor, position: int, ordinal: int) -> bool:
+        """Whether an item near the start of this pass was near the end of the last one"""
+        if cursor.epoch == 0 or position >= self.no_repeat_window or ordinal >= cursor.previous_size:
+            return False
+        previous = cursor.permutation(cursor.epoch - 1, cursor.previous_size)
+        return previous.index(ordinal) >= cursor.previous_size - self.no_repeat_window
+
+    def _newest_timestamp(self) -> Optional[float]:
+        """Creation time of the newest indexed item, which recency weights are relative to"""
+        page = self.index.query_page('all', page_size=1)
+        if not page['mediaItems']:
+            return None
+        return _timestamp(page['mediaItems'][0].creation_time)
+
+    @staticmethod
+    def _accepted(cursor: PlaylistCursor, row, weights: Sequence[str], newest: Optional[float]) -> bool:
+        """Deterministic weighted coin flip for an item in this pass"""
+        weight = 1.0
+        if 'favorites' in weights:
+            weight = 1.0 if row['favorite'] else 1.0 / PLAYLIST_FAVORITE_WEIGHT
+        if 'recency' in weights and newest is not None:
+            created = _timestamp(row['creation_time'])
+            if created is not None:
+                age_days = max(0.0, (newest - created) / 86400)
+                weight *= max(PLAYLIST_MIN_RECENCY_WEIGHT, 0.5 ** (age_days / PLAYLIST_RECENCY_HALF_LIFE))
+        if weight >= 1.0:
+            return True
+        digest = hashlib.blake2b(f'{cursor.seed}:{cursor.epoch}:{row[0]}'.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') / 2 ** 64 < weight
+
+
+def _timestamp(creation_time: str) -> Optional[float]:
+    """Parse an RFC 3339 creationTime into a POSIX timestamp"""
+    try:
+        return datetime.datetime.fromisoformat(creation_time.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
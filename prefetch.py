@@ -0,0 +1,290 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import (
+    PREFETCH_WORKERS, PREFETCH_LOOKAHEAD, PREFETCH_MAX_LOOKAHEAD,
+    PREFETCH_PAGE_TTL, PREFETCH_MAX_PAGES, PREFETCH_SESSION_IDLE, BASE_URL_MAX_AGE, SERVER_PROCESSES
+)
+from image_cache import ImageCache
+from state_store import get_state_store
+from video_proxy import VideoProxy
+
+# How many warmed image keys to remember for attributing display hits to prefetch
+MAX_TRACKED_KEYS = 10000
+
+# State store namespace of prefetched API pages, for displays whose next request reaches another worker
+PAGES_NAMESPACE = 'prefetched_pages'
+
+
+class PrefetchSession:
+    """Prefetch state for one slideshow display"""
+
+    def __init__(self, session_id: str, source: Tuple):
+        self.session_id = session_id
+        self.source = source
+        self.generation = 0
+        self.position = 0
+        self.lookahead = PREFETCH_LOOKAHEAD
+        self.speed = None
+        self.futures = []
+        self.last_seen = time.time()
+
+
+class PrefetchScheduler:
+    """
+    Warms the image cache for the slides each display is about to show
+    Displays report their position; the next N images (and the next API
+    page) are fetched by a bounded worker pool, along with the start of
+    each upcoming video. Switching album or account cancels whatever is
+    still queued for that display. With several server workers (shared=True)
+    prefetched pages are also put in the state store, since the display's
+    next request may be served by a different worker.
+    """
+
+    def __init__(self, image_cache: ImageCache, video_proxy: Optional[VideoProxy] = None,
+                 max_workers: int = PREFETCH_WORKERS, shared: bool = SERVER_PROCESSES > 1):
+        self.image_cache = image_cache
+        self.video_proxy = video_proxy
+        self.shared = shared
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._pages = OrderedDict()  # (source, page_token) -> (fetched_at, result)
+        self._prefetched = OrderedDict()  # image cache keys warmed by prefetch
+        self._stats = {
+            'scheduled': 0,
+            'completed': 0,
+            'failed': 0,
+            'cancelled': 0,
+            'already_cached': 0,
+            'hits': 0,
+            'misses': 0,
+            'prefetch_hits': 0,
+            'pages_prefetched': 0,
+            'page_hits': 0,
+            'video_heads': 0,
+            'fetch_seconds': 0.0
+        }
+
+    def _count(self, stat: str, amount=1):
+        with self._lock:
+            self._stats[stat] += amount
+
+    def report_position(self, session_id: str, source: Tuple, position: int, upcoming: List[str],
+                        base_url_provider: Callable[[str], Callable[[], Optional[str]]],
+                        width: int, height: int,
+                        next_page_token: Optional[str] = None,
+                        page_fetcher: Optional[Callable[[str], Dict]] = None,
+                        lookahead: Optional[int] = None, speed: Optional[float] = None,
+                        image_format: str = 'jpeg', videos: Optional[List[str]] = None) -> Dict:
+        """
+        Schedule prefetch work for a display's upcoming slides
+        source identifies what the display is playing, e.g. (user_id, album_id, type);
+        a change of source cancels queued work from the previous one. width, height
+        and image_format should match the variant the display will request; for
+        videos in upcoming that is the poster frame. videos lists the upcoming
+        clips whose first seconds should be cached too.
+        """
+        self.expire_sessions()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = PrefetchSession(session_id, source)
+            elif session.source != source:
+                self._cancel(session)
+                session.source = source
+
+            session.position = position
+            session.last_seen = time.time()
+            session.speed = speed
+            if lookahead:
+                session.lookahead = max(1, min(lookahead, PREFETCH_MAX_LOOKAHEAD))
+            session.futures = [(future, key) for future, key in session.futures if not future.done()]
+            generation = session.generation
+            count = session.lookahead
+
+        scheduled = 0
+        for item_id in upcoming[:count]:
+            if self.image_cache.is_cached(item_id, width, height, image_format):
+                self._count('already_cached')
+                continue
+            key = self.image_cache.cache_key(item_id, width, height, image_format)
+            with self._lock:
+                if key in self._prefetched:
+                    continue
+                self._prefetched[key] = False
+                while len(self._prefetched) > MAX_TRACKED_KEYS:
+                    self._prefetched.popitem(last=False)
+            future = self._executor.submit(
+                self._prefetch_image, session, generation, item_id, key,
+                base_url_provider(item_id), width, height, image_format
+            )
+            scheduled += 1
+            with self._lock:
+                session.futures.append((future, key))
+
+        if self.video_proxy is not None:
+            upcoming_slides = set(upcoming[:count])
+            for item_id in videos or []:
+                if item_id not in upcoming_slides or self.video_proxy.is_cached(item_id):
+                    continue
+                future = self._executor.submit(
+                    self._prefetch_video, session, generation, item_id, base_url_provider(item_id)
+                )
+                scheduled += 1
+                with self._lock:
+                    session.futures.append((future, f'video:{item_id}'))
+
+        if next_page_token and page_fetcher and len(upcoming) < count * 2:
+            page_key = (source, next_page_token)
+            with self._lock:
+                pending = page_key in self._pages
+                if not pending:
+                    self._pages[page_key] = None
+            if not pending:
+                future = self._executor.submit(self._prefetch_page, session, generation, page_key, page_fetcher)
+                with self._lock:
+                    session.futures.append((future, page_key))
+
+        self._count('scheduled', scheduled)
+        return {'scheduled': scheduled, 'lookahead': count}
+
+    def _prefetch_image(self, session: PrefetchSession, generation: int, item_id: str, key: str,
+                        base_url_provider: Callable[[], Optional[str]], width: int, height: int,
+                        image_format: str):
+        if session.generation != generation:
+            with self._lock:
+                self._stats['cancelled'] += 1
+                self._prefetched.pop(key, None)
+            return
+
+        start = time.perf_counter()
+        result = self.image_cache.get_image(item_id, base_url_provider, width, height, image_format)
+        self._count('fetch_seconds', time.perf_counter() - start)
+        if result is None:
+            self._count('failed')
+            with self._lock:
+                self._prefetched.pop(key, None)
+            return
+        self._count('completed')
+
+    def _prefetch_video(self, session: PrefetchSession, generation: int, item_id: str,
+                        base_url_provider: Callable[[], Optional[str]]):
+        if session.generation != generation:
+            self._count('cancelled')
+            return
+
+        start = time.perf_counter()
+        cached = self.video_proxy.fetch_head(item_id, base_url_provider)
+        self._count('fetch_seconds', time.perf_counter() - start)
+        if not cached:
+            self._count('failed')
+            return
+        self._count('completed')
+        self._count('video_heads')
+
+    def _prefetch_page(self, session: PrefetchSession, generation: int, page_key: Tuple,
+                       page_fetcher: Callable[[str], Dict]):
+        if session.generation != generation:
+            with self._lock:
+                self._pages.pop(page_key, None)
+            return
+
+        result = page_fetcher(page_key[1])
+        with self._lock:
+            if not result:
+                self._pages.pop(page_key, None)
+                return
+            self._pages[page_key] = (time.time(), result)
+            while len(self._pages) > PREFETCH_MAX_PAGES:
+                self._pages.popitem(last=False)
+            self._stats['pages_prefetched'] += 1
+        if self.shared:
+            get_state_store().set(PAGES_NAMESPACE, _page_store_key(page_key), result,
+                                  min(PREFETCH_PAGE_TTL, BASE_URL_MAX_AGE))
+
+    def take_page(self, source: Tuple, page_token: str) -> Optional[Dict]:
+        """Get (and forget) a prefetched API page if one is ready and still fresh"""
+        if self.shared:
+            # Whichever worker takes the page first gets it; the others forget their copy
+            key = _page_store_key((source, page_token))
+            store = get_state_store()
+            result = store.get(PAGES_NAMESPACE, key)
+            with self._lock:
+                self._pages.pop((source, page_token), None)
+            if result is None or not store.delete(PAGES_NAMESPACE, key):
+                return None
+            self._count('page_hits')
+            return result
+        with self._lock:
+            entry = self._pages.get((source, page_token))
+            if not entry:
+                return None
+            del self._pages[(source, page_token)]
+            fetched_at, result = entry
+            ttl = min(PREFETCH_PAGE_TTL, BASE_URL_MAX_AGE)
+            if time.time() - fetched_at > ttl:
+                return None
+            self._stats['page_hits'] += 1
+            return result
+
+    def record_access(self, item_id: str, width: int, height: int, image_format: str = 'jpeg'):
+        """Record whether a display request found its image already cached"""
+        key = self.image_cache.cache_key(item_id, width, height, image_format)
+        cached = self.image_cache.is_cached(item_id, width, height, image_format)
+        with self._lock:
+            self._stats['hits' if cached else 'misses'] += 1
+            if cached and self._prefetched.get(key) is False:
+                self._prefetched[key] = True
+                self._stats['prefetch_hits'] += 1
+
+    def cancel(self, session_id: str):
+        """Cancel queued work for a display and forget it"""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._cancel(session)
+
+    def _cancel(self, session: PrefetchSession):
+        session.generation += 1
+        for future, key in session.futures:
+            if future.cancel():
+                self._stats['cancelled'] += 1
+                if isinstance(key, tuple):
+                    self._pages.pop(key, None)
+                else:
+                    self._prefetched.pop(key, None)
+        session.futures = []
+
+    def expire_sessions(self, max_idle: float = PREFETCH_SESSION_IDLE):
+        """Drop displays that have not reported a position recently"""
+        cutoff = time.time() - max_idle
+        with self._lock:
+            for session_id in [sid for sid, s in self._sessions.items() if s.last_seen < cutoff]:
+                self._cancel(self._sessions.pop(session_id))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            sessions = [{
+                'session_id': session.session_id,
+                'position': session.position,
+                'lookahead': session.lookahead,
+                'speed': session.speed,
+                'pending': sum(1 for future, _ in session.futures if not future.done())
+            } for session in self._sessions.values()]
+
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else None
+        stats['avg_fetch_seconds'] = stats['fetch_seconds'] / stats['completed'] if stats['completed'] else None
+        stats['sessions'] = sessions
+        return stats
+
+
+def _page_store_key(page_key: Tuple) -> str:
+    source, page_token = page_key
+    return json.dumps([list(source), page_token], default=str)
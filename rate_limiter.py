@@ -0,0 +1,268 @@
+import datetime
+import email.utils
+import threading
+import time
+from typing import Dict, Optional
+
+from state_store import StateStore, get_state_store
+from config import (
+    RATE_LIMIT_GLOBAL_RATE, RATE_LIMIT_GLOBAL_BURST, RATE_LIMIT_ACCOUNT_RATE, RATE_LIMIT_ACCOUNT_BURST,
+    RATE_LIMIT_MIN_RATE, RATE_LIMIT_DECREASE, RATE_LIMIT_INCREASE, RATE_LIMIT_THROTTLE_BACKOFF,
+    RATE_LIMIT_DAILY_QUOTA, RATE_LIMIT_INTERACTIVE_RESERVE, RATE_LIMIT_MAX_WAIT, SERVER_PROCESSES
+)
+
+# State store namespace of the daily request counts, keyed by UTC date
+QUOTA_NAMESPACE = 'photos_api_quota'
+
+# Request priorities: slides a display is waiting on vs index sync and prefetch
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header given either in seconds or as an HTTP date
+    Returns: seconds to wait, or None if the header is missing or invalid
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class TokenBucket:
+    """Token bucket whose refill rate adapts to throttling (AIMD)"""
+
+    __slots__ = ('rate', 'max_rate', 'burst', 'tokens', 'updated', 'blocked_until',
+                 'requests', 'throttled')
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.max_rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+
+    def wait_time(self, now: float, needed: float) -> float:
+        """Seconds until needed tokens are available (0 if they are now)"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def needed(self, reserve: float) -> float:
+        """Tokens that must be available to take one while leaving reserve (a share of burst) untouched"""
+        # Never more than a full bucket, or a small per-worker burst could never be met
+        return min(1 + self.burst * reserve, self.burst)
+
+    def take(self):
+        self.tokens -= 1
+        self.requests += 1
+
+    def give_back(self):
+        """Undo take() for a request that was not sent"""
+        self.tokens = min(self.burst, self.tokens + 1)
+        self.requests -= 1
+
+    def slow_down(self, now: float, pause: float):
+        """Multiplicative decrease after a 429, pausing for pause seconds"""
+        self.throttled += 1
+        # Requests already in flight when the first 429 arrived are answered
+        # 429 too; only decrease once per pause
+        if now >= self.blocked_until:
+            self.rate = max(RATE_LIMIT_MIN_RATE, self.rate * RATE_LIMIT_DECREASE)
+        self.tokens = min(self.tokens, 0.0)
+        self.blocked_until = max(self.blocked_until, now + pause)
+
+    def speed_up(self):
+        """Additive increase after a successful request"""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + RATE_LIMIT_INCREASE)
+
+    def stats(self, now: float) -> Dict:
+        return {
+            'rate': round(self.rate, 3),
+            'max_rate': self.max_rate,
+            'tokens': round(min(self.burst, self.tokens + (now - self.updated) * self.rate), 3),
+            'burst': self.burst,
+            'blocked_for': round(max(0.0, self.blocked_until - now), 3),
+            'requests': self.requests,
+            'throttled': self.throttled
+        }
+
+
+class RateLimiter:
+    """
+    Client-side limits for Photos Library API calls
+    Every request needs a token from both the global bucket and its
+    account's bucket. A 429 halves the rates and pauses for Retry-After;
+    successes win the rate back gradually. Background requests leave a
+    reserve of burst tokens and of the daily quota to interactive ones.
+    The day's request count is kept in the state store, so it survives
+    restarts and is shared by every server worker. Rates are per process;
+    get_rate_limiter() gives each worker its share of them.
+    """
+
+    def __init__(self, global_rate: float = RATE_LIMIT_GLOBAL_RATE, global_burst: int = RATE_LIMIT_GLOBAL_BURST,
+                 account_rate: float = RATE_LIMIT_ACCOUNT_RATE, account_burst: int = RATE_LIMIT_ACCOUNT_BURST,
+                 daily_quota: int = RATE_LIMIT_DAILY_QUOTA,
+                 interactive_reserve: float = RATE_LIMIT_INTERACTIVE_RESERVE,
+                 store: Optional[StateStore] = None):
+        self.account_rate = account_rate
+        self.account_burst = account_burst
+        self.daily_quota = daily_quota
+        self.interactive_reserve = interactive_reserve
+        self._lock = threading.Lock()
+        self._global = TokenBucket(global_rate, global_burst)
+        self._accounts = {}
+        self._store = store or get_state_store()
+        self._stats = {priority: {
+            'granted': 0,
+            'waited': 0,
+            'wait_seconds': 0.0,
+            'timed_out': 0,
+            'over_quota': 0
+        } for priority in PRIORITIES}
+
+    @staticmethod
+    def _today() -> datetime.date:
+        return datetime.datetime.now(datetime.timezone.utc).date()
+
+    def _bucket(self, account: str) -> TokenBucket:
+        bucket = self._accounts.get(account)
+        if bucket is None:
+            bucket = self._accounts[account] = TokenBucket(self.account_rate, self.account_burst)
+        return bucket
+
+    def _quota_limit(self, priority: str) -> int:
+        if priority == INTERACTIVE:
+            return self.daily_quota
+        return int(self.daily_quota * (1 - self.interactive_reserve))
+
+    def reserve(self, account: str, priority: str = INTERACTIVE) -> Optional[float]:
+        """
+        Try to take a request slot without blocking
+        Returns: 0 if granted, seconds to wait before retrying, or None if
+        the daily quota available to this priority is spent
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(account)
+            reserve = self.interactive_reserve if priority == BACKGROUND else 0.0
+            wait = max(
+                self._global.wait_time(now, self._global.needed(reserve)),
+                bucket.wait_time(now, bucket.needed(reserve))
+            )
+            if wait > 0:
+                return wait
+            self._global.take()
+            bucket.take()
+
+        # Counted only once the buckets allow the request, so waiting doesn't use up quota.
+        # The count is a disk write; other requests shouldn't queue behind it on the lock
+        if self._store.increment(QUOTA_NAMESPACE, self._today().isoformat(),
+                                 limit=self._quota_limit(priority), ttl=2 * 86400) is None:
+            with self._lock:
+                self._global.give_back()
+                bucket.give_back()
+                self._stats[priority]['over_quota'] += 1
+            return None
+
+        with self._lock:
+            self._stats[priority]['granted'] += 1
+        return 0.0
+
+    def acquire(self, account: str, priority: str = INTERACTIVE, max_wait: Optional[float] = None) -> bool:
+        """
+        Wait for a request slot
+        Returns: True if granted, False if over quota or it would take longer than max_wait
+        """
+        max_wait = RATE_LIMIT_MAX_WAIT[priority] if max_wait is None else max_wait
+        waited = 0.0
+        while True:
+            wait = self.reserve(account, priority)
+            if wait is None:
+                return False
+            if wait == 0:
+                if waited:
+                    with self._lock:
+                        self._stats[priority]['waited'] += 1
+                        self._stats[priority]['wait_seconds'] += waited
+                return True
+            if waited + wait > max_wait:
+                with self._lock:
+                    self._stats[priority]['timed_out'] += 1
+                return False
+            time.sleep(wait)
+            waited += wait
+
+    def record_throttle(self, account: str, retry_after: Optional[float] = None):
+        """Back off after the API answered 429"""
+        now = time.monotonic()
+        pause = RATE_LIMIT_THROTTLE_BACKOFF if retry_after is None else retry_after
+        with self._lock:
+            self._bucket(account).slow_down(now, pause)
+            self._global.slow_down(now, pause)
+
+    def record_success(self, account: str):
+        with self._lock:
+            self._bucket(account).speed_up()
+            self._global.speed_up()
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        today = self._today()
+        used = self._store.get(QUOTA_NAMESPACE, today.isoformat(), 0)
+        with self._lock:
+            tomorrow = datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time(),
+                                                 datetime.timezone.utc)
+            return {
+                'processes': SERVER_PROCESSES,
+                'quota': {
+                    'day': today.isoformat(),
+                    'used': used,
+                    'limit': self.daily_quota,
+                    'remaining': max(0, self.daily_quota - used),
+                    'background_remaining': max(0, self._quota_limit(BACKGROUND) - used),
+                    'resets_in': int((tomorrow - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+                },
+                'global': self._global.stats(now),
+                'accounts': {account: bucket.stats(now) for account, bucket in self._accounts.items()},
+                'priorities': {priority: dict(stats) for priority, stats in self._stats.items()}
+            }
+
+
+_default_rate_limiter = None
+_default_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    Get the process-wide Photos API rate limiter
+    With several server workers each gets an equal share of the configured
+    rates and bursts, so together they stay within them.
+    """
+    global _default_rate_limiter
+    if _default_rate_limiter is None:
+        with _default_rate_limiter_lock:
+            if _default_rate_limiter is None:
+                _default_rate_limiter = RateLimiter(
+                    global_rate=RATE_LIMIT_GLOBAL_RATE / SERVER_PROCESSES,
+                    global_burst=max(1, RATE_LIMIT_GLOBAL_BURST // SERVER_PROCESSES),
+                    account_rate=RATE_LIMIT_ACCOUNT_RATE / SERVER_PROCESSES,
+                    account_burst=max(1, RATE_LIMIT_ACCOUNT_BURST // SERVER_PROCESSES)
+                )
+    return _default_rate_limiter
@@ -0,0 +1,154 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from config import RESPONSE_CACHE_TTL, RESPONSE_CACHE_STALE_TTL, RESPONSE_CACHE_MAX_ENTRIES
+from coalesce import SingleFlight
+from state_store import get_state_store
+
+
+class CacheEntry:
+    __slots__ = ('value', 'fresh_until', 'stale_until', 'refreshing')
+
+    def __init__(self, value: Dict, fresh_until: float, stale_until: float):
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+        self.refreshing = False
+
+
+class ResponseCache:
+    """
+    Keyed cache of upstream API responses with stale-while-revalidate
+    Fresh entries are served as-is. Entries past their TTL but within the
+    stale window are served immediately while one background refresh runs.
+    Concurrent misses for the same key share a single upstream call, and
+    failed loads (empty responses) are never cached. With a namespace,
+    responses are also kept in the state store, so every server worker
+    answers from what any of them fetched; keys and values must be JSON.
+    """
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, stale_ttl: float = RESPONSE_CACHE_STALE_TTL,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, refresh_workers: int = 2,
+                 namespace: Optional[str] = None):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._loads = SingleFlight()
+        self._refresher = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix='cache-refresh')
+        self._stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'refresh_failures': 0,
+            'evictions': 0,
+            'invalidations': 0
+        }
+
+    def get(self, key: Tuple[Hashable, ...], loader: Callable[[], Dict]) -> Dict:
+        """
+        Get the response for key, calling loader on a miss
+        Returns: the cached or freshly loaded response ({} if loading failed)
+        """
+        now = time.monotonic()
+        shared = self._shared_entry(key, now) if self.namespace else None
+        with self._lock:
+            entry = self._entries.get(key)
+            if self.namespace:
+                # The state store decides: a worker may have invalidated or refetched the entry
+                if shared is None:
+                    self._entries.pop(key, None)
+                    entry = None
+                elif entry is None or shared.stale_until > entry.stale_until + 0.001:
+                    entry = self._entries[key] = shared
+            if entry is not None:
+                if now < entry.fresh_until:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry.value
+                if now < entry.stale_until:
+                    self._entries.move_to_end(key)
+                    self._stats['stale_hits'] += 1
+                    if not entry.refreshing:
+                        entry.refreshing = True
+                        self._refresher.submit(self._refresh, key, loader)
+                    return entry.value
+            self._stats['misses'] += 1
+
+        result, _ = self._loads.do(key, lambda: self._load(key, loader))
+        return result or {}
+
+    def _load(self, key: Tuple[Hashable, ...], loader: Callable[[], Dict]) -> Dict:
+        value = loader()
+        if value:
+            self._store(key, value)
+        return value
+
+    def _refresh(self, key: Tuple[Hashable, ...], loader: Callable[[], Dict]):
+        try:
+            value = loader()
+        except Exception as e:
+            print(f'Error refreshing cached response: {e}')
+            value = None
+
+        with self._lock:
+            self._stats['refreshes'] += 1
+            entry = self._entries.get(key)
+            if not value:
+                self._stats['refresh_failures'] += 1
+                if entry is not None:
+                    entry.refreshing = False
+                return
+        self._store(key, value)
+
+    def _shared_entry(self, key: Tuple[Hashable, ...], now: float) -> Optional[CacheEntry]:
+        stored = get_state_store().get(self.namespace, json.dumps(list(key)))
+        if stored is None:
+            return None
+        age = time.time() - stored['fetched_at']
+        return CacheEntry(stored['value'], now + self.ttl - age, now + self.ttl + self.stale_ttl - age)
+
+    def _store(self, key: Tuple[Hashable, ...], value: Dict):
+        now = time.monotonic()
+        if self.namespace:
+            get_state_store().set(self.namespace, json.dumps(list(key)), {'value': value, 'fetched_at': time.time()},
+                                  self.ttl + self.stale_ttl)
+        with self._lock:
+            self._entries[key] = CacheEntry(value, now + self.ttl, now + self.ttl + self.stale_ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def invalidate(self, *prefix: Hashable) -> int:
+        """
+        Drop every entry whose key starts with prefix (all entries if empty)
+        Returns: number of entries dropped
+        """
+        if self.namespace:
+            store = get_state_store()
+            for stored_key in store.keys(self.namespace):
+                if tuple(json.loads(stored_key))[:len(prefix)] == prefix:
+                    store.delete(self.namespace, stored_key)
+        with self._lock:
+            keys = [key for key in self._entries if key[:len(prefix)] == prefix]
+            for key in keys:
+                del self._entries[key]
+            self._stats['invalidations'] += len(keys)
+            return len(keys)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        stats['coalesced'] = self._loads.stats()['coalesced']
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['hits'] + stats['stale_hits']) / lookups if lookups else None
+        return stats
@@ -0,0 +1,304 @@
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config import MAX_IMAGES_PER_PAGE, SEARCH_BITSET_DENSITY, SEARCH_CHECK_INTERVAL
+from dedupe import popcount
+from media_index import _normalize_date, get_media_index
+
+# Page tokens handed out for search-backed pages, holding the creation time
+# and seq of the item to resume from, so they stay valid across rebuilds
+SEARCH_PAGE_PREFIX = 'srch:'
+
+# Facets counted for every query, in the order they are returned
+FACETS = ('year', 'month', 'type', 'mime', 'camera')
+DATE_FACETS = ('year', 'month')
+
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase runs of letters and digits; IMG_2041.JPG gives img, 2041 and jpg"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def _bitset(positions: Iterable[int], size: int) -> int:
+    """Pack item positions into an int with one bit per item"""
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def parse_page_token(page_token: str) -> Optional[Tuple[str, int]]:
+    """
+    Read a search page token
+    Returns: (creation_time, seq) of the item to resume from, or None if the token is malformed
+    """
+    if not page_token.startswith(SEARCH_PAGE_PREFIX):
+        return None
+    creation_time, _, seq = page_token[len(SEARCH_PAGE_PREFIX):].rpartition('|')
+    if not creation_time or not seq.isdigit():
+        return None
+    return creation_time, int(seq)
+
+
+def _set_positions(bits: int, start: int, limit: int) -> List[int]:
+    """Positions of the first limit set bits at or after start"""
+    digits = bin(bits >> start)[:1:-1]  # least significant bit first
+    positions = []
+    offset = digits.find('1')
+    while offset != -1 and len(positions) < limit:
+        positions.append(start + offset)
+        offset = digits.find('1', offset + 1)
+    return positions
+
+
+class _Snapshot:
+    """
+    Postings for one build of an account's search index
+    Items are numbered newest first, so every set of matches is an int with
+    one bit per item: filters are ANDs, counts are popcounts and a date
+    range is a run of consecutive bits. Words found on only a few items are
+    kept as position arrays and packed into bits when a query needs them.
+    """
+
+    def __init__(self, rows: Sequence[tuple]):
+        size = len(rows)
+        self.size = size
+        self.ids = []
+        self.seqs = array('Q')
+        times = []
+        terms = {}
+        facets = {name: {} for name in FACETS}
+        favorites = array('I')
+        duplicates = array('I')
+
+        for position, row in enumerate(rows):
+            (item_id, filename, mime_type, media_type, description, creation_time, make, model, favorite, duplicate,
+             seq) = row
+            self.ids.append(item_id)
+            self.seqs.append(seq)
+            times.append(creation_time)
+            # Models usually repeat the make ("Canon EOS R5", "NIKON D750"), but not always ("iPhone 12")
+            brand = make.split()[0].lower() if make else ''
+            camera = model if model.lower().startswith(brand) else f'{make} {model}'.strip()
+            for term in set(tokenize(f'{filename} {description} {camera}')):
+                terms.setdefault(term, array('I')).append(position)
+            values = (creation_time[:4], creation_time[:7], media_type, mime_type, camera)
+            for name, value in zip(FACETS, values):
+                if value:
+                    facets[name].setdefault(value, array('I')).append(position)
+            if favorite:
+                favorites.append(position)
+            elif duplicate:
+                # Favorites are always shown, even when they duplicate another photo
+                duplicates.append(position)
+
+        min_bitset = max(1, int(size * SEARCH_BITSET_DENSITY))
+        self.terms = {
+            term: _bitset(positions, size) if len(positions) >= min_bitset else positions
+            for term, positions in terms.items()
+        }
+        self.sorted_terms = sorted(terms)
+        self.facets = {
+            name: {value: _bitset(positions, size) for value, positions in values.items()}
+            for name, values in facets.items()
+        }
+        self.favorites = _bitset(favorites, size)
+        self.duplicates = _bitset(duplicates, size)
+        self.all = (1 << size) - 1
+        self.ascending_times = times[::-1]
+
+    def match_prefix(self, prefix: str) -> int:
+        """Items with a word starting with prefix"""
+        start = bisect_left(self.sorted_terms, prefix)
+        end = bisect_left(self.sorted_terms, prefix + '\U0010ffff', start)
+        bits = 0
+        sparse = []
+        for term in self.sorted_terms[start:end]:
+            postings = self.terms[term]
+            if isinstance(postings, int):
+                bits |= postings
+            else:
+                sparse.append(postings)
+        if sparse:
+            bits |= _bitset((position for postings in sparse for position in postings), self.size)
+        return bits
+
+    def date_range(self, start_date: str, end_date: str) -> int:
+        """Items created between two days, inclusive"""
+        # creationTime is RFC 3339, so day bounds compare correctly as strings
+        low = bisect_left(self.ascending_times, _normalize_date(start_date))
+        high = bisect_right(self.ascending_times, _normalize_date(end_date) + 'T99')
+        return ((1 << (self.size - low)) - 1) ^ ((1 << (self.size - high)) - 1)
+
+    def creation_time(self, position: int) -> str:
+        return self.ascending_times[self.size - 1 - position]
+
+    def resume_position(self, creation_time: str, seq: int) -> int:
+        """Position of the first item at or after (creation_time, seq) in newest-first order"""
+        position = self.size - bisect_right(self.ascending_times, creation_time)
+        # Items created at the same time are ordered by seq, highest first
+        while position < self.size and self.creation_time(position) == creation_time and self.seqs[position] > seq:
+            position += 1
+        return position
+
+    def facet_union(self, name: str, values: Iterable[str]) -> int:
+        bits = 0
+        for value in values:
+            bits |= self.facets[name].get(value, 0)
+        return bits
+
+
+class SearchIndex:
+    """
+    In-memory full-text and faceted search over one account's media index
+    Built from the index on first use and rebuilt in the background when
+    synced items, favorites or duplicates change; queries keep using the
+    previous build until the new one is ready.
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self._snapshot = None
+        self._version = None
+        self._checked_at = 0.0
+        self._building = False
+        self._lock = threading.Lock()
+        self._first_build_lock = threading.Lock()
+        self.builds = 0
+        self.last_build_seconds = 0.0
+
+    def _build(self, version: Optional[tuple] = None) -> _Snapshot:
+        try:
+            media_index = get_media_index(self.user_id)
+            version = version or media_index.search_version()
+            start = time.perf_counter()
+            snapshot = _Snapshot(media_index.search_rows())
+            with self._lock:
+                self._snapshot, self._version = snapshot, version
+                self.builds += 1
+                self.last_build_seconds = time.perf_counter() - start
+            return snapshot
+        finally:
+            self._building = False
+
+    def _current(self) -> _Snapshot:
+        if self._snapshot is None:
+            # The first build happens in the request; concurrent first queries wait for it
+            with self._first_build_lock:
+                if self._snapshot is None:
+                    self._checked_at = time.monotonic()
+                    self._build()
+            return self._snapshot
+
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if now - self._checked_at < SEARCH_CHECK_INTERVAL or self._building:
+            return snapshot
+        with self._lock:
+            if self._building or now - self._checked_at < SEARCH_CHECK_INTERVAL:
+                return snapshot
+            self._checked_at = now
+            version = get_media_index(self.user_id).search_version()
+            if version == self._version:
+                return snapshot
+            self._building = True
+        threading.Thread(target=self._build, args=(version,), name=f'search-build-{self.user_id}',
+                         daemon=True).start()
+        return snapshot
+
+    def search(self, text: str = '', filters: Optional[Dict[str, List[str]]] = None,
+               start_date: Optional[str] = None, end_date: Optional[str] = None,
+               favorites_only: bool = False, exclude_duplicates: bool = False,
+               page_token: Optional[str] = None, page_size: int = MAX_IMAGES_PER_PAGE) -> Dict:
+        """
+        Find items matching every word of text (as word prefixes) and the facet filters
+        Values within a facet are alternatives; different facets must all
+        match. Each facet's counts apply every filter except its own, so a
+        settings panel can offer the other years, cameras and so on.
+        Raises ValueError for a page token parse_page_token rejects.
+        Returns: dict with ids (newest first), total, facets ({name: [[value,
+        count], ...]}, dates newest first, others most common first) and nextPageToken
+        """
+        resume = parse_page_token(page_token) if page_token else None
+        if page_token and resume is None:
+            raise ValueError(f'Invalid search page token: {page_token}')
+
+        snapshot = self._current()
+        filters = {name: values for name, values in (filters or {}).items() if name in FACETS and values}
+
+        base = snapshot.all
+        for word in tokenize(text):
+            base &= snapshot.match_prefix(word)
+        if start_date and end_date:
+            base &= snapshot.date_range(start_date, end_date)
+        if favorites_only:
+            base &= snapshot.favorites
+        if exclude_duplicates:
+            base &= ~snapshot.duplicates
+
+        selected = {name: snapshot.facet_union(name, values) for name, values in filters.items()}
+        matches = base
+        for bits in selected.values():
+            matches &= bits
+
+        facets = {}
+        for name in FACETS:
+            scope = base
+            for other, bits in selected.items():
+                if other != name:
+                    scope &= bits
+            counts = [(value, popcount(scope & bits)) for value, bits in snapshot.facets[name].items()]
+            if name in DATE_FACETS:
+                counts.sort(reverse=True)
+            else:
+                counts.sort(key=lambda count: (-count[1], count[0]))
+            facets[name] = [[value, count] for value, count in counts if count]
+
+        start = snapshot.resume_position(*resume) if resume else 0
+        positions = _set_positions(matches, start, page_size + 1)
+        next_page_token = None
+        if len(positions) > page_size:
+            last = positions[page_size]
+            next_page_token = f'{SEARCH_PAGE_PREFIX}{snapshot.creation_time(last)}|{snapshot.seqs[last]}'
+            positions = positions[:page_size]
+
+        return {
+            'ids': [snapshot.ids[position] for position in positions],
+            'total': popcount(matches),
+            'facets': facets,
+            'nextPageToken': next_page_token
+        }
+
+    def stats(self) -> Dict:
+        snapshot = self._snapshot
+        return {
+            'items': snapshot.size if snapshot else 0,
+            'terms': len(snapshot.terms) if snapshot else 0,
+            'builds': self.builds,
+            'last_build_seconds': round(self.last_build_seconds, 3)
+        }
+
+
+_search_indexes = {}
+_search_indexes_lock = threading.Lock()
+
+
+def get_search_index(user_id: str) -> SearchIndex:
+    """Get the shared SearchIndex for an account"""
+    with _search_indexes_lock:
+        index = _search_indexes.get(user_id)
+        if index is None:
+            index = _search_indexes[user_id] = SearchIndex(user_id)
+        return index
+
+
+def remove_search_index(user_id: str):
+    """Forget an account's search index"""
+    with _search_indexes_lock:
+        _search_indexes.pop(user_id, None)
@@ -0,0 +1,175 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Any, Iterator, List, Optional
+
+from config import STATE_DB_PATH
+
+
+class StateStore:
+    """
+    Small SQLite key/value store shared by every server worker process
+    Module-level dicts only exist in the process that wrote them; under a
+    multi-worker server, state that any worker may need to read (auth
+    sessions, which worker owns a background job) lives here instead.
+    Values are JSON and may expire.
+    """
+
+    def __init__(self, path: str = STATE_DB_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Identifies this process as a lease owner
+        self.owner = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=10, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS kv (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL,
+                    PRIMARY KEY (namespace, key)
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)',
+                (namespace, key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)',
+                (namespace, key, json.dumps(value, default=str), expires_at)
+            )
+
+    def delete(self, namespace: str, key: str) -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute('DELETE FROM kv WHERE namespace = ? AND key = ?', (namespace, key))
+        return cursor.rowcount > 0
+
+    def increment(self, namespace: str, key: str, amount: int = 1, limit: Optional[int] = None,
+                  ttl: Optional[float] = None) -> Optional[int]:
+        """
+        Atomically add amount to an integer value (missing or expired counts as 0)
+        Every worker sees the same count, so limits hold across processes.
+        Returns: the new value, or None if it would exceed limit (the value is left unchanged)
+        """
+        now = time.time()
+        if limit is not None and amount > limit:
+            return None
+        # One statement, so the read and the write can't interleave with another worker's
+        expired = 'kv.expires_at IS NOT NULL AND kv.expires_at <= :now'
+        updated = f'CASE WHEN {expired} THEN :amount ELSE CAST(kv.value AS INTEGER) + :amount END'
+        params = {'namespace': namespace, 'key': key, 'amount': amount, 'limit': limit, 'now': now,
+                  'expires_at': now + ttl if ttl else None}
+        with self._lock, self._conn:
+            cursor = self._conn.execute(f'''
+                INSERT INTO kv (namespace, key, value, expires_at) VALUES (:namespace, :key, :amount, :expires_at)
+                ON CONFLICT(namespace, key) DO UPDATE SET
+                    value = {updated},
+                    expires_at = CASE WHEN {expired} THEN excluded.expires_at ELSE kv.expires_at END
+                WHERE :limit IS NULL OR {updated} <= :limit
+            ''', params)
+            if cursor.rowcount == 0:
+                return None
+            row = self._conn.execute('SELECT value FROM kv WHERE namespace = :namespace AND key = :key',
+                                     params).fetchone()
+        return json.loads(row[0])
+
+    def keys(self, namespace: str) -> List[str]:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?', (now,))
+            rows = self._conn.execute('SELECT key FROM kv WHERE namespace = ?', (namespace,)).fetchall()
+        return [row[0] for row in rows]
+
+    def namespace(self, namespace: str, ttl: Optional[float] = None) -> 'StateNamespace':
+        """Get a dict-like view of one namespace"""
+        return StateNamespace(self, namespace, ttl)
+
+    def acquire_lease(self, name: str, ttl: float) -> bool:
+        """
+        Take (or renew) a named lease for ttl seconds
+        Returns: True if this process now holds it, False if another process does
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute('''
+                INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE leases.owner = excluded.owner OR leases.expires_at <= ?
+            ''', (name, self.owner, now + ttl, now))
+        return cursor.rowcount > 0
+
+    def release_lease(self, name: str):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, self.owner))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class StateNamespace(MutableMapping):
+    """dict interface over one StateStore namespace"""
+
+    def __init__(self, store: StateStore, namespace: str, ttl: Optional[float] = None):
+        self.store = store
+        self.name = namespace
+        self.ttl = ttl
+
+    def __getitem__(self, key: str) -> Any:
+        missing = object()
+        value = self.store.get(self.name, key, missing)
+        if value is missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any):
+        self.store.set(self.name, key, value, self.ttl)
+
+    def __delitem__(self, key: str):
+        if not self.store.delete(self.name, key):
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.store.keys(self.name))
+
+    def __len__(self) -> int:
+        return len(self.store.keys(self.name))
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_state_store() -> StateStore:
+    """Get this process's handle on the shared state store"""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = StateStore()
+    return _default_store
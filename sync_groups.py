@@ -0,0 +1,80 @@
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import SYNC_POLL_INTERVAL
+from state_store import get_state_store
+
+# Group names appear in hub URLs
+GROUP_NAME_PATTERN = re.compile(r'^[\w-]{1,64}$')
+
+ACTIONS = ('play', 'pause', 'next', 'previous')
+
+GROUPS_NAMESPACE = 'sync_groups'
+COMMANDS_NAMESPACE = 'sync_commands'
+STATUS_NAMESPACE = 'sync_status'
+
+# Commands the hub hasn't picked up by then are dropped (e.g. no worker is serving it)
+COMMAND_TTL = 60
+# The hub rewrites its status every poll; a status this old means no hub is running
+STATUS_TTL = SYNC_POLL_INTERVAL * 5
+
+
+def list_groups() -> Dict[str, Dict]:
+    """
+    Get every sync group's settings
+    Groups live in the shared state store, so any worker can change them
+    and whichever worker serves the hub picks the change up.
+    Returns: {name: settings}
+    """
+    store = get_state_store()
+    groups = {}
+    for name in store.keys(GROUPS_NAMESPACE):
+        settings = store.get(GROUPS_NAMESPACE, name)
+        if settings is not None:
+            groups[name] = settings
+    return groups
+
+
+def save_group(name: str, settings: Dict):
+    """Create a group or replace its settings; the hub restarts its playlist"""
+    get_state_store().set(GROUPS_NAMESPACE, name, settings)
+
+
+def remove_group(name: str) -> bool:
+    return get_state_store().delete(GROUPS_NAMESPACE, name)
+
+
+def send_command(name: str, action: str):
+    """Queue a playback command (one of ACTIONS) for a group's hub"""
+    # One key per command, so commands sent at once from several workers are all kept
+    get_state_store().set(COMMANDS_NAMESPACE, f'{name}/{time.time_ns():020d}', action, COMMAND_TTL)
+
+
+def take_commands() -> List[Tuple[str, str]]:
+    """
+    Remove and return the queued commands, oldest first
+    Returns: [(group name, action), ...]
+    """
+    store = get_state_store()
+    commands = []
+    for key in sorted(store.keys(COMMANDS_NAMESPACE)):
+        action = store.get(COMMANDS_NAMESPACE, key)
+        if store.delete(COMMANDS_NAMESPACE, key) and action in ACTIONS:
+            commands.append((key.rpartition('/')[0], action))
+    return commands
+
+
+def publish_status(status: Dict[str, Dict]):
+    """Record each group's playback status for workers that don't serve the hub"""
+    store = get_state_store()
+    for name, group_status in status.items():
+        store.set(STATUS_NAMESPACE, name, group_status, STATUS_TTL)
+
+
+def group_status(name: str) -> Optional[Dict]:
+    """
+    Get a group's last published playback status
+    Returns: dict with displays, index, paused and current, or None if no hub is playing the group
+    """
+    return get_state_store().get(STATUS_NAMESPACE, name)
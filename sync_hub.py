@@ -0,0 +1,386 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from config import (
+    SYNC_PORT, SYNC_POLL_INTERVAL, SYNC_LEAD, SYNC_PREFETCH_SLIDES, SYNC_BATCH_SIZE, SYNC_HISTORY,
+    SYNC_HEARTBEAT, SYNC_QUEUE_SIZE, SYNC_IDLE_TIMEOUT, SYNC_RETRY_INTERVAL, SYNC_LEASE, SERVER_HOST
+)
+from image_cache import display_size, negotiate_format
+from media_item import MediaItem, page_urls
+from state_store import get_state_store
+from sync_groups import list_groups, publish_status, take_commands
+
+HUB_LEASE = 'sync-hub'
+
+# (width, height, image format) of the slides a display loads; None for the proxy's default size
+Variant = Optional[Tuple[int, int, str]]
+
+
+class _Display:
+    """One connected display: the events waiting to be written to it"""
+
+    __slots__ = ('queue', 'variant')
+
+    def __init__(self, variant: Variant):
+        self.queue = asyncio.Queue(SYNC_QUEUE_SIZE)
+        self.variant = variant
+
+
+class _Group:
+    """Shared playback state of one sync group"""
+
+    def __init__(self, name: str, settings: Dict):
+        self.name = name
+        self.settings = settings
+        self.displays = set()
+        self.upcoming = deque()
+        self.history = deque(maxlen=SYNC_HISTORY)
+        self.current = None
+        self.index = 0
+        self.cursor = None
+        self.paused = False
+        self.due = 0.0  # loop time the next slide is shown at
+        self.starts_at = 0.0  # wall clock time the current slide was shown at
+        self.idle_since = None
+        self.task = None
+        self.wake = asyncio.Event()
+
+    def restart(self, settings: Dict):
+        """Start the group's playlist over, e.g. after its settings changed"""
+        self.settings = settings
+        self.upcoming.clear()
+        self.history.clear()
+        self.cursor = None
+
+
+class SyncHub:
+    """
+    Server-Sent Events hub that plays one shared slideshow per group
+    Each group has a single timer on the hub's event loop. A slide is
+    announced to every display of the group SYNC_LEAD seconds before it is
+    due, with the time to show it and the slides that follow, so displays
+    switch together and load what comes next in the meantime. A display is
+    an open HTTP response, a coroutine and a small queue, not a thread.
+    """
+
+    def __init__(self, load_slides: Callable[[Dict, Optional[str]], Optional[Tuple[List[MediaItem], str]]],
+                 warm: Optional[Callable[[str, Dict, int, List[MediaItem], List[Variant]], None]] = None):
+        """
+        load_slides(settings, cursor) returns the next slides of a group's playlist and the
+        cursor to continue from, or None if there are none yet. warm(name, settings, index,
+        items, variants) gets the server's caches ready for upcoming slides. Both block,
+        so they run on the loop's executor.
+        """
+        self.load_slides = load_slides
+        self.warm = warm
+        self._groups = {}
+        self._loop = None
+        self.events_sent = 0
+        self.displays_dropped = 0
+
+    # Event stream
+
+    async def subscribe(self, request: web.Request) -> web.StreamResponse:
+        """GET /events/<group>: the group's slides as a text/event-stream"""
+        name = request.match_info['group']
+        group = self._groups.get(name)
+        if group is None:
+            # The group may have been created since the last poll
+            await self._poll()
+            group = self._groups.get(name)
+            if group is None:
+                return web.json_response({'error': 'Sync group not found'}, status=404,
+                                         headers={'Access-Control-Allow-Origin': '*'})
+
+        display = _Display(_variant(request.query))
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'Access-Control-Allow-Origin': '*',
+            'X-Accel-Buffering': 'no'  # stop nginx from buffering the stream
+        })
+        await response.prepare(request)
+        await response.write(b'retry: 3000\n\n' + self._hello(group, display.variant))
+
+        group.displays.add(display)
+        group.idle_since = None
+        self._start_clock(group)
+        try:
+            while True:
+                try:
+                    data = await asyncio.wait_for(display.queue.get(), SYNC_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    data = b': ping\n\n'
+                if data is None:
+                    break
+                await response.write(data)
+        except ConnectionResetError:
+            pass
+        finally:
+            group.displays.discard(display)
+            if not group.displays:
+                group.idle_since = self._loop.time()
+        return response
+
+    def _hello(self, group: _Group, variant: Variant) -> bytes:
+        """First event of a stream: server time, playback state and the slide showing now"""
+        payload = {'group': group.name, 'serverTime': _now_ms(), 'paused': group.paused, 'index': group.index}
+        if group.current is not None:
+            payload.update(self._slide_payload(group, variant))
+            payload['startsAt'] = round(group.starts_at * 1000)
+        return _event('hello', payload)
+
+    def _slide_payload(self, group: _Group, variant: Variant) -> Dict:
+        media = group.settings.get('media')
+        size = variant[:2] if variant else None
+        return {
+            'index': group.index,
+            'item': group.current.to_compact_dict(media is None),
+            'next': [item.to_compact_dict(media is None) for item in list(group.upcoming)[:SYNC_PREFETCH_SLIDES]],
+            'urls': page_urls(media, size),
+            'duration': group.settings['speed']
+        }
+
+    def _broadcast(self, group: _Group, kind: str, payload_for: Callable[[Variant], Dict]):
+        """Queue one event for every display of a group, encoded once per slide variant"""
+        encoded = {}
+        for display in list(group.displays):
+            data = encoded.get(display.variant)
+            if data is None:
+                data = encoded[display.variant] = _event(kind, {**payload_for(display.variant),
+                                                                'serverTime': _now_ms()}, group.index)
+            try:
+                display.queue.put_nowait(data)
+                self.events_sent += 1
+            except asyncio.QueueFull:
+                # A display this far behind is disconnected; it reconnects and resynchronizes
+                self._drop(group, display)
+
+    def _drop(self, group: _Group, display: _Display):
+        """Disconnect a display that fell behind, discarding what it hasn't been sent"""
+        self.displays_dropped += 1
+        while not display.queue.empty():
+            display.queue.get_nowait()
+        self._close(group, display)
+
+    def _close(self, group: _Group, display: _Display):
+        """End a display's stream once the events already queued for it are written"""
+        group.displays.discard(display)
+        try:
+            display.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            # No room for the end marker: make room by dropping the oldest event but keep the newest
+            display.queue.get_nowait()
+            display.queue.put_nowait(None)
+
+    # Group clocks
+
+    def _start_clock(self, group: _Group):
+        if group.task is None or group.task.done():
+            group.due = self._loop.time() + SYNC_LEAD
+            group.task = self._loop.create_task(self._run_clock(group))
+
+    async def _run_clock(self, group: _Group):
+        """Show each of a group's slides in turn while displays are connected"""
+        loop = self._loop
+        while True:
+            if not group.displays and group.idle_since is not None and \
+                    loop.time() - group.idle_since > SYNC_IDLE_TIMEOUT:
+                return
+            if group.paused:
+                timeout = SYNC_IDLE_TIMEOUT
+            else:
+                timeout = group.due - SYNC_LEAD - loop.time()
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(group.wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                group.wake.clear()
+                continue
+            try:
+                await self._advance(group)
+            except Exception as e:
+                print(f'Error advancing sync group {group.name}: {e}')
+                group.due = loop.time() + SYNC_RETRY_INTERVAL
+
+    async def _advance(self, group: _Group):
+        loop = self._loop
+        if len(group.upcoming) <= SYNC_PREFETCH_SLIDES:
+            settings = group.settings
+            result = await loop.run_in_executor(None, self.load_slides, settings, group.cursor)
+            if group.settings is not settings:
+                return  # settings changed while loading; start over with the new playlist
+            if result:
+                items, group.cursor = result
+                group.upcoming.extend(items)
+        if not group.upcoming:
+            group.due = loop.time() + SYNC_RETRY_INTERVAL
+            return
+
+        if group.current is not None:
+            group.history.append(group.current)
+        group.current = group.upcoming.popleft()
+        group.index += 1
+        group.starts_at = time.time() + max(0.0, group.due - loop.time())
+        starts_at = round(group.starts_at * 1000)
+        self._broadcast(group, 'slide', lambda variant: {**self._slide_payload(group, variant),
+                                                         'startsAt': starts_at})
+        group.due += group.settings['speed']
+
+        if self.warm is not None:
+            upcoming = [group.current] + list(group.upcoming)[:SYNC_PREFETCH_SLIDES]
+            variants = list({display.variant for display in group.displays})
+            loop.run_in_executor(None, self.warm, group.name, group.settings, group.index, upcoming, variants)
+
+    def _command(self, group: _Group, action: str):
+        now = self._loop.time()
+        if action == 'pause':
+            group.paused = True
+        elif action == 'play':
+            group.paused = False
+            group.due = now + SYNC_LEAD
+        elif action == 'next':
+            group.due = now + SYNC_LEAD
+        elif action == 'previous' and group.history and group.current is not None:
+            group.upcoming.appendleft(group.current)
+            group.upcoming.appendleft(group.history.pop())
+            group.current = None
+            group.index -= 2
+            group.due = now + SYNC_LEAD
+        self._broadcast(group, 'state', lambda variant: {'paused': group.paused, 'index': group.index})
+        group.wake.set()
+
+    # Shared state
+
+    async def _poll(self):
+        """Apply group changes and commands from the state store, and publish each group's status"""
+        status = {
+            name: {'displays': len(group.displays), 'index': group.index, 'paused': group.paused,
+                   'current': group.current.id if group.current else None}
+            for name, group in self._groups.items()
+        }
+        groups, commands = await self._loop.run_in_executor(None, _sync_state, status)
+
+        for name in list(self._groups):
+            if name not in groups:
+                group = self._groups.pop(name)
+                self._broadcast(group, 'end', lambda variant: {})
+                for display in list(group.displays):
+                    self._close(group, display)
+                if group.task:
+                    group.task.cancel()
+        for name, settings in groups.items():
+            group = self._groups.get(name)
+            if group is None:
+                self._groups[name] = _Group(name, settings)
+            elif settings != group.settings:
+                group.restart(settings)
+                group.due = self._loop.time() + SYNC_LEAD
+                group.wake.set()
+        for name, action in commands:
+            group = self._groups.get(name)
+            if group is not None:
+                self._command(group, action)
+
+    async def _poll_forever(self):
+        while True:
+            try:
+                await self._poll()
+            except Exception as e:
+                print(f'Error polling sync groups: {e}')
+            await asyncio.sleep(SYNC_POLL_INTERVAL)
+
+    async def stats(self, request: web.Request) -> web.Response:
+        """GET /stats: connected displays and events sent"""
+        return web.json_response({
+            'groups': {name: len(group.displays) for name, group in self._groups.items()},
+            'displays': sum(len(group.displays) for group in self._groups.values()),
+            'events_sent': self.events_sent,
+            'displays_dropped': self.displays_dropped
+        }, headers={'Access-Control-Allow-Origin': '*'})
+
+    # Serving
+
+    async def serve(self, host: str, port: int, keep_running: Callable[[], bool] = lambda: True):
+        """Serve the hub until keep_running() returns False"""
+        self._loop = asyncio.get_running_loop()
+        app = web.Application()
+        app.router.add_get('/events/{group}', self.subscribe)
+        app.router.add_get('/stats', self.stats)
+        runner = web.AppRunner(app, handle_signals=False)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, host, port, backlog=1024).start()
+            poller = self._loop.create_task(self._poll_forever())
+            print(f'Sync hub listening on {host}:{port}')
+            while keep_running():
+                await asyncio.sleep(SYNC_LEASE / 3)
+            poller.cancel()
+        finally:
+            await runner.cleanup()
+
+
+def _sync_state(status: Dict[str, Dict]):
+    publish_status(status)
+    return list_groups(), take_commands()
+
+
+def _variant(query) -> Variant:
+    """The slide size (from vw, vh and dpr) and image format (formats) a display asked for"""
+    try:
+        width, height = float(query['vw']), float(query['vh'])
+        dpr = float(query.get('dpr', 1))
+    except (KeyError, ValueError):
+        return None
+    if not (0 < width < 100000 and 0 < height < 100000):
+        return None
+    return (*display_size(width, height, dpr), negotiate_format(query.get('formats', '').split(',')))
+
+
+def _event(kind: str, payload: Dict, event_id: Optional[int] = None) -> bytes:
+    lines = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{lines}event: {kind}\ndata: {json.dumps(payload, separators=(",", ":"))}\n\n'.encode()
+
+
+def _now_ms() -> int:
+    return round(time.time() * 1000)
+
+
+_hub_thread = None
+_hub_lock = threading.Lock()
+
+
+def start_sync_hub(hub: SyncHub, host: str = SERVER_HOST, port: int = SYNC_PORT) -> bool:
+    """
+    Serve the sync hub from one worker process
+    Every worker calls this; the one holding the hub lease serves, and the
+    others keep trying so one takes over if that worker goes away.
+    Returns: False if this process already started it
+    """
+    global _hub_thread
+    with _hub_lock:
+        if _hub_thread is not None:
+            return False
+        store = get_state_store()
+
+        def run():
+            while True:
+                if store.acquire_lease(HUB_LEASE, SYNC_LEASE):
+                    try:
+                        asyncio.run(hub.serve(host, port, lambda: store.acquire_lease(HUB_LEASE, SYNC_LEASE)))
+                    except OSError as e:
+                        print(f'Sync hub could not listen on {host}:{port}: {e}')
+                    finally:
+                        store.release_lease(HUB_LEASE)
+                time.sleep(SYNC_LEASE / 2)
+
+        _hub_thread = threading.Thread(target=run, name='sync-hub', daemon=True)
+        _hub_thread.start()
+        return True
@@ -0,0 +1,45 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Runs in a fresh interpreter so modules imported by other tests don't count
+STARTUP_SCRIPT = '''
+import json, sys
+import main, app
+app._init_services = lambda: None
+client = app.create_app().test_client()
+status = client.get('/').status_code
+
+import http_session, media_index, rate_limiter, search_index, state_store, token_store
+print(json.dumps({
+    'status': status,
+    'modules': sorted(sys.modules),
+    'singletons': {
+        'token_store': token_store._default_store is not None,
+        'state_store': state_store._default_store is not None,
+        'rate_limiter': rate_limiter._default_rate_limiter is not None,
+        'http_session': http_session._default_transport is not None,
+        'media_index': bool(media_index._indexes),
+        'search_index': bool(search_index._search_indexes),
+    }
+}))
+'''
+
+HEAVY_MODULES = ['requests', 'urllib3', 'PIL', 'aiohttp']
+
+
+def test_startup_leaves_heavy_modules_and_stores_unloaded(tmp_path):
+    env = dict(os.environ, GOOGLE_CLIENT_ID='', PYTHONPATH=str(ROOT))
+    result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert report['status'] == 200
+    loaded = {name.split('.')[0] for name in report['modules']}
+    assert [name for name in HEAVY_MODULES if name in loaded] == []
+    assert [name for name, created in report['singletons'].items() if created] == []
@@ -0,0 +1,103 @@
+import json
+import multiprocessing
+import random
+import threading
+
+from token_store import TokenStore
+
+ACCOUNTS = 20
+PROCESSES = 3
+THREADS = 4
+OPERATIONS = 300
+
+
+def credentials(user_id, serial=0):
+    return {
+        'token': f'{user_id}:access-{serial}',
+        'refresh_token': f'{user_id}:refresh',
+        'email': f'{user_id}@example.com',
+        'user_id': user_id,
+        'expiry': '2030-01-01 00:00:00.000000'
+    }
+
+
+def hammer(db_path, legacy_dir, worker, results):
+    """Refresh and read accounts from several threads; report torn reads and each thread's update counts"""
+    store = TokenStore(db_path, legacy_dir)
+    torn = []
+    expected = {}
+    lock = threading.Lock()
+
+    def run(thread):
+        rng = random.Random(worker * 100 + thread)
+        field = f'n_{worker}_{thread}'
+        counts = {}
+        for _ in range(OPERATIONS):
+            user_id = f'user-{rng.randrange(ACCOUNTS)}'
+            if rng.random() < 0.4:
+                counts[user_id] = counts.get(user_id, 0) + 1
+                store.update(user_id, {'token': f'{user_id}:access-{rng.random()}', field: counts[user_id]})
+            else:
+                creds, _ = store.get(user_id)
+                # A thread always sees its own latest refresh, whatever the other writers did
+                if not creds['token'].startswith(f'{user_id}:') or creds.get(field, 0) != counts.get(user_id, 0):
+                    with lock:
+                        torn.append(user_id)
+        with lock:
+            expected.update({f'{user_id}/{field}': n for user_id, n in counts.items()})
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store.close()
+    results.put((torn, expected))
+
+
+def test_migrates_json_token_files_once(tmp_path):
+    legacy_dir = tmp_path / 'tokens'
+    legacy_dir.mkdir()
+    for n in range(3):
+        (legacy_dir / f'user-{n}.json').write_text(json.dumps(credentials(f'user-{n}')))
+    (legacy_dir / 'broken.json').write_text('{"token": ')
+
+    store = TokenStore(str(tmp_path / 'tokens.sqlite3'), str(legacy_dir))
+    assert sorted(store.user_ids()) == ['user-0', 'user-1', 'user-2']
+    assert store.get('user-1')[0]['token'] == 'user-1:access-0'
+    store.close()
+
+    # Later changes to the old files are not imported again
+    (legacy_dir / 'user-1.json').write_text(json.dumps(credentials('user-1', serial=9)))
+    (legacy_dir / 'user-3.json').write_text(json.dumps(credentials('user-3')))
+    store = TokenStore(str(tmp_path / 'tokens.sqlite3'), str(legacy_dir))
+    assert sorted(store.user_ids()) == ['user-0', 'user-1', 'user-2']
+    assert store.get('user-1')[0]['token'] == 'user-1:access-0'
+    store.close()
+
+
+def test_concurrent_refreshes_are_never_torn_or_lost(tmp_path):
+    db_path, legacy_dir = str(tmp_path / 'tokens.sqlite3'), str(tmp_path / 'none')
+    store = TokenStore(db_path, legacy_dir)
+    for n in range(ACCOUNTS):
+        store.save(f'user-{n}', credentials(f'user-{n}'))
+    store.close()
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [context.Process(target=hammer, args=(db_path, legacy_dir, n, results)) for n in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    reports = [results.get(timeout=120) for _ in processes]
+    for process in processes:
+        process.join(timeout=30)
+        assert process.exitcode == 0
+
+    assert [user_id for torn, _ in reports for user_id in torn] == []
+    store = TokenStore(db_path, legacy_dir)
+    for _, expected in reports:
+        for key, n in expected.items():
+            user_id, field = key.split('/')
+            assert store.get(user_id)[0].get(field) == n, f'lost update to {key}'
+    assert len(store.accounts()) == ACCOUNTS
+    store.close()
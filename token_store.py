@@ -0,0 +1,198 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config import TOKEN_DB_PATH, TOKENS_DIR
+
+
+class TokenStore:
+    """
+    Transactional store for every account's OAuth credentials
+    One SQLite database in WAL mode replaces the per-user JSON files in
+    data/tokens. Each write is a single transaction, so a reader in any
+    worker sees either the old or the new credentials and never a
+    half-written file. Writes that change some fields (a refreshed access
+    token) are merged into the stored record inside the transaction, so a
+    refresh can't undo a concurrent re-login. Every write gets a new
+    version number, which the credential cache compares instead of file
+    mtimes.
+    """
+
+    def __init__(self, path: str = TOKEN_DB_PATH, legacy_dir: str = TOKENS_DIR):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # Transactions are opened explicitly, so read-modify-write updates can take the write lock up front
+        self._conn = sqlite3.connect(str(self.path), timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # Credentials are written rarely and are expensive to lose; sync every commit
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS tokens (
+                user_id TEXT PRIMARY KEY,
+                email TEXT NOT NULL,
+                creds TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)")
+
+        # Account list kept in memory; reloaded only when another connection has written
+        self._accounts = None
+        self._data_version = None
+
+        self._migrate(Path(legacy_dir))
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    @staticmethod
+    def _next_version(conn: sqlite3.Connection) -> int:
+        """Store-wide version for a write, so a removed and re-added account never reuses one"""
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        return conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def _migrate(self, legacy_dir: Path):
+        """
+        Import the JSON token files of earlier versions, once
+        The files are left in place; later changes to them are not picked up.
+        """
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+                return
+            imported = 0
+            for token_file in sorted(legacy_dir.glob('*.json')) if legacy_dir.is_dir() else []:
+                try:
+                    with open(token_file, 'r') as f:
+                        creds = json.load(f)
+                    user_id = creds.setdefault('user_id', token_file.stem)
+                    now = time.time()
+                    cursor = conn.execute(
+                        'INSERT OR IGNORE INTO tokens (user_id, email, creds, version, created_at, updated_at) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (user_id, creds.get('email', 'Unknown'), json.dumps(creds, default=str),
+                         self._next_version(conn), now, now)
+                    )
+                    imported += cursor.rowcount
+                except (json.JSONDecodeError, OSError, AttributeError) as e:
+                    print(f'Skipping unreadable token file {token_file.name}: {e}')
+            conn.execute("INSERT INTO meta (key, value) VALUES ('migrated', ?)", (imported,))
+        if imported:
+            print(f'Moved {imported} account(s) from {legacy_dir} into {self.path}')
+
+    def get(self, user_id: str) -> Optional[Tuple[Dict, int]]:
+        """
+        Get an account's credentials
+        Returns: (credentials dict, version), or None if the account isn't stored
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT creds, version FROM tokens WHERE user_id = ?', (user_id,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def version(self, user_id: str) -> Optional[int]:
+        """
+        Get the version of an account's credentials, to tell whether a cached copy is current
+        Returns: version number, or None if the account isn't stored
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT version FROM tokens WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def save(self, user_id: str, creds: Dict) -> int:
+        """
+        Store an account's credentials after a login, replacing any it had
+        Returns: the new version
+        """
+        creds = json.loads(json.dumps({**creds, 'user_id': user_id}, default=str))
+        now = time.time()
+        with self._transaction() as conn:
+            version = self._next_version(conn)
+            conn.execute('''
+                INSERT INTO tokens (user_id, email, creds, version, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET email = excluded.email, creds = excluded.creds,
+                    version = excluded.version, updated_at = excluded.updated_at
+            ''', (user_id, creds.get('email', 'Unknown'), json.dumps(creds), version, now, now))
+            self._remember(user_id, creds.get('email', 'Unknown'))
+        return version
+
+    def update(self, user_id: str, changes: Dict) -> Optional[Tuple[Dict, int]]:
+        """
+        Change some of an account's credential fields (e.g. token and expiry after a refresh)
+        Returns: (the merged credentials, new version), or None if the account was removed
+        """
+        changes = json.loads(json.dumps(changes, default=str))
+        with self._transaction() as conn:
+            row = conn.execute('SELECT creds FROM tokens WHERE user_id = ?', (user_id,)).fetchone()
+            if row is None:
+                return None
+            creds = {**json.loads(row[0]), **changes}
+            version = self._next_version(conn)
+            conn.execute(
+                'UPDATE tokens SET creds = ?, version = ?, updated_at = ? WHERE user_id = ?',
+                (json.dumps(creds), version, time.time(), user_id)
+            )
+        return creds, version
+
+    def remove(self, user_id: str) -> bool:
+        with self._transaction() as conn:
+            removed = conn.execute('DELETE FROM tokens WHERE user_id = ?', (user_id,)).rowcount > 0
+            if self._accounts is not None:
+                self._accounts.pop(user_id, None)
+        return removed
+
+    def _remember(self, user_id: str, email: str):
+        """Keep the in-memory account list in step with this connection's own writes"""
+        if self._accounts is not None:
+            self._accounts[user_id] = {'user_id': user_id, 'email': email}
+
+    def accounts(self) -> List[Dict]:
+        """
+        List stored accounts
+        Served from memory; PRAGMA data_version tells whether another worker
+        has written since, without reading any table.
+        Returns: list of dicts with user_id and email, oldest account first
+        """
+        with self._lock:
+            data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+            if self._accounts is None or data_version != self._data_version:
+                rows = self._conn.execute('SELECT user_id, email FROM tokens ORDER BY created_at, user_id').fetchall()
+                self._accounts = {user_id: {'user_id': user_id, 'email': email} for user_id, email in rows}
+                self._data_version = data_version
+            return [dict(account) for account in self._accounts.values()]
+
+    def user_ids(self) -> List[str]:
+        return [account['user_id'] for account in self.accounts()]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_token_store() -> TokenStore:
+    """Get this process's handle on the credential store"""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = TokenStore()
+    return _default_store
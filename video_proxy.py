@@ -0,0 +1,433 @@
+import hashlib
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import (
+    VIDEO_CACHE_DIR, VIDEO_CACHE_MAX_BYTES, VIDEO_HEAD_BYTES, VIDEO_CHUNK_BYTES,
+    VIDEO_READ_AHEAD_CHUNKS, VIDEO_READ_AHEAD_IDLE, VIDEO_STARTUP_HISTORY
+)
+from http_session import HttpTransport, get_transport
+from image_cache import DiskLRUCache
+from metrics import counter, histogram
+
+if TYPE_CHECKING:
+    import requests
+
+VIDEO_FIRST_BYTE_SECONDS = histogram(
+    'video_first_byte_duration_seconds', 'Time until the first byte of a proxied video response', ('source',)
+)
+VIDEO_STARTUP_SECONDS = histogram(
+    'video_startup_duration_seconds', 'Time from showing a video slide until it played, reported by displays',
+    ('source',)
+)
+VIDEO_BYTES = counter('video_bytes_total', 'Proxied video bytes by where they came from', ('source',))
+
+# How many clips to remember the last serving source of, for startup reports
+MAX_TRACKED_CLIPS = 10000
+
+# A byte range as werkzeug parses it: (start, stop) with stop exclusive; a negative start counts from the end
+ByteRange = Tuple[int, Optional[int]]
+
+
+class VideoStream:
+    """
+    Status, headers and body of a proxied video response
+    close() must be called when the response ends, even if the body was
+    never read (a HEAD request, or a client gone before the first byte).
+    """
+
+    def __init__(self, status: int, headers: Dict[str, str], chunks: Iterator[bytes],
+                 on_close: Optional[Callable[[], None]] = None):
+        self.status = status
+        self.headers = headers
+        self.chunks = chunks
+        self._on_close = on_close
+
+    def close(self):
+        self.chunks.close()
+        if self._on_close is not None:
+            self._on_close()
+
+
+class _ReadAhead:
+    """
+    Reads an upstream response on a background thread, a bounded number of chunks ahead
+    The client drains the buffer at its own pace while the next chunks are
+    already on their way from Google. At most length bytes are passed on;
+    a 200 from a server that ignored Range has its first offset bytes dropped.
+    If the client takes nothing for idle_timeout seconds, reading stops and
+    the upstream response is closed.
+    """
+
+    def __init__(self, open_response: Callable[[], Optional['requests.Response']], offset: int = 0,
+                 length: Optional[int] = None, chunk_bytes: int = VIDEO_CHUNK_BYTES,
+                 max_chunks: int = VIDEO_READ_AHEAD_CHUNKS, idle_timeout: float = VIDEO_READ_AHEAD_IDLE):
+        self._open_response = open_response
+        self._offset = offset
+        self._length = length
+        self._chunk_bytes = chunk_bytes
+        self._idle_timeout = idle_timeout
+        self._queue = queue.Queue(max_chunks)
+        self._closed = threading.Event()
+        threading.Thread(target=self._run, name='video-read-ahead', daemon=True).start()
+
+    def _put(self, chunk: Optional[bytes]) -> bool:
+        give_up_at = time.monotonic() + self._idle_timeout
+        while not self._closed.is_set():
+            try:
+                self._queue.put(chunk, timeout=min(1.0, self._idle_timeout))
+                return True
+            except queue.Full:
+                if time.monotonic() >= give_up_at:
+                    # The client stopped reading without closing; don't hold the upstream connection
+                    self._closed.set()
+        return False
+
+    def _run(self):
+        import requests
+        try:
+            response = self._open_response()
+            if response is None:
+                return
+            with response:
+                if response.status_code not in (200, 206):
+                    print(f'Error streaming video: {response.status_code}')
+                    return
+                skip = self._offset if response.status_code == 200 else 0
+                remaining = self._length
+                for chunk in response.iter_content(self._chunk_bytes):
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        chunk, skip = chunk[dropped:], skip - dropped
+                    if remaining is not None:
+                        chunk = chunk[:remaining]
+                        remaining -= len(chunk)
+                    if chunk and not self._put(chunk):
+                        return
+                    if remaining == 0:
+                        return
+        except requests.RequestException as e:
+            print(f'Error streaming video: {e}')
+        finally:
+            self._put(None)
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            yield chunk
+
+    def close(self):
+        """Stop reading; called when the client goes away"""
+        self._closed.set()
+
+
+class VideoProxy:
+    """
+    Streams Google Photos videos through the server with Range support
+    The first VIDEO_HEAD_BYTES of each clip are kept on disk, so playback
+    starts from local bytes while the rest is read ahead from Google on a
+    background thread. Prefetch fetches the heads of upcoming clips.
+    """
+
+    def __init__(self, disk_cache: Optional[DiskLRUCache] = None,
+                 transport: Optional[HttpTransport] = None, head_bytes: int = VIDEO_HEAD_BYTES):
+        self.disk_cache = disk_cache or DiskLRUCache(VIDEO_CACHE_DIR, VIDEO_CACHE_MAX_BYTES)
+        self.transport = transport or get_transport()
+        self.head_bytes = head_bytes
+
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._sources = OrderedDict()  # item id -> where its last response started ('head' or 'upstream')
+        self._startups = deque(maxlen=VIDEO_STARTUP_HISTORY)
+        self._stats = {
+            'streams': 0,
+            'head_hits': 0,
+            'head_misses': 0,
+            'heads_fetched': 0,
+            'head_bytes_served': 0,
+            'upstream_bytes_served': 0
+        }
+
+    @staticmethod
+    def cache_key(item_id: str) -> str:
+        return hashlib.sha1(f'{item_id}=dv-head'.encode()).hexdigest()
+
+    @staticmethod
+    def _info_key(item_id: str) -> str:
+        return hashlib.sha1(f'{item_id}=dv-info'.encode()).hexdigest()
+
+    def _count(self, stat: str, amount: int = 1):
+        with self._lock:
+            self._stats[stat] += amount
+
+    def is_cached(self, item_id: str) -> bool:
+        return self.disk_cache.contains(self.cache_key(item_id)) and \
+            self.disk_cache.contains(self._info_key(item_id))
+
+    def head(self, item_id: str) -> Optional[Tuple[Path, int, str]]:
+        """
+        Get the cached start of a clip
+        Returns: (path, total size of the clip, content type), or None if it isn't cached
+        """
+        path = self.disk_cache.get(self.cache_key(item_id))
+        info_path = self.disk_cache.get(self._info_key(item_id))
+        if path is None or info_path is None:
+            return None
+        try:
+            info = json.loads(info_path.read_text())
+        except (OSError, ValueError):
+            return None
+        return path, info['size'], info['content_type']
+
+    def _store_head(self, item_id: str, data: bytes, size: int, content_type: str):
+        self.disk_cache.put(self.cache_key(item_id), data, content_type)
+        info = json.dumps({'size': size, 'content_type': content_type}).encode()
+        self.disk_cache.put(self._info_key(item_id), info, 'application/json')
+
+    def fetch_head(self, item_id: str, base_url_provider: Callable[[], Optional[str]]) -> bool:
+        """
+        Cache the start of a clip ahead of playback
+        base_url_provider is only called if the head isn't cached yet.
+        Returns: whether the head is cached now
+        """
+        import requests
+        if self.is_cached(item_id):
+            return True
+        with self._lock:
+            lock = self._locks.setdefault(item_id, threading.Lock())
+        with lock:
+            try:
+                if self.is_cached(item_id):
+                    return True
+                base_url = base_url_provider()
+                if not base_url:
+                    return False
+                headers = {'Range': f'bytes=0-{self.head_bytes - 1}'}
+                with self.transport.get(f'{base_url}=dv', headers=headers, stream=True) as response:
+                    if response.status_code not in (200, 206):
+                        print(f'Error fetching video: {response.status_code}')
+                        return False
+                    size = _total_size(response)
+                    data = bytearray()
+                    for chunk in response.iter_content(VIDEO_CHUNK_BYTES):
+                        data += chunk
+                        if len(data) >= self.head_bytes:
+                            break
+                if size is None:
+                    return False
+                self._store_head(item_id, bytes(data[:self.head_bytes]), size, _content_type(response))
+                self._count('heads_fetched')
+                return True
+            except requests.RequestException as e:
+                print(f'Error fetching video: {e}')
+                return False
+            finally:
+                with self._lock:
+                    self._locks.pop(item_id, None)
+
+    def open(self, item_id: str, base_url_provider: Callable[[], Optional[str]],
+             byte_range: Optional[ByteRange] = None) -> Optional[VideoStream]:
+        """
+        Start a response for a clip, or a byte range of it
+        Ranges starting inside a cached head are answered from disk at once
+        while the rest is requested from Google; anything else is streamed
+        from Google, and a response from the start fills the head cache.
+        Returns: a VideoStream, or None if the clip could not be fetched
+        """
+        started = time.perf_counter()
+        self._count('streams')
+        head = self.head(item_id)
+        if head is not None:
+            path, size, content_type = head
+            start, stop = _resolve(byte_range, size)
+            if start < path.stat().st_size:
+                self._count('head_hits')
+                self._remember_source(item_id, 'head')
+                return self._from_head(item_id, base_url_provider, path, size, content_type, start, stop,
+                                       byte_range is not None, started)
+        else:
+            self._count('head_misses')
+        self._remember_source(item_id, 'upstream')
+        return self._from_upstream(item_id, base_url_provider, byte_range, started)
+
+    def _from_head(self, item_id, base_url_provider, path, size, content_type, start, stop, partial, started):
+        head_size = path.stat().st_size
+
+        def open_rest():
+            base_url = base_url_provider()
+            if not base_url:
+                print('Error streaming video: no base URL')
+                return None
+            return self.transport.get(f'{base_url}=dv', headers={'Range': f'bytes={head_size}-{stop - 1}'},
+                                      stream=True)
+
+        def chunks():
+            first = True
+            # Ask Google for the rest before sending the head, so it arrives meanwhile; opened
+            # here rather than up front so a body that is never read opens no connection
+            rest = _ReadAhead(open_rest, offset=head_size, length=stop - head_size) if stop > head_size else None
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(start)
+                    remaining = min(stop, head_size) - start
+                    while remaining > 0:
+                        chunk = f.read(min(VIDEO_CHUNK_BYTES, remaining))
+                        if not chunk:
+                            break
+                        if first:
+                            VIDEO_FIRST_BYTE_SECONDS.labels('head').observe(time.perf_counter() - started)
+                            first = False
+                        remaining -= len(chunk)
+                        self._count('head_bytes_served', len(chunk))
+                        VIDEO_BYTES.labels('head').inc(len(chunk))
+                        yield chunk
+                if rest is not None:
+                    for chunk in rest:
+                        self._count('upstream_bytes_served', len(chunk))
+                        VIDEO_BYTES.labels('upstream').inc(len(chunk))
+                        yield chunk
+            finally:
+                if rest is not None:
+                    rest.close()
+
+        headers = {'Content-Type': content_type, 'Content-Length': str(stop - start)}
+        if partial:
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        return VideoStream(206 if partial else 200, headers, chunks())
+
+    def _from_upstream(self, item_id, base_url_provider, byte_range, started):
+        import requests
+        base_url = base_url_provider()
+        if not base_url:
+            return None
+        headers = {}
+        if byte_range is not None:
+            start, stop = byte_range
+            if start < 0:
+                headers['Range'] = f'bytes={start}'
+            else:
+                headers['Range'] = f'bytes={start}-{"" if stop is None else stop - 1}'
+        try:
+            response = self.transport.get(f'{base_url}=dv', headers=headers, stream=True)
+        except requests.RequestException as e:
+            print(f'Error streaming video: {e}')
+            return None
+        if response.status_code not in (200, 206, 416):
+            print(f'Error streaming video: {response.status_code}')
+            response.close()
+            return None
+
+        stream_headers = {
+            name: response.headers[name]
+            for name in ('Content-Type', 'Content-Length', 'Content-Range') if name in response.headers
+        }
+        if response.status_code == 416:
+            response.close()
+            return VideoStream(416, stream_headers, iter(()))
+
+        # Only a response from byte 0 can fill the head cache
+        size = _total_size(response)
+        fills_head = size is not None and (response.status_code == 200 or _range_start(response) == 0)
+        content_type = _content_type(response)
+        started = False
+
+        def chunks():
+            nonlocal started
+            started = True
+            first = True
+            head = bytearray()
+            body = _ReadAhead(lambda: response)
+            try:
+                for chunk in body:
+                    if first:
+                        VIDEO_FIRST_BYTE_SECONDS.labels('upstream').observe(time.perf_counter() - started)
+                        first = False
+                    if fills_head and len(head) < self.head_bytes:
+                        head += chunk[:self.head_bytes - len(head)]
+                        if len(head) == min(self.head_bytes, size):
+                            self._store_head(item_id, bytes(head), size, content_type)
+                    self._count('upstream_bytes_served', len(chunk))
+                    VIDEO_BYTES.labels('upstream').inc(len(chunk))
+                    yield chunk
+            finally:
+                body.close()
+
+        def close_unread():
+            # Once the body is being read, the read-ahead owns the response and closes it
+            if not started:
+                response.close()
+
+        return VideoStream(response.status_code, stream_headers, chunks(), close_unread)
+
+    def _remember_source(self, item_id: str, source: str):
+        with self._lock:
+            self._sources[item_id] = source
+            self._sources.move_to_end(item_id)
+            while len(self._sources) > MAX_TRACKED_CLIPS:
+                self._sources.popitem(last=False)
+
+    def record_startup(self, item_id: str, seconds: float):
+        """Record how long a display waited for a clip to start playing"""
+        with self._lock:
+            source = self._sources.get(item_id, 'unknown')
+            self._startups.append((item_id, source, seconds))
+        VIDEO_STARTUP_SECONDS.labels(source).observe(seconds)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            startups = list(self._startups)
+
+        by_source = {}
+        for _, source, seconds in startups:
+            by_source.setdefault(source, []).append(seconds)
+        stats['startup'] = {source: _summary(samples) for source, samples in by_source.items()}
+        stats['recent_startups'] = [
+            {'id': item_id, 'source': source, 'ms': round(seconds * 1000, 1)}
+            for item_id, source, seconds in startups[-20:]
+        ]
+        return {**self.disk_cache.stats(), **stats}
+
+
+def _resolve(byte_range: Optional[ByteRange], size: int) -> Tuple[int, int]:
+    """Turn a requested range into (start, stop) within a clip of size bytes"""
+    if byte_range is None:
+        return 0, size
+    start, stop = byte_range
+    if start < 0:
+        return max(0, size + start), size
+    return start, size if stop is None else min(stop, size)
+
+
+def _total_size(response: 'requests.Response') -> Optional[int]:
+    """Size of the whole clip from Content-Range, or Content-Length of a 200"""
+    if response.status_code == 206:
+        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get('Content-Length', '')
+    return int(length) if length.isdigit() else None
+
+
+def _range_start(response: 'requests.Response') -> Optional[int]:
+    first = response.headers.get('Content-Range', '').partition(' ')[2].partition('-')[0]
+    return int(first) if first.isdigit() else None
+
+
+def _content_type(response: 'requests.Response') -> str:
+    return response.headers.get('Content-Type', 'video/mp4').split(';')[0]
+
+
+def _summary(samples: List[float]) -> Dict:
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 1),
+        'p90_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))] * 1000, 1)
+    }